@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+
+"""Offline administration of the pycon state
+
+Description:    Offline administration of the pycon state
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import logging
+import sqlite3
+from argparse import ArgumentParser, Namespace
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pycon.handlers.persistence_handler import (
+    BASE_PATH,
+    PersistenceHandler,
+    PersistenceKind,
+    PersistenceMethod,
+)
+
+KIND_NAMES: Dict[str, PersistenceKind] = {
+    "channels": PersistenceKind.CHANNELS,
+    "prefixes": PersistenceKind.PREFIXES,
+    "users": PersistenceKind.USERS,
+}
+METHOD_NAMES: Dict[str, PersistenceMethod] = {method.value: method for method in PersistenceMethod}
+
+Entry = Tuple[Optional[str], Any]
+
+
+@dataclass
+class StreamStats:
+    """Counters of one streamed kind of state"""
+    read: int = 0
+    written: int = 0
+    invalid: int = 0
+    duplicates: int = 0
+    pruned: int = 0
+    changed: int = 0
+
+    def __str__(self) -> str:
+        return self.format()
+
+    def format(self, written: str = "written") -> str:
+        """Format the counters
+
+        Args:
+            written (str, optional): Name of the written counter, e.g. "checked" if nothing is
+                written. Defaults to "written".
+
+        Returns:
+            str: Counters as "name value" pairs
+        """
+        return ", ".join(
+            f"{written if name == 'written' else name} {value}"
+            for name, value in self.__dict__.items()
+        )
+
+
+def validate_entry(kind: PersistenceKind, key: Optional[str], value: Any) -> Optional[str]:
+    """Validate a single entry
+
+    Args:
+        kind (PersistenceKind): Kind of the entry
+        key (Optional[str]): Key of the entry
+        value (Any): Value of the entry
+
+    Returns:
+        Optional[str]: Reason why the entry is invalid, None if it is valid
+    """
+    if kind == PersistenceKind.USERS:
+        return None if isinstance(value, int) else "user ID is no number"
+    if not str(key).isdigit():
+        return "ID is no number"
+    if kind == PersistenceKind.PREFIXES:
+        return None if isinstance(value, str) and value.strip() else "prefix is empty"
+    if not isinstance(value, dict):
+        return "config is no object"
+    missing = {"authorized", "rcon", "port", "password", "type"} - set(value)
+    if missing:
+        return f"config misses {', '.join(sorted(missing))}"
+    if value["authorized"]:
+        if not value["rcon"]:
+            return "authorized channel has no host"
+        if not isinstance(value["port"], int) or not 0 < value["port"] < 65536:
+            return "authorized channel has an invalid port"
+    return None
+
+
+def is_stub(kind: PersistenceKind, value: Any) -> bool:
+    """Check whether an entry is an unauthorized channel stub without credentials
+
+    Args:
+        kind (PersistenceKind): Kind of the entry
+        value (Any): Value of the entry
+
+    Returns:
+        bool: True for channel stubs
+    """
+    return (
+        kind == PersistenceKind.CHANNELS and not value.get("authorized") and not value.get("rcon")
+    )
+
+
+def get_identity(kind: PersistenceKind, key: Optional[str], value: Any) -> Any:
+    """Get what identifies an entry for deduplication
+
+    Args:
+        kind (PersistenceKind): Kind of the entry
+        key (Optional[str]): Key of the entry
+        value (Any): Value of the entry
+
+    Returns:
+        Any: The user ID for authorized users, else the key
+    """
+    return value if kind == PersistenceKind.USERS else key
+
+
+class LastOccurrences:
+    """Positions of the last valid occurrence of every key in a stream of entries.
+
+    The positions are kept in a temporary SQLite database instead of a dict. SQLite holds its
+    pages in a bounded cache and spills the rest to a temporary file, so memory stays constant
+    however many unique keys the state has.
+    """
+    def __init__(self) -> None:
+        # An empty name opens a private database in a temporary file that is deleted on close
+        self._connection = sqlite3.connect("")
+        self._connection.execute(
+            "CREATE TABLE last (identity PRIMARY KEY, position INTEGER NOT NULL) WITHOUT ROWID"
+        )
+
+    def add(self, positions: Iterator[Tuple[Any, int]]) -> None:
+        """Record positions of keys, later positions of a key replace earlier ones
+
+        Args:
+            positions (Iterator[Tuple[Any, int]]): Identities and positions in stream order
+        """
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO last VALUES (?, ?)", positions)
+
+    def get(self, identity: Any) -> Optional[int]:
+        """Get the last position of a key
+
+        Args:
+            identity (Any): Identity of the entry, see get_identity
+
+        Returns:
+            Optional[int]: Last position, None if the key has no valid occurrence
+        """
+        row = self._connection.execute(
+            "SELECT position FROM last WHERE identity = ?", (identity,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def close(self) -> None:
+        """Close and delete the temporary database"""
+        self._connection.close()
+
+
+def find_last_occurrences(kind: PersistenceKind, entries: Iterator[Entry]) -> LastOccurrences:
+    """Find the position of the last valid occurrence of every key in a stream of entries
+
+    Args:
+        kind (PersistenceKind): Kind of the entries
+        entries (Iterator[Entry]): Source entries
+
+    Returns:
+        LastOccurrences: Identities of the entries mapped to their last position in the stream
+    """
+    last = LastOccurrences()
+    last.add(
+        (get_identity(kind, key, value), position)
+        for position, (key, value) in enumerate(entries)
+        if validate_entry(kind, key, value) is None
+    )
+    return last
+
+
+def process(
+    kind: PersistenceKind,
+    entries: Iterator[Entry],
+    stats: StreamStats,
+    last: LastOccurrences,
+    prune: bool = False,
+    edit: Optional[Callable[[Any], bool]] = None,
+    drop_invalid: bool = True,
+) -> Iterator[Entry]:
+    """Validate, deduplicate, prune and edit a stream of entries
+
+    Only the positions of the keys are remembered for deduplication, the entries themselves are
+    passed on one by one. Like with json.loads, which the bot uses, the last occurrence of a key
+    wins.
+
+    Args:
+        kind (PersistenceKind): Kind of the entries
+        entries (Iterator[Entry]): Source entries
+        stats (StreamStats): Counters that are updated while streaming
+        last (LastOccurrences): Last positions of the keys, see find_last_occurrences
+        prune (bool, optional): Drop unauthorized channel stubs. Defaults to False.
+        edit (Optional[Callable[[Any], bool]], optional): Function that edits a value in place
+            and returns whether it changed. Defaults to None.
+        drop_invalid (bool, optional): Drop invalid entries instead of passing them on unchanged.
+            Defaults to True.
+
+    Yields:
+        Entry: Processed entries
+    """
+    for position, (key, value) in enumerate(entries):
+        stats.read += 1
+        reason = validate_entry(kind, key, value)
+        if reason:
+            logging.warning("Invalid %s entry %s: %s", kind.value, key or value, reason)
+            stats.invalid += 1
+            if drop_invalid:
+                continue
+            stats.written += 1
+            yield key, value
+            continue
+        if last.get(get_identity(kind, key, value)) != position:
+            stats.duplicates += 1
+            continue
+        if prune and is_stub(kind, value):
+            stats.pruned += 1
+            continue
+        if edit is not None and edit(value):
+            stats.changed += 1
+        stats.written += 1
+        yield key, value
+
+
+def stream(
+    args: Namespace,
+    kind: PersistenceKind,
+    source: PersistenceMethod,
+    target: Optional[PersistenceMethod],
+    edit: Optional[Callable[[Any], bool]] = None,
+) -> StreamStats:
+    """Stream one kind of state from a source to a target method
+
+    The source is read twice: once to find the last occurrence of every key and once to stream
+    the entries. The last occurrences are kept in a temporary SQLite database, so memory does not
+    grow with the number of entries.
+
+    Args:
+        args (Namespace): Parsed arguments with base_path and prune
+        kind (PersistenceKind): Kind of state
+        source (PersistenceMethod): Method to read from
+        target (Optional[PersistenceMethod]): Method to write to, None to only validate
+        edit (Optional[Callable[[Any], bool]], optional): See process. Invalid entries are kept
+            while editing. Defaults to None.
+
+    Returns:
+        StreamStats: Counters of the stream
+    """
+    stats = StreamStats()
+    with closing(
+        find_last_occurrences(kind, PersistenceHandler.iter_entries(kind, source, args.base_path))
+    ) as last:
+        entries = process(
+            kind,
+            PersistenceHandler.iter_entries(kind, source, args.base_path),
+            stats,
+            last,
+            getattr(args, "prune", False),
+            edit,
+            drop_invalid=edit is None,
+        )
+        if target is None:
+            for _ in entries:
+                pass
+        else:
+            PersistenceHandler.write_entries(kind, entries, target, args.base_path)
+    return stats
+
+
+def command_migrate(args: Namespace) -> None:
+    """Copy state from one persistence method to another
+
+    Args:
+        args (Namespace): Parsed arguments
+    """
+    for kind_name in args.kinds:
+        stats = stream(args, KIND_NAMES[kind_name], args.source, args.target)
+        print(f"{kind_name}: {stats}")
+
+
+def command_validate(args: Namespace) -> None:
+    """Report invalid and duplicate entries without changing anything
+
+    Args:
+        args (Namespace): Parsed arguments
+    """
+    for kind_name in args.kinds:
+        stats = stream(args, KIND_NAMES[kind_name], args.method, None)
+        print(f"{kind_name}: {stats.format(written='checked')}")
+
+
+def command_prune(args: Namespace) -> None:
+    """Remove unauthorized channel stubs, invalid and duplicate entries in place
+
+    Args:
+        args (Namespace): Parsed arguments
+    """
+    args.prune = True
+    for kind_name in args.kinds:
+        stats = stream(args, KIND_NAMES[kind_name], args.method, args.method)
+        print(f"{kind_name}: {stats}")
+
+
+def command_rotate_password(args: Namespace) -> None:
+    """Set a new password for every channel pointing at a host
+
+    Args:
+        args (Namespace): Parsed arguments
+    """
+    def edit(config: Dict[str, Any]) -> bool:
+        if config["rcon"] != args.host or (args.port and config["port"] != args.port):
+            return False
+        config["password"] = args.password
+        return True
+
+    stats = stream(args, PersistenceKind.CHANNELS, args.method, args.method, edit)
+    print(f"channels: {stats}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> Namespace:
+    """Get the argparse Namespace of pycon-admin
+
+    Args:
+        argv (Optional[List[str]], optional): Arguments. Defaults to sys.argv.
+
+    Returns:
+        Namespace: argparse.Namespace with defined arguments from the commandline
+    """
+    parser = ArgumentParser(
+        prog="pycon-admin",
+        description="Bulk import, export, migration and editing of the pycon state. "
+        "Stop the bot before editing its state, since it overwrites the state on shutdown.",
+    )
+    parser.add_argument("--base-path", type=Path, default=BASE_PATH)
+    parser.add_argument("--loglevel", type=str, default="WARNING")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_kinds(subparser: ArgumentParser) -> None:
+        subparser.add_argument(
+            "--kind",
+            dest="kinds",
+            action="append",
+            choices=list(KIND_NAMES),
+            help="Kind of state to process. Can be repeated. Defaults to all kinds.",
+        )
+
+    migrate = subparsers.add_parser("migrate", help="Copy state between persistence methods")
+    migrate.add_argument("--from", dest="source", choices=list(METHOD_NAMES), required=True)
+    migrate.add_argument("--to", dest="target", choices=list(METHOD_NAMES), required=True)
+    migrate.add_argument("--prune", action="store_true", help="Drop unauthorized channel stubs")
+    add_kinds(migrate)
+    migrate.set_defaults(handler=command_migrate)
+
+    validate = subparsers.add_parser("validate", help="Report invalid and duplicate entries")
+    validate.add_argument("--method", choices=list(METHOD_NAMES), default="json")
+    add_kinds(validate)
+    validate.set_defaults(handler=command_validate)
+
+    prune = subparsers.add_parser("prune", help="Remove stubs, invalid and duplicate entries")
+    prune.add_argument("--method", choices=list(METHOD_NAMES), default="json")
+    add_kinds(prune)
+    prune.set_defaults(handler=command_prune)
+
+    rotate = subparsers.add_parser(
+        "rotate-password", help="Set a new password for every channel pointing at a host"
+    )
+    rotate.add_argument("--method", choices=list(METHOD_NAMES), default="json")
+    rotate.add_argument("--host", required=True)
+    rotate.add_argument("--port", type=int, default=None)
+    rotate.add_argument("--password", required=True)
+    rotate.set_defaults(handler=command_rotate_password)
+
+    args = parser.parse_args(argv)
+    args.kinds = getattr(args, "kinds", None) or list(KIND_NAMES)
+    for name in ("source", "target", "method"):
+        if hasattr(args, name):
+            setattr(args, name, METHOD_NAMES[getattr(args, name)])
+    return args
+
+
+def main(argv: Optional[List[str]] = None):
+    """pycon-admin main method
+
+    Args:
+        argv (Optional[List[str]], optional): Arguments. Defaults to sys.argv.
+    """
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.getLevelName(args.loglevel.upper()))
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
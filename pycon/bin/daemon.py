@@ -9,12 +9,23 @@ Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
                 via any medium is strictly prohibited.
 """
 
+from __future__ import annotations
+
+import importlib
 import logging
 import signal
-from typing import List
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
 
 from pycon.client.argument_parser import parse_args
-from pycon.client.client import PyconClient
+from pycon.client.startup_profile import StartupProfile
+
+if TYPE_CHECKING:
+    from pycon.client.client import PyconClient
+
+# Heavy modules, imported only after the arguments are valid. Listed separately so that the startup
+# profile shows the cost of each of them.
+LAZY_MODULES = ("aiohttp", "discord", "pycon.client.client")
 
 
 def setup_logging(loglevel: str):
@@ -39,24 +50,55 @@ def setup_signal_handlers(pycon_client: PyconClient):
     signal.signal(signal.SIGTERM, pycon_client.handle_signal)
 
 
-def setup_client(token: str, servers: List[str]):
+def setup_client(
+    token: str,
+    servers: List[str],
+    profile: Optional[StartupProfile] = None,
+    slash_only: bool = False,
+    trace_path: Optional[Path] = None,
+):
     """Setup the Pycon Client
 
     Args:
         token (str): Token of the Bot. Get this from https://discord.com/developers
         servers (List[str]): List of guilds
+        profile (Optional[StartupProfile], optional): Profile that records the startup phases and
+            is printed once the bot is ready. Defaults to None.
+        slash_only (bool, optional): Only serve slash commands and DMs. Defaults to False.
+        trace_path (Optional[Path], optional): File to record a trace to. Defaults to None.
     """
+    timer = profile if profile is not None else StartupProfile()
+    for module in LAZY_MODULES:
+        with timer.phase(f"import {module}"):
+            importlib.import_module(module)
+    from pycon.client.client import PyconClient  # pylint: disable=import-outside-toplevel
+
     logging.info("Setting up Pycon Client")
-    pycon_client: PyconClient = PyconClient(token=token, servers=servers)
+    with timer.phase("client init"):
+        pycon_client: PyconClient = PyconClient(
+            token=token,
+            servers=servers,
+            profile=profile,
+            slash_only=slash_only,
+            trace_path=trace_path,
+        )
     setup_signal_handlers(pycon_client)
     pycon_client.start_client()
 
 
 def main():
     """Pycon main method"""
-    args = parse_args()
+    profile = StartupProfile()
+    with profile.phase("parse arguments"):
+        args = parse_args()
     setup_logging(args.loglevel)
-    setup_client(args.token, args.servers)
+    setup_client(
+        args.token,
+        args.servers,
+        profile if args.startup_profile else None,
+        args.slash_only,
+        args.record_trace,
+    )
 
 
 if __name__ == "__main__":
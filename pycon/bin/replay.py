@@ -0,0 +1,474 @@
+#!/usr/bin/python3
+
+"""Replay of recorded pycon traffic
+
+Description:    Replay of recorded pycon traffic against local fake RCON servers
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from pycon.handlers.trace_handler import (
+    COMMAND,
+    DROPPED,
+    MESSAGE_EVENT,
+    RCON,
+    RCON_EVENT,
+    REDACTED_PREFIX,
+    read_trace,
+)
+
+# Same as pycon.handlers.persistence_handler.DATA_DIR_VAR, which has to be set before that module
+# is imported
+DATA_DIR_VAR = "PYCON_DATA_DIR"
+REPLAY_USER_ID = 1
+REPLAY_PASSWORD = "replay"
+FIRST_CHANNEL_ID = 1000
+FIRST_GUILD_ID = 100
+# Commands that only read state and are therefore replayed; their arguments are not in the trace
+REPLAYED_COMMANDS = {"help", "stats", "audit"}
+DEFAULT_RCON_COMMAND = "say"
+SOURCE_PACKET_SIZE = 4096
+# Key of the recorded server latencies in the report, next to the kinds of messages
+SERVER = "server"
+METRICS = ("count", "errors", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+
+
+@dataclass
+class FakeUser:
+    """User that sends all replayed messages"""
+
+    id: int = REPLAY_USER_ID
+    name: str = "replay"
+    roles: List[Any] = field(default_factory=list)
+
+    @property
+    def mention(self) -> str:
+        """str: Mention of the user"""
+        return f"<@{self.id}>"
+
+    def __str__(self) -> str:
+        return self.name
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> None:
+        """Drop a direct message"""
+
+
+@dataclass
+class FakeGuild:
+    """Guild of replayed messages"""
+
+    id: int
+    owner_id: int = REPLAY_USER_ID
+    name: str = "replay"
+
+    def get_role(self, role_id: int) -> None:
+        """Roles are not replayed"""
+        return None
+
+    def get_member(self, member_id: int) -> None:
+        """Members are not replayed"""
+        return None
+
+
+@dataclass
+class FakeChannel:
+    """Channel that counts what the bot sends"""
+
+    id: int
+    guild: Optional[FakeGuild]
+    name: str = ""
+    sent: int = 0
+    sent_bytes: int = 0
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> None:
+        """Count a message instead of sending it"""
+        self.sent += 1
+        self.sent_bytes += len(content or "")
+
+
+@dataclass
+class FakeMessage:
+    """Replayed message"""
+
+    content: str
+    channel: FakeChannel
+    guild: Optional[FakeGuild]
+    author: FakeUser
+    id: int = 0
+    mentions: List[Any] = field(default_factory=list)
+    role_mentions: List[Any] = field(default_factory=list)
+    channel_mentions: List[Any] = field(default_factory=list)
+
+
+class FakeRCONServer:
+    """Source RCON server that answers with the recorded response sizes and latencies
+
+    Args:
+        responses (Deque[Tuple[float, int]]): Recorded latencies in milliseconds and response
+            sizes, in the order the commands were sent
+        speed (float): Replay speed, 0 answers without delay
+    """
+
+    def __init__(self, responses: Deque[Tuple[float, int]], speed: float) -> None:
+        self._responses = responses
+        self._speed = speed
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.StreamWriter, "asyncio.Task[None]"] = {}
+        self.port = 0
+
+    async def start(self) -> None:
+        """Listen on a free local port"""
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        """Stop listening and close the open connections"""
+        if self._server is not None:
+            self._server.close()
+        tasks = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        def send(request_id: int, response_type: int, body: bytes) -> None:
+            payload = struct.pack("<ii", request_id, response_type) + body + b"\0\0"
+            writer.write(struct.pack("<i", len(payload)) + payload)
+
+        task = asyncio.current_task()
+        if task is not None:
+            self._connections[writer] = task
+        try:
+            while True:
+                size = struct.unpack("<i", await reader.readexactly(4))[0]
+                packet = await reader.readexactly(size)
+                request_id, request_type = struct.unpack_from("<ii", packet)
+                if request_type == 3:
+                    send(request_id, 2, b"")
+                elif request_type == 2:
+                    latency, response_size = (
+                        self._responses.popleft() if self._responses else (0.0, 0)
+                    )
+                    if self._speed:
+                        await asyncio.sleep(latency / 1000 / self._speed)
+                    body = b"x" * response_size
+                    for offset in range(0, max(response_size, 1), SOURCE_PACKET_SIZE):
+                        send(request_id, 0, body[offset : offset + SOURCE_PACKET_SIZE])
+                else:
+                    send(request_id, 0, b"")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+
+@dataclass
+class Replay:
+    """Messages and fake servers built from a trace"""
+
+    messages: List[Tuple[float, str, FakeMessage]] = field(default_factory=list)
+    channels: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    servers: List[FakeRCONServer] = field(default_factory=list)
+    recorded: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+    skipped: int = 0
+
+
+def build_replay(trace: Path, speed: float) -> Replay:
+    """Turn the events of a trace into messages and fake servers
+
+    Args:
+        trace (Path): Trace written by TraceRecorder
+        speed (float): Replay speed, 0 replays without delays
+
+    Returns:
+        Replay: Messages sorted by time, fake servers and configs of the authorized channels
+    """
+    replay = Replay()
+    user = FakeUser()
+    guilds: Dict[Optional[str], FakeGuild] = {}
+    channels: Dict[str, FakeChannel] = {}
+    responses: Dict[str, Deque[Tuple[float, int]]] = defaultdict(deque)
+    types: Dict[str, str] = {}
+    events = sorted(read_trace(trace), key=lambda event: event["t"])
+
+    def get_channel(name: str, guild_name: Optional[str]) -> FakeChannel:
+        if name not in channels:
+            if guild_name not in guilds and guild_name is not None:
+                guilds[guild_name] = FakeGuild(FIRST_GUILD_ID + len(guilds))
+            guild = guilds.get(guild_name)
+            channels[name] = FakeChannel(FIRST_CHANNEL_ID + len(channels), guild, name)
+        return channels[name]
+
+    for event in events:
+        if event["e"] == RCON_EVENT:
+            responses[event["c"]].append((event["ms"], event["size"]))
+            types[event["c"]] = event["type"]
+            replay.recorded[SERVER].append(event["ms"])
+            continue
+        if event["e"] != MESSAGE_EVENT:
+            continue
+        replay.recorded[event["k"]].append(event["ms"])
+        channel = get_channel(event["c"], event["g"])
+        command = event["cmd"]
+        if event["k"] == DROPPED:
+            content = "x" * max(event["len"], 1)
+        elif event["k"] == RCON:
+            if not command or command.startswith(REDACTED_PREFIX):
+                command = DEFAULT_RCON_COMMAND
+            content = " ".join([command] + ["x"] * event["argc"])
+        elif event["k"] == COMMAND and command in REPLAYED_COMMANDS:
+            content = f"r!{command}"
+        else:
+            replay.skipped += 1
+            continue
+        message = FakeMessage(content, channel, channel.guild, user, id=len(replay.messages))
+        replay.messages.append((event["t"], event["k"], message))
+
+    from pycon.handlers.transport_handler import (  # pylint: disable=import-outside-toplevel
+        SourceTransport,
+        get_transport,
+    )
+
+    for name, channel_responses in responses.items():
+        server = FakeRCONServer(channel_responses, speed)
+        replay.servers.append(server)
+        server_type = types.get(name, "")
+        # All fake servers speak Source RCON
+        if not issubclass(get_transport(server_type), SourceTransport):
+            server_type = "source"
+        replay.channels[name] = {
+            "authorized": True,
+            "rcon": "127.0.0.1",
+            "port": 0,
+            "password": REPLAY_PASSWORD,
+            "type": server_type,
+            "id": get_channel(name, None).id,
+        }
+    return replay
+
+
+def percentile(values: List[float], share: float) -> float:
+    """Get a percentile by the nearest-rank method
+
+    Args:
+        values (List[float]): Sorted values
+        share (float): Percentile between 0 and 1
+
+    Returns:
+        float: Percentile, 0 for no values
+    """
+    if not values:
+        return 0.0
+    return values[max(math.ceil(share * len(values)) - 1, 0)]
+
+
+def summarize(latencies: List[float], errors: int = 0) -> Dict[str, float]:
+    """Summarize latencies in milliseconds
+
+    Args:
+        latencies (List[float]): Latencies in milliseconds
+        errors (int, optional): Number of failed messages. Defaults to 0.
+
+    Returns:
+        Dict[str, float]: Values of METRICS
+    """
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.5), 3),
+        "p95_ms": round(percentile(values, 0.95), 3),
+        "p99_ms": round(percentile(values, 0.99), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0,
+    }
+
+
+async def run_replay(args: Namespace) -> Dict[str, Any]:
+    """Replay a trace through PyconClient.on_message
+
+    Args:
+        args (Namespace): Parsed arguments with trace and speed
+
+    Returns:
+        Dict[str, Any]: Report with throughput and latencies per kind of message
+    """
+    replay = build_replay(args.trace, args.speed)
+    for server in replay.servers:
+        await server.start()
+
+    # pylint: disable=import-outside-toplevel
+    from pycon.client.client import PyconClient
+    from pycon.handlers.persistence_handler import BASE_PATH, SYS_AUTH_FILE, PersistenceHandler
+
+    BASE_PATH.mkdir(parents=True, exist_ok=True)
+    PersistenceHandler.save_auth_channels(
+        {
+            f"{config['id']}": {
+                **{key: value for key, value in config.items() if key != "id"},
+                "port": server.port,
+            }
+            for config, server in zip(replay.channels.values(), replay.servers)
+        }
+    )
+    PersistenceHandler.save_prefixes({})
+    with open(SYS_AUTH_FILE, "w", encoding="utf-8") as users_file:
+        json.dump([REPLAY_USER_ID], users_file)
+
+    client = PyconClient(token="replay")
+    await client._load_state()  # pylint: disable=protected-access
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+
+    async def deliver(offset: float, kind: str, message: FakeMessage) -> None:
+        if args.speed:
+            await asyncio.sleep(max(offset / args.speed - (time.perf_counter() - start), 0))
+        sent = time.perf_counter()
+        try:
+            await client.on_message(message)
+        except Exception as err:  # pylint: disable=broad-except
+            logging.debug("Replayed message %d failed: %s", message.id, err)
+            errors[kind] += 1
+        latencies[kind].append((time.perf_counter() - sent) * 1000)
+
+    first = replay.messages[0][0] if replay.messages else 0.0
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(deliver(offset - first, kind, message) for offset, kind, message in replay.messages)
+    )
+    duration = time.perf_counter() - start
+    client._cleanup()  # pylint: disable=protected-access
+    for server in replay.servers:
+        await server.close()
+
+    try:
+        pycon_version = version("pycon")
+    except PackageNotFoundError:
+        pycon_version = "unknown"
+    return {
+        "pycon": pycon_version,
+        "trace": str(args.trace),
+        "speed": args.speed,
+        "messages": len(replay.messages),
+        "skipped": replay.skipped,
+        "duration_s": round(duration, 3),
+        "throughput_per_s": round(len(replay.messages) / duration, 3) if duration else 0.0,
+        "kinds": {kind: summarize(values, errors[kind]) for kind, values in latencies.items()},
+        "recorded": {kind: summarize(values) for kind, values in replay.recorded.items()},
+    }
+
+
+def command_run(args: Namespace) -> None:
+    """Replay a trace and print or write the report
+
+    Args:
+        args (Namespace): Parsed arguments
+    """
+    data_dir = tempfile.mkdtemp(prefix="pycon-replay-")
+    os.environ[DATA_DIR_VAR] = data_dir
+    try:
+        report = asyncio.run(run_replay(args))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n", encoding="utf-8")
+    print(output)
+
+
+def command_compare(args: Namespace) -> None:
+    """Print the differences between two reports
+
+    Args:
+        args (Namespace): Parsed arguments
+    """
+    base = json.loads(args.base.read_text(encoding="utf-8"))
+    new = json.loads(args.new.read_text(encoding="utf-8"))
+    if base.get("trace") != new.get("trace") or base.get("speed") != new.get("speed"):
+        print("Warning: the reports were made with different traces or speeds", file=sys.stderr)
+    print(f"{'':24} {base['pycon']:>12} {new['pycon']:>12} {'change':>9}")
+    rows = [("throughput_per_s", base["throughput_per_s"], new["throughput_per_s"])]
+    for kind in sorted(set(base["kinds"]) | set(new["kinds"])):
+        for metric in METRICS:
+            rows.append(
+                (
+                    f"{kind} {metric}",
+                    base["kinds"].get(kind, {}).get(metric, 0),
+                    new["kinds"].get(kind, {}).get(metric, 0),
+                )
+            )
+    for name, old_value, new_value in rows:
+        change = f"{(new_value - old_value) / old_value * 100:+.1f}%" if old_value else "-"
+        print(f"{name:24} {old_value:>12} {new_value:>12} {change:>9}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> Namespace:
+    """Get the argparse Namespace of pycon-replay
+
+    Args:
+        argv (Optional[List[str]], optional): Arguments. Defaults to sys.argv.
+
+    Returns:
+        Namespace: argparse.Namespace with defined arguments from the commandline
+    """
+    parser = ArgumentParser(
+        prog="pycon-replay",
+        description="Replay a trace recorded with pycon --record-trace against local fake RCON "
+        "servers and compare the reports of two pycon versions.",
+    )
+    parser.add_argument("--loglevel", type=str, default="WARNING")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Replay a trace")
+    run.add_argument("trace", type=Path)
+    run.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Replay speed: 1 replays in real time, 10 ten times faster, 0 without any delays",
+    )
+    run.add_argument("--output", type=Path, default=None, help="File to write the report to")
+    run.set_defaults(handler=command_run)
+
+    compare = subparsers.add_parser("compare", help="Compare two reports")
+    compare.add_argument("base", type=Path)
+    compare.add_argument("new", type=Path)
+    compare.set_defaults(handler=command_compare)
+
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    """pycon-replay main method
+
+    Args:
+        argv (Optional[List[str]], optional): Arguments. Defaults to sys.argv.
+    """
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.getLevelName(args.loglevel.upper()))
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
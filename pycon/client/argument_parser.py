@@ -9,6 +9,7 @@ Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
 
 import os
 from argparse import ArgumentParser, Namespace
+from pathlib import Path
 from typing import List
 
 TOKEN_VAR = "PYCON_BOT_TOKEN"
@@ -27,8 +28,30 @@ def parse_args() -> Namespace:
     parser: ArgumentParser = ArgumentParser()
 
     parser.add_argument("--token", "-t", type=str, default=None)
-    parser.add_argument("--servers", type=List[str], default=None)
+    parser.add_argument(
+        "--servers",
+        nargs="*",
+        default=None,
+        help="IDs of the guilds the bot answers in. Defaults to all guilds.",
+    )
     parser.add_argument("--loglevel", type=str, default="INFO")
+    parser.add_argument(
+        "--slash-only",
+        action="store_true",
+        help="Only serve slash commands and DMs, without the privileged message content intent",
+    )
+    parser.add_argument(
+        "--record-trace",
+        type=Path,
+        default=None,
+        metavar="PATH",
+        help="Record an anonymised trace of messages and RCON calls for pycon-replay",
+    )
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="Print how long imports and each init phase took, once the bot is ready",
+    )
 
     args = parser.parse_args()
 
@@ -39,7 +62,9 @@ def parse_args() -> Namespace:
         args.token: str = token
 
     if not args.servers:
-        args.servers: List[str] = os.getenv(SERVERS_VAR, "").strip().split(" ")
+        args.servers: List[str] = os.getenv(SERVERS_VAR, "").replace(",", " ").split()
+    else:
+        args.servers: List[str] = " ".join(args.servers).replace(",", " ").split()
 
     args.loglevel: str = args.loglevel.upper()
 
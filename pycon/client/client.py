@@ -9,19 +9,34 @@ Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import signal
 import socket
 import sys
-from typing import Any, Callable, Dict, List
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import discord
-from rcon.source import Client as RCONClient
 
+from pycon.client.startup_profile import StartupProfile
+from pycon.handlers.audit_handler import AuditHandler
 from pycon.handlers.auth_handler import ChannelAuthHandler
+from pycon.handlers.broadcast_handler import BroadcastHandler
 from pycon.handlers.command_handler import CommandAuthStage, CommandContext, CommandHandler
-from pycon.handlers.persistence_handler import PersistenceHandler
+from pycon.handlers.dns_handler import DNSResolver
+from pycon.handlers.health_handler import ServerUnavailableError
+from pycon.handlers.journal_handler import JournalHandler
+from pycon.handlers.permission_handler import PermissionHandler
+from pycon.handlers.persistence_handler import BASE_PATH, PersistenceHandler
+from pycon.handlers.rcon_handler import RCONHandler
+from pycon.handlers.schedule_handler import ScheduleHandler
+from pycon.handlers.slash_handler import AutocompleteCache, SlashHandler
+from pycon.handlers.stats_handler import StatsHandler
 from pycon.handlers.system_handler import SystemHandler
+from pycon.handlers.trace_handler import AUTH, COMMAND, DROPPED, IGNORED, RCON, TraceRecorder
+from pycon.handlers.transport_handler import AuthenticationError
 
 DEFAULT_PREFIX = "r!"
 
@@ -29,20 +44,71 @@ DEFAULT_PREFIX = "r!"
 class PyconClient(discord.Client):
     """Pycon Bot Client Class
 
+    The persisted state is loaded in parallel to the gateway login. Until it is loaded, the
+    handlers hold empty containers that are filled in place, and nothing is saved on shutdown.
+
     Args:
         token (str): Token for the Discord Bot
         servers (List[str]): List of guilds
+        profile (Optional[StartupProfile], optional): Profile of the startup phases, printed once
+            the bot is ready. Defaults to None.
+        slash_only (bool, optional): Only serve slash commands and DMs. Guild messages are not
+            received at all, so the privileged message content intent is not needed.
+            Defaults to False.
+        trace_path (Optional[Path], optional): File to record an anonymised trace of messages and
+            RCON calls to. Defaults to None, which records nothing.
     """
-    def __init__(self, token: str, servers: List[str] = None) -> None:
-        intents = discord.Intents.default()
-        intents.message_content = True
+    def __init__(
+        self,
+        token: str,
+        servers: List[str] = None,
+        profile: Optional[StartupProfile] = None,
+        slash_only: bool = False,
+        trace_path: Optional[Path] = None,
+    ) -> None:
+        # Only subscribe to the events the bot handles, to keep inbound gateway traffic low
+        intents = discord.Intents.none()
+        intents.guilds = True
+        intents.guild_messages = not slash_only
+        intents.dm_messages = True
+        intents.message_content = not slash_only
         super().__init__(intents=intents)
+        self.__slash_only = slash_only
         self.__token = token
         self.__servers = servers if servers else []
-        self.__authorized_channels: Dict[str, Any] = PersistenceHandler.get_auth_channels()
+        self.__guild_ids: Set[int] = PyconClient._parse_guild_ids(self.__servers)
+        self.__profile = profile
+        self.__state_loaded = False
+        self.__ready_start = time.perf_counter()
+        self.__authorized_channels: Dict[str, Any] = {}
+        self.__active_channels: Set[int] = set()
         self.__open_auths: Dict[int, Dict[Any]] = {}
-        self.__prefixes: Dict[int, str] = PersistenceHandler.get_prefixes()
-        self.__command_handler = CommandHandler()
+        self.__prefixes: Dict[int, str] = {}
+        self.__resolver = DNSResolver()
+        self.__rcon_handler = RCONHandler(self.__resolver)
+        self.__audit_handler = AuditHandler()
+        self.__permission_handler = PermissionHandler({}, [])
+        broadcast_handler = BroadcastHandler(
+            self.__authorized_channels,
+            self.__rcon_handler,
+            self.__permission_handler,
+            self.__audit_handler,
+        )
+        self.__journal_handler = JournalHandler(
+            self.__authorized_channels, self.__permission_handler
+        )
+        self.__autocomplete = AutocompleteCache()
+        self.__stats_handler = StatsHandler(
+            self.__authorized_channels,
+            self.__rcon_handler,
+            on_response=lambda channel_id, creds, command, response: self.__autocomplete.observe(
+                int(channel_id), creds, command, response
+            ),
+        )
+        self.__schedule_handler = ScheduleHandler(
+            self.__authorized_channels, self.__rcon_handler, self.__permission_handler, {}
+        )
+        self.__command_handler = CommandHandler(self.__permission_handler.check)
         self.__command_handler.add_commands([
             (
                 "set-prefix",
@@ -64,11 +130,97 @@ class PyconClient(discord.Client):
             ),
             (
                 "restart",
-                SystemHandler(self.__authorized_channels).handle_sys_command,
+                SystemHandler(
+                    self.__authorized_channels, self.__permission_handler, self.__audit_handler
+                ).handle_sys_command,
                 "Restart the authorized server of this channel",
                 CommandAuthStage.BOSS
             ),
+            (
+                "broadcast",
+                broadcast_handler.handle_broadcast,
+                "Send an RCON command to all authorized servers of this guild "
+                "(use -g GROUP to limit it to a group)",
+                CommandAuthStage.HITMAN
+            ),
+            (
+                "set-group",
+                broadcast_handler.handle_set_group,
+                "Assign the authorized server of this channel to a broadcast group",
+                CommandAuthStage.HITMAN
+            ),
+            (
+                "console",
+                self.__journal_handler.handle_console,
+                "Stream the server's journal into this channel (console on [CATEGORIES] | off)",
+                CommandAuthStage.BOSS
+            ),
+            (
+                "schedule",
+                self.__schedule_handler.handle_schedule,
+                "Run an RCON command regularly (schedule add INTERVAL COMMAND | list | remove ID)",
+                CommandAuthStage.HITMAN
+            ),
+            (
+                "stats",
+                self.__stats_handler.handle_stats,
+                "Show player count, latency and availability of this server (stats [WINDOW])",
+                CommandAuthStage.CROOK
+            ),
+            (
+                "set-role",
+                self.__permission_handler.handle_set_role,
+                "Grant an auth stage to roles (set-role crook|hitman|boss|none @ROLE)",
+                CommandAuthStage.BOSS
+            ),
+            (
+                "audit",
+                self.__audit_handler.handle_audit,
+                "Search executed commands "
+                "(audit [user=@USER] [server=#CHANNEL] [command=NAME] [since=7d] [until=DATE])",
+                CommandAuthStage.BOSS
+            ),
         ])
+        self.__trace: Optional[TraceRecorder] = TraceRecorder(
+            trace_path, [command.name for command in self.__command_handler.commands]
+        ) if trace_path else None
+        self.__slash_handler = SlashHandler(
+            self,
+            self.__command_handler,
+            self.__authorized_channels,
+            self.__autocomplete,
+            self._handle_slash_command,
+            self.handle_rcon,
+            self.__guild_ids,
+        )
+        self.__slash_handler.setup()
+        self.__sync_task: Optional[asyncio.Task] = None
+
+    async def login(self, token: str) -> None:
+        """Log in with the token while the persisted state is loaded, then start the handlers.
+
+        discord.Client.login calls setup_hook, so the handlers are not started there: they would
+        run before their containers are filled.
+
+        Args:
+            token (str): Token for the Discord Bot
+        """
+        start = time.perf_counter()
+        await asyncio.gather(self._timed_login(token), self._load_state())
+        self._profile("login and state", start)
+        self._start_handlers()
+
+    def _start_handlers(self) -> None:
+        """Start the background tasks of the handlers before the gateway connection"""
+        start = time.perf_counter()
+        self.__resolver.start()
+        self.__audit_handler.start()
+        self.__stats_handler.start()
+        self.__schedule_handler.start(self.get_channel)
+        # Syncing the slash commands must not delay the gateway connection
+        self.__sync_task = asyncio.get_running_loop().create_task(self.__slash_handler.sync())
+        self._profile("start handlers", start)
+        self.__ready_start = time.perf_counter()
 
     async def on_ready(self):
         """Gets Called when the Bot is ready"""
@@ -79,55 +231,128 @@ class PyconClient(discord.Client):
             f"client_id={client_id}&scope=bot"
         )
         logging.info("Use %s to invite the bot to your server!", invite_link)
+        self.__journal_handler.resume(self.get_channel)
+        if self.__profile is not None:
+            self._profile("gateway connect", self.__ready_start)
+            self.__profile.print()
+            self.__profile = None
         await self.change_presence(
             activity=discord.Activity(
                 type=discord.ActivityType.playing,
-                name=f"with yo mamas ballz lol | {DEFAULT_PREFIX}help"
+                name="with yo mamas ballz lol | "
+                f"{'/' if self.__slash_only else DEFAULT_PREFIX}help"
             )
         )
 
 
+    async def on_guild_role_create(self, role: discord.Role):
+        """Gets Called when a role is created"""
+        self.__permission_handler.invalidate(role.guild.id)
+
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        """Gets Called when a role is changed"""
+        self.__permission_handler.invalidate(after.guild.id)
+
+    async def on_guild_role_delete(self, role: discord.Role):
+        """Gets Called when a role is deleted"""
+        self.__permission_handler.invalidate(role.guild.id)
+
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
+        """Gets Called when a guild is changed, e.g. its owner"""
+        self.__permission_handler.invalidate(after.id)
+
     async def on_message(self, message: discord.Message):
         """Gets Called on message"""
+        start = time.perf_counter()
+        length = len(message.content)
+        kind, handler, ctx = self._route_message(message)
+        try:
+            if handler is not None:
+                await self._run_handler(handler, ctx)
+        finally:
+            if self.__trace is not None:
+                self.__trace.message(
+                    message.channel.id,
+                    message.guild.id if message.guild else None,
+                    kind,
+                    length,
+                    start,
+                    ctx.command if ctx else "",
+                    len(ctx.args) if ctx else 0,
+                )
+
+    def _route_message(
+        self, message: discord.Message
+    ) -> Tuple[str, Optional[Callable], Optional[CommandContext]]:
+        """Decide which handler a message goes to
+
+        Args:
+            message (discord.Message): Received message
+
+        Returns:
+            Tuple[str, Optional[Callable], Optional[CommandContext]]: Kind of the message as
+                recorded in traces, its handler and the command context, if it has a handler
+        """
+        # Fast path: drop messages that can't concern the bot after a few set lookups
+        guild = message.guild
+        if guild is not None and self.__guild_ids and guild.id not in self.__guild_ids:
+            return DROPPED, None, None
+        if message.channel.id not in self.__active_channels and (
+            guild is not None or message.author.id not in self.__open_auths
+        ):
+            prefix = self.__prefixes.get(guild.id, DEFAULT_PREFIX) if guild else DEFAULT_PREFIX
+            if not message.content.startswith(prefix) and not message.content[:1].isspace():
+                return DROPPED, None, None
         if message.author == self.user:
-            return
+            return IGNORED, None, None
         logging.debug(
             "Got message from %s (%d): %s",
             message.author,
             message.author.id,
             message.content
         )
-        prefix = self.get_prefix_for_server(message.channel.guild)
+        prefix = self.get_prefix_for_server(guild)
         message.content = message.content.strip()
+        kind: str = IGNORED
         handler: Callable = None
         auth_channel: Dict[str, Any] = self.__authorized_channels.get(f"{message.channel.id}")
 
         if message.content.startswith(prefix):
             message.content = message.content[len(prefix):]
-            handler = self.__command_handler.handle_command
+            kind, handler = COMMAND, self.__command_handler.handle_command
         elif auth_channel:
             if auth_channel["authorized"]:
                 # Set this prefix for rcon commands
                 # prefix = auth_channel["prefix"]
-                handler = self.handle_rcon
-        elif not isinstance(message.channel, discord.channel.DMChannel) and not auth_channel:
-            # Create entry in channels if not already done
-            self.__authorized_channels[f"{message.channel.id}"] = self._basic_channel_auth()
-        elif self.__open_auths.get(message.author.id):
-            handler = ChannelAuthHandler(
-                self.__open_auths, self.__authorized_channels
+                kind, handler = RCON, self.handle_rcon
+        elif guild is None and self.__open_auths.get(message.author.id):
+            kind, handler = AUTH, ChannelAuthHandler(
+                self.__open_auths, self.__authorized_channels, self.__rcon_handler
             ).handle_auth
 
-        if not handler is None:
-            content_list: List[str] = message.content.split(" ")
-            command: str = content_list[0] if content_list else ""
-            args: List[str] = content_list[1:] if len(content_list) > 1 else []
-            ctx: CommandContext = CommandContext(prefix, command, args, message)
-            try:
-                await handler(ctx)
-            except Exception:
-                await ctx.message.channel.send("I'm sorry, something bad happend on my end :(")
-                raise
+        if handler is None:
+            return kind, None, None
+        content_list: List[str] = message.content.split(" ")
+        command: str = content_list[0] if content_list else ""
+        args: List[str] = content_list[1:] if len(content_list) > 1 else []
+        return kind, handler, CommandContext(prefix, command, args, message)
+
+    async def _run_handler(self, handler: Callable, ctx: CommandContext) -> None:
+        """Run the handler of a message
+
+        Args:
+            handler (Callable): Handler chosen by _route_message
+            ctx (CommandContext): Command context of the message
+        """
+        try:
+            await handler(ctx)
+        except Exception:
+            await ctx.message.channel.send("I'm sorry, something bad happend on my end :(")
+            raise
+        finally:
+            if handler != self.handle_rcon:
+                # Commands and authentications are the only way to (de)authorize channels
+                self._refresh_active_channels()
 
     def start_client(self) -> None:
         """Start the Bot and all listeners"""
@@ -159,7 +384,9 @@ class PyconClient(discord.Client):
             await ctx.message.channel.send("You cannot authorize a private channel!")
             return
         self.__open_auths[ctx.message.author.id] = None
-        await ChannelAuthHandler(self.__open_auths, self.__authorized_channels).handle_auth(ctx)
+        await ChannelAuthHandler(
+            self.__open_auths, self.__authorized_channels, self.__rcon_handler
+        ).handle_auth(ctx)
         logging.debug("Started authorizing: %s", self.__open_auths)
 
     async def deauthorize_channel_command(self, ctx: CommandContext):
@@ -193,8 +420,26 @@ class PyconClient(discord.Client):
 
     def _cleanup(self) -> None:
         """Clean up the Bot and save all properties that need persistence."""
+        self.__audit_handler.close()
+        if self.__trace is not None:
+            self.__trace.close()
+        if not self.__state_loaded:
+            # Saving now would overwrite the persisted state with empty containers
+            logging.warning("Stopped before the state was loaded, not saving it")
+            return
         PersistenceHandler.save_auth_channels(self.__authorized_channels)
         PersistenceHandler.save_prefixes(self.__prefixes)
+        PersistenceHandler.save_schedules(self.__schedule_handler.to_dict())
+        PersistenceHandler.save_role_stages(self.__permission_handler.to_dict())
+        self.__stats_handler.save()
+
+    async def close(self) -> None:
+        """Stop the journal readers before closing the connection to Discord.
+
+        Also runs after handle_signal, when asyncio cancels the task of the running bot.
+        """
+        await self.__journal_handler.stop()
+        await super().close()
 
     def handle_signal(self, signum: int, frame: Any) -> None:
         """Handle SIGINT and SIGTERM signals and exit gracefully
@@ -223,20 +468,41 @@ class PyconClient(discord.Client):
         """
         logging.debug("Handling RCON command %s %s", ctx.command, ctx.args)
         creds = self.__authorized_channels[f"{ctx.message.channel.id}"]
-        if creds["type"] == "Minecraft":
-            ctx.prefix = "/"
         if (
             "stop" in ctx.command.lower() and
-            not ctx.message.author.id in SystemHandler.get_authorized_users()
+            not self.__permission_handler.is_allowed(ctx.message.author, CommandAuthStage.BOSS)
         ):
             await ctx.message.channel.send("Nah bro u aint stopping that shit now dawg")
             return
+        self.__autocomplete.add_command(ctx.message.channel.id, " ".join((ctx.command, *ctx.args)))
+        result: str = "ok"
+        response: Optional[str] = None
+        latency: Optional[float] = None
+        start = time.perf_counter()
         try:
-            with RCONClient(creds["rcon"], creds["port"], passwd=creds["password"]) as rcon_client:
-                response = rcon_client.run(f"{ctx.prefix}{ctx.command}", *ctx.args)
-                if response:
-                    await ctx.message.channel.send(response)
+            response = await self.__rcon_handler.run(creds, ctx.command, *ctx.args)
+            latency = time.perf_counter() - start
+            self.__autocomplete.observe(ctx.message.channel.id, creds, ctx.command, response)
+            if response:
+                await ctx.message.channel.send(response)
+        except ServerUnavailableError as err:
+            result = "server down"
+            await ctx.message.channel.send(
+                f"The server is down since <t:{int(err.since)}:R>. "
+                "I'll let it through again once it answers."
+            )
+        except asyncio.TimeoutError:
+            result = "timed out"
+            logging.error("RCON command %s timed out", ctx.command)
+            await ctx.message.channel.send("The server took too long to answer.")
+        except AuthenticationError as err:
+            result = "wrong password"
+            logging.error("RCON login failed: %s", err)
+            await ctx.message.channel.send(
+                "The server rejected the RCON password. Authorize this channel again."
+            )
         except (ConnectionRefusedError, socket.gaierror) as err:
+            result = "connection failed"
             logging.error("Got connection refused when connecting to rcon: %s", err)
             await ctx.message.channel.send("Connection Failed. Is the server running?")
         except discord.errors.HTTPException as err:
@@ -244,16 +510,104 @@ class PyconClient(discord.Client):
             await ctx.message.channel.send(
                 "The requested Message is too long for Discord. Must be 2000 or fewer in length!"
             )
+        except Exception:
+            result = "error"
+            raise
+        finally:
+            self.__audit_handler.record(
+                ctx, "rcon", ctx.message.channel.id, ctx.message.channel.name, result
+            )
+            if self.__trace is not None:
+                self.__trace.rcon(
+                    ctx.message.channel.id,
+                    creds,
+                    ctx.command,
+                    len(ctx.args),
+                    start,
+                    latency if latency is not None else time.perf_counter() - start,
+                    response,
+                    result,
+                )
+
+    async def _handle_slash_command(self, ctx: CommandContext) -> None:
+        """Run a text command that was sent as slash command
+
+        Args:
+            ctx (CommandContext): Context with an InteractionMessage
+        """
+        try:
+            await self.__command_handler.handle_command(ctx)
+        finally:
+            # Commands and authentications are the only way to (de)authorize channels
+            self._refresh_active_channels()
 
-    def _basic_channel_auth(self) -> Dict[str, Any]:
-        return {
-            "authorized": False,
-            "rcon": "",
-            "port": "",
-            "password": "",
-            "type": "",
+    async def _timed_login(self, token: str) -> None:
+        start = time.perf_counter()
+        await super().login(token)
+        self._profile("gateway login", start)
+
+    async def _load_state(self) -> None:
+        """Load all persisted state in worker threads and fill the handlers' containers in place"""
+        start = time.perf_counter()
+        await asyncio.to_thread(BASE_PATH.mkdir, parents=True, exist_ok=True)
+        (
+            channels, prefixes, users, role_stages, schedules, stats
+        ) = await asyncio.gather(*(
+            self._load(name, getter)
+            for name, getter in (
+                ("channels", PersistenceHandler.get_auth_channels),
+                ("prefixes", PersistenceHandler.get_prefixes),
+                ("authorized users", PersistenceHandler.get_authorized_users),
+                ("role stages", PersistenceHandler.get_role_stages),
+                ("schedules", PersistenceHandler.get_schedules),
+                ("stats", PersistenceHandler.get_stats),
+            )
+        ))
+        self.__authorized_channels.update(channels)
+        self._refresh_active_channels()
+        self.__prefixes.update({int(s_id): prefix for s_id, prefix in prefixes.items()})
+        self.__permission_handler.load(role_stages, users)
+        self.__schedule_handler.load(schedules)
+        self.__stats_handler.load(stats)
+        self.__state_loaded = True
+        self._profile("load state", start)
+
+    async def _load(self, name: str, getter: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        result = await asyncio.to_thread(getter)
+        self._profile(f"load {name}", start)
+        return result
+
+    def _profile(self, name: str, start: float) -> None:
+        if self.__profile is not None:
+            self.__profile.add(name, start)
+
+    def _refresh_active_channels(self) -> None:
+        """Rebuild the set of channel IDs whose messages are forwarded to rcon"""
+        self.__active_channels = {
+            int(channel_id)
+            for channel_id, channel_cfg in self.__authorized_channels.items()
+            if channel_cfg.get("authorized")
         }
 
+    @staticmethod
+    def _parse_guild_ids(servers: List[str]) -> Set[int]:
+        """Parse the guild allowlist
+
+        Args:
+            servers (List[str]): Guild IDs as strings
+
+        Returns:
+            Set[int]: Guild IDs. Empty if every guild is allowed.
+        """
+        guild_ids: Set[int] = set()
+        for server in servers:
+            if server.strip().isdigit():
+                guild_ids.add(int(server))
+            elif server.strip():
+                logging.warning("Ignoring invalid guild ID in servers: %s", server)
+        return guild_ids
+
     async def _prefix_setter(self, ctx: CommandContext) -> None:
         if ctx.args:
             self.set_prefix_for_server(ctx.message.guild, ctx.args[0])
@@ -0,0 +1,62 @@
+"""Startup profile for pycon
+
+Description:    Timing of the import and init phases of the pycon startup
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+
+class StartupProfile:
+    """Collect the duration of startup phases.
+
+    Phases may overlap, e.g. state loading runs while the client logs in. Every phase is therefore
+    reported with its start offset and its own duration.
+    """
+    def __init__(self) -> None:
+        self._origin = time.perf_counter()
+        self._phases: List[Tuple[str, float, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as a phase
+
+        Args:
+            name (str): Name of the phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def add(self, name: str, start: float) -> None:
+        """Add a phase that ends now
+
+        Args:
+            name (str): Name of the phase
+            start (float): time.perf_counter() at the start of the phase
+        """
+        self._phases.append((name, start - self._origin, time.perf_counter() - start))
+
+    def report(self) -> str:
+        """Render all phases
+
+        Returns:
+            str: One line per phase with start offset and duration in milliseconds
+        """
+        lines = ["Startup profile (start offset, duration):"]
+        for name, offset, duration in self._phases:
+            lines.append(f"  +{offset * 1000:8.1f} ms {duration * 1000:8.1f} ms  {name}")
+        lines.append(f"  +{(time.perf_counter() - self._origin) * 1000:8.1f} ms  total")
+        return "\n".join(lines)
+
+    def print(self) -> None:
+        """Print the report to stderr"""
+        print(self.report(), file=sys.stderr, flush=True)
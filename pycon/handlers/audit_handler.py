@@ -0,0 +1,475 @@
+"""Audit handler
+
+Description:    Append-only audit log of executed RCON and system commands
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from pycon.handlers.command_handler import CommandContext
+from pycon.handlers.persistence_handler import AUDIT_PATH
+
+CURRENT_SEGMENT = "current.jsonl"
+SEGMENT_PATTERN = re.compile(r"^segment-(\d+)\.jsonl\.gz$")
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_FLUSH_SIZE = 100
+DEFAULT_SEGMENT_BYTES = 4 * 1024 * 1024
+DEFAULT_SEGMENT_AGE = 7 * 86400
+DEFAULT_MAX_SEGMENTS = 200
+DEFAULT_QUERY_LIMIT = 20
+TIME_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+@dataclass
+class AuditRecord:
+    """A single executed command"""
+
+    ts: float
+    user: int
+    user_name: str
+    server: str
+    server_name: str
+    kind: str
+    command: str
+    args: List[str] = field(default_factory=list)
+    result: str = ""
+    guild: int = 0
+
+
+@dataclass
+class SegmentIndex:
+    """Summary of one log segment, used to skip segments that cannot match a query"""
+
+    first: float = 0.0
+    last: float = 0.0
+    count: int = 0
+    users: Set[int] = field(default_factory=set)
+    servers: Set[str] = field(default_factory=set)
+    commands: Set[str] = field(default_factory=set)
+    guilds: Set[int] = field(default_factory=set)
+
+    def add(self, record: Dict[str, Any]) -> None:
+        """Add a record to the index
+
+        Args:
+            record (Dict[str, Any]): Record as written to the log
+        """
+        self.first = record["ts"] if not self.count else min(self.first, record["ts"])
+        self.last = max(self.last, record["ts"])
+        self.count += 1
+        self.users.add(record["user"])
+        self.servers.add(record["server"])
+        self.commands.add(record["command"].lower())
+        self.guilds.add(record.get("guild", 0))
+
+    def may_match(self, query: "AuditQuery") -> bool:
+        """Check whether the segment can contain records of a query
+
+        Args:
+            query (AuditQuery): Query
+
+        Returns:
+            bool: False if no record of the segment can match
+        """
+        return (
+            self.count > 0
+            and (query.since is None or self.last >= query.since)
+            and (query.until is None or self.first <= query.until)
+            and (query.user is None or query.user in self.users)
+            and (query.server is None or query.server in self.servers)
+            and (query.command is None or query.command in self.commands)
+            and (query.guild is None or query.guild in self.guilds)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the index in its file format
+
+        Returns:
+            Dict[str, Any]: JSON serializable index
+        """
+        return {
+            "first": self.first,
+            "last": self.last,
+            "count": self.count,
+            "users": sorted(self.users),
+            "servers": sorted(self.servers),
+            "commands": sorted(self.commands),
+            "guilds": sorted(self.guilds),
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "SegmentIndex":
+        """Load an index from its file format
+
+        Args:
+            data (Dict[str, Any]): Index as written by to_dict
+
+        Returns:
+            SegmentIndex: Index
+        """
+        return SegmentIndex(
+            data["first"],
+            data["last"],
+            data["count"],
+            set(data["users"]),
+            set(data["servers"]),
+            set(data["commands"]),
+            # Indexes written before records had a guild
+            set(data.get("guilds", [0])),
+        )
+
+
+@dataclass
+class AuditQuery:
+    """Filter for audit records. Unset fields match everything."""
+
+    guild: Optional[int] = None
+    user: Optional[int] = None
+    server: Optional[str] = None
+    command: Optional[str] = None
+    since: Optional[float] = None
+    until: Optional[float] = None
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        """Check whether a record matches the query
+
+        Args:
+            record (Dict[str, Any]): Record as written to the log
+
+        Returns:
+            bool: True if the record matches
+        """
+        return (
+            (self.since is None or record["ts"] >= self.since)
+            and (self.until is None or record["ts"] <= self.until)
+            and (self.user is None or record["user"] == self.user)
+            and (self.server is None or record["server"] == self.server)
+            and (self.command is None or record["command"].lower() == self.command)
+            and (self.guild is None or record.get("guild", 0) == self.guild)
+        )
+
+
+class AuditHandler:
+    """Buffered, rotating audit log under AUDIT_PATH.
+
+    Records are buffered in memory and appended to the current segment in batches by a worker
+    thread. Once the current segment grows too large or too old, it is compressed and gets a
+    small index file, so queries only open segments that can contain matching records.
+
+    Args:
+        path (Path, optional): Directory of the log. Defaults to AUDIT_PATH.
+        flush_interval (float, optional): Seconds between two flushes.
+            Defaults to DEFAULT_FLUSH_INTERVAL.
+        flush_size (int, optional): Buffered records that trigger an early flush.
+            Defaults to DEFAULT_FLUSH_SIZE.
+        segment_bytes (int, optional): Size after which the current segment is rotated.
+            Defaults to DEFAULT_SEGMENT_BYTES.
+        segment_age (float, optional): Seconds after which the current segment is rotated.
+            Defaults to DEFAULT_SEGMENT_AGE.
+        max_segments (int, optional): Number of compressed segments that are kept.
+            Defaults to DEFAULT_MAX_SEGMENTS.
+    """
+
+    def __init__(
+        self,
+        path: Path = AUDIT_PATH,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        flush_size: int = DEFAULT_FLUSH_SIZE,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        segment_age: float = DEFAULT_SEGMENT_AGE,
+        max_segments: int = DEFAULT_MAX_SEGMENTS,
+    ) -> None:
+        self._path = path
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
+        self._segment_bytes = segment_bytes
+        self._segment_age = segment_age
+        self._max_segments = max_segments
+        self._buffer: List[Dict[str, Any]] = []
+        self._file_lock = threading.Lock()
+        self._indexes: Dict[str, SegmentIndex] = {}
+        self._current_index: Optional[SegmentIndex] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._pending_flush: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the periodic flush. Has to be called from a running event loop."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def close(self) -> None:
+        """Write all buffered records synchronously, e.g. on shutdown"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._write(self._take_buffer())
+
+    def record(
+        self, ctx: CommandContext, kind: str, server: Any, server_name: str, result: str
+    ) -> None:
+        """Add an executed command to the log
+
+        Args:
+            ctx (CommandContext): Context of the command
+            kind (str): Kind of the command, e.g. "rcon" or "system"
+            server (Any): ID of the authorized channel of the targeted server
+            server_name (str): Name of the authorized channel
+            result (str): Short result, e.g. "ok" or "connection failed"
+        """
+        record = AuditRecord(
+            time.time(),
+            ctx.message.author.id,
+            f"{ctx.message.author}",
+            f"{server}",
+            server_name,
+            kind,
+            ctx.command,
+            list(ctx.args),
+            result,
+            ctx.message.guild.id if ctx.message.guild else 0,
+        )
+        self._buffer.append(asdict(record))
+        if len(self._buffer) >= self._flush_size and (
+            self._pending_flush is None or self._pending_flush.done()
+        ):
+            self._pending_flush = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self) -> None:
+        """Write all buffered records in a worker thread"""
+        batch = self._take_buffer()
+        if batch:
+            await asyncio.to_thread(self._write, batch)
+
+    async def query(self, query: AuditQuery, limit: int = DEFAULT_QUERY_LIMIT) -> List[Dict]:
+        """Search the log, newest records first
+
+        Args:
+            query (AuditQuery): Filter of the search
+            limit (int, optional): Maximum number of results. Defaults to DEFAULT_QUERY_LIMIT.
+
+        Returns:
+            List[Dict]: Matching records
+        """
+        await self.flush()
+        return await asyncio.to_thread(self._query, query, limit)
+
+    async def handle_audit(self, ctx: CommandContext) -> None:
+        """Handle the audit command:
+        ``audit [user=@USER] [server=#CHANNEL] [command=NAME] [since=7d] [until=2023-01-31]``
+
+        Only commands of the guild the audit command is used in are shown, since auth stages are
+        granted per guild.
+
+        Args:
+            ctx (CommandContext): Command Context
+        """
+        if not ctx.message.guild:
+            await ctx.message.channel.send("You cannot audit from a private channel!")
+            return
+        try:
+            query = AuditHandler.parse_query(ctx.args)
+        except ValueError as err:
+            await ctx.message.channel.send(
+                f"{err}\nUse it like this: {ctx.prefix}{ctx.command} [user=@USER] "
+                "[server=#CHANNEL] [command=NAME] [since=7d|YYYY-MM-DD] [until=...]"
+            )
+            return
+        query.guild = ctx.message.guild.id
+        records = await self.query(query)
+        if not records:
+            await ctx.message.channel.send("No matching commands found.")
+            return
+        lines = ["```"]
+        for record in records:
+            timestamp = datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d %H:%M")
+            lines.append(
+                f"{timestamp} {record['user_name']} @ {record['server_name'] or record['server']}"
+                f" ({record['kind']}): {' '.join([record['command'], *record['args']])}"
+                f" -> {record['result']}"
+            )
+        message = "\n".join(lines)[:1990]
+        await ctx.message.channel.send(message + "\n```")
+
+    @staticmethod
+    def parse_query(args: List[str]) -> AuditQuery:
+        """Parse the arguments of the audit command
+
+        Args:
+            args (List[str]): key=value arguments
+
+        Raises:
+            ValueError: If an argument is malformed
+
+        Returns:
+            AuditQuery: Parsed query
+        """
+        query = AuditQuery()
+        for arg in args:
+            key, _, value = arg.partition("=")
+            if not value:
+                raise ValueError(f'Invalid filter "{arg}".')
+            key = key.lower()
+            if key == "user":
+                query.user = int(re.sub(r"\D", "", value) or "0")
+            elif key == "server":
+                query.server = re.sub(r"\D", "", value)
+            elif key == "command":
+                query.command = value.lower()
+            elif key in ("since", "until"):
+                setattr(query, key, AuditHandler.parse_time(value))
+            else:
+                raise ValueError(f'Unknown filter "{key}".')
+        return query
+
+    @staticmethod
+    def parse_time(value: str) -> float:
+        """Parse a relative time like "7d" or an ISO date like "2023-01-31"
+
+        Args:
+            value (str): Time string
+
+        Raises:
+            ValueError: If the time is malformed
+
+        Returns:
+            float: Unix timestamp
+        """
+        match = re.match(r"^(\d+)([mhdw])$", value.lower())
+        if match:
+            return time.time() - int(match.group(1)) * TIME_UNITS[match.group(2)]
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError as err:
+            raise ValueError(f'Invalid time "{value}".') from err
+
+    def _take_buffer(self) -> List[Dict[str, Any]]:
+        batch, self._buffer = self._buffer, []
+        return batch
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except OSError as err:
+                logging.error("Could not write audit log: %s", err)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        """Append a batch to the current segment and rotate it if needed. Runs in a thread.
+
+        Args:
+            batch (List[Dict[str, Any]]): Records to be written
+        """
+        if not batch:
+            return
+        with self._file_lock:
+            current_index = self._load_current_index()
+            with open(self._path / CURRENT_SEGMENT, "a", encoding="utf-8") as current:
+                for record in batch:
+                    current.write(json.dumps(record, separators=(",", ":")) + "\n")
+                    current_index.add(record)
+            too_large = (self._path / CURRENT_SEGMENT).stat().st_size >= self._segment_bytes
+            if too_large or time.time() - current_index.first >= self._segment_age:
+                self._rotate(current_index)
+
+    def _rotate(self, current_index: SegmentIndex) -> None:
+        """Compress the current segment and write its index. Caller holds the file lock.
+
+        Args:
+            current_index (SegmentIndex): Index of the current segment
+        """
+        name = f"segment-{int(current_index.first * 1000)}.jsonl.gz"
+        logging.info("Rotating audit log into %s", name)
+        with open(self._path / CURRENT_SEGMENT, "rb") as current:
+            with gzip.open(self._path / name, "wb") as segment:
+                segment.write(current.read())
+        with open(self._path / f"{name}.idx", "w", encoding="utf-8") as index_file:
+            index_file.write(json.dumps(current_index.to_dict()))
+        os.remove(self._path / CURRENT_SEGMENT)
+        self._indexes[name] = current_index
+        self._current_index = SegmentIndex()
+        segments = self._segment_names()
+        for old in segments[: -self._max_segments]:
+            logging.info("Removing old audit segment %s", old)
+            os.remove(self._path / old)
+            if (self._path / f"{old}.idx").exists():
+                os.remove(self._path / f"{old}.idx")
+            self._indexes.pop(old, None)
+
+    def _query(self, query: AuditQuery, limit: int) -> List[Dict[str, Any]]:
+        """Search all segments, newest first. Runs in a thread.
+
+        Args:
+            query (AuditQuery): Filter of the search
+            limit (int): Maximum number of results
+
+        Returns:
+            List[Dict[str, Any]]: Matching records
+        """
+        results: List[Dict[str, Any]] = []
+        with self._file_lock:
+            if self._load_current_index().may_match(query):
+                results.extend(self._scan(self._path / CURRENT_SEGMENT, query, False))
+            segments = self._segment_names()
+            indexes = [(name, self._load_index(name)) for name in segments]
+        results.sort(key=lambda record: -record["ts"])
+        for name, index in reversed(indexes):
+            if len(results) >= limit:
+                break
+            if index.may_match(query):
+                matches = list(self._scan(self._path / name, query, True))
+                results.extend(sorted(matches, key=lambda record: -record["ts"]))
+        return results[:limit]
+
+    def _scan(self, path: Path, query: AuditQuery, compressed: bool) -> Iterator[Dict[str, Any]]:
+        opener = gzip.open if compressed else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as segment:
+                for line in segment:
+                    record = json.loads(line)
+                    if query.matches(record):
+                        yield record
+        except FileNotFoundError:
+            return
+
+    def _segment_names(self) -> List[str]:
+        if not self._path.exists():
+            return []
+        names = [name for name in os.listdir(self._path) if SEGMENT_PATTERN.match(name)]
+        return sorted(names, key=lambda name: int(SEGMENT_PATTERN.match(name).group(1)))
+
+    def _load_index(self, name: str) -> SegmentIndex:
+        index = self._indexes.get(name)
+        if index is None:
+            try:
+                with open(self._path / f"{name}.idx", "r", encoding="utf-8") as index_file:
+                    index = SegmentIndex.from_dict(json.loads(index_file.read()))
+            except (FileNotFoundError, ValueError, KeyError):
+                logging.warning("Rebuilding missing index of audit segment %s", name)
+                index = SegmentIndex()
+                for record in self._scan(self._path / name, AuditQuery(), True):
+                    index.add(record)
+            self._indexes[name] = index
+        return index
+
+    def _load_current_index(self) -> SegmentIndex:
+        if self._current_index is None:
+            os.makedirs(self._path, exist_ok=True)
+            self._current_index = SegmentIndex()
+            for record in self._scan(self._path / CURRENT_SEGMENT, AuditQuery(), False):
+                self._current_index.add(record)
+        return self._current_index
@@ -7,15 +7,17 @@ Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
                 via any medium is strictly prohibited.
 """
 
+import asyncio
 import logging
 import socket
 from enum import Enum, auto
 from typing import Any, Dict
 
 from discord import TextChannel
-from rcon.source import Client as RCONClient
 
 from pycon.handlers.command_handler import CommandContext
+from pycon.handlers.rcon_handler import RCONHandler
+from pycon.handlers.transport_handler import AuthenticationError
 
 
 class AuthStage(Enum):
@@ -35,13 +37,18 @@ class ChannelAuthHandler:
     Args:
         open_auths (Dict[int, Dict[str, Any]]): Pycon client's open authentications and their stage
         authorized_channels (Dict[str, Any]): Pycon client's authorized channels
+        rcon_handler (RCONHandler): Handler to check the credentials with
     """
 
     def __init__(
-        self, open_auths: Dict[int, Dict[str, Any]], authorized_channels: Dict[str, Any]
+        self,
+        open_auths: Dict[int, Dict[str, Any]],
+        authorized_channels: Dict[str, Any],
+        rcon_handler: RCONHandler,
     ) -> None:
         self._open_auths: Dict[str, int] = open_auths
         self._authorized_channels: Dict[str, Any] = authorized_channels
+        self._rcon_handler = rcon_handler
         self._original_channel: TextChannel = None
 
     async def handle_auth(self, ctx: CommandContext):
@@ -81,7 +88,7 @@ class ChannelAuthHandler:
             "HOST:PORT PASSWORD [TYPE]\n"
             "```\n"
             "Where HOST is you RCON IP address, PORT is the RCON port, PASSWORD is your password "
-            "and TYPE is the type of server you have (e.g. Minecraft, ARK, ...).\n"
+            "and TYPE is the type of server you have (e.g. Minecraft, ARK, Rust, DayZ, ...).\n"
             "TYPE is optional and defaults to 'Minecraft'.\n"
             'Write "abort" to end configuration.'
         )
@@ -156,9 +163,11 @@ class ChannelAuthHandler:
                 f"{self._open_auths[ctx.message.author.id]['orig_channel'].id}"
             ]
             try:
-                with RCONClient(creds["rcon"], creds["port"], passwd=creds["password"]):
-                    await ctx.message.channel.send("Connection successfull!")
-            except (ConnectionRefusedError, socket.gaierror) as err:
+                await self._rcon_handler.check(creds)
+                await ctx.message.channel.send("Connection successfull!")
+            except (
+                ConnectionRefusedError, socket.gaierror, asyncio.TimeoutError, AuthenticationError
+            ) as err:
                 logging.error("Couldn't connect to rcon: %s", err)
                 await ctx.message.channel.send(
                     "Connection not possible. Try again."
@@ -0,0 +1,234 @@
+"""Broadcast handler
+
+Description:    Concurrent fan-out of RCON commands to all servers of a guild
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import logging
+import socket
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from discord import Guild
+
+from pycon.handlers.audit_handler import AuditHandler
+from pycon.handlers.command_handler import CommandAuthStage, CommandContext
+from pycon.handlers.health_handler import ServerUnavailableError
+from pycon.handlers.permission_handler import PermissionHandler
+from pycon.handlers.rcon_handler import RCONHandler
+from pycon.handlers.transport_handler import AuthenticationError
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_SERVER_TIMEOUT = 10.0
+GROUP_FLAG = "-g"
+MAX_MESSAGE_LENGTH = 2000
+MAX_RESPONSE_LENGTH = 80
+
+
+@dataclass
+class BroadcastResult:
+    """Result of a broadcast command on a single server"""
+    server: int
+    name: str
+    success: bool
+    response: str
+
+
+class BroadcastHandler:
+    """Send one RCON command to every authorized server of a guild at the same time
+
+    Args:
+        auth_channels (Dict[str, Any]): Pycon client's authorized channels
+        rcon_handler (RCONHandler): Handler to run RCON commands with
+        permission_handler (PermissionHandler): Handler to check auth stages with
+        audit_handler (AuditHandler): Audit log for executed commands
+        concurrency (int, optional): Maximum number of servers contacted at the same time.
+            Defaults to DEFAULT_CONCURRENCY.
+        server_timeout (float, optional): Timeout per server in seconds.
+            Defaults to DEFAULT_SERVER_TIMEOUT.
+    """
+    def __init__(
+        self,
+        auth_channels: Dict[str, Any],
+        rcon_handler: RCONHandler,
+        permission_handler: PermissionHandler,
+        audit_handler: AuditHandler,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        server_timeout: float = DEFAULT_SERVER_TIMEOUT,
+    ) -> None:
+        self._auth_channels = auth_channels
+        self._rcon_handler = rcon_handler
+        self._permission_handler = permission_handler
+        self._audit_handler = audit_handler
+        self._concurrency = concurrency
+        self._server_timeout = server_timeout
+
+    async def handle_broadcast(self, ctx: CommandContext) -> None:
+        """Handle the broadcast command: ``broadcast [-g GROUP] COMMAND [ARGS...]``
+
+        Args:
+            ctx (CommandContext): Command Context
+        """
+        if not ctx.message.guild:
+            await ctx.message.channel.send("You cannot broadcast from a private channel!")
+            return
+        group, command_args = BroadcastHandler._split_group(ctx.args)
+        if group == "" or not command_args:
+            await ctx.message.channel.send(
+                f"Use it like this: {ctx.prefix}{ctx.command} [{GROUP_FLAG} GROUP] COMMAND [ARGS]"
+            )
+            return
+        if (
+            "stop" in command_args[0].lower() and
+            not self._permission_handler.is_allowed(ctx.message.author, CommandAuthStage.BOSS)
+        ):
+            await ctx.message.channel.send("Nah bro u aint stopping all that shit now dawg")
+            return
+        targets = self.get_targets(ctx.message.guild, group)
+        if not targets:
+            await ctx.message.channel.send(
+                f'No authorized servers found{f" in group {group}" if group else ""}.'
+            )
+            return
+        logging.info(
+            "User %s (%d) broadcasts %s to %d servers",
+            ctx.message.author,
+            ctx.message.author.id,
+            command_args,
+            len(targets),
+        )
+        results = await self.broadcast(targets, command_args[0], command_args[1:])
+        command_ctx = CommandContext(ctx.prefix, command_args[0], command_args[1:], ctx.message)
+        for result in results:
+            self._audit_handler.record(
+                command_ctx,
+                "broadcast",
+                result.server,
+                result.name,
+                "ok" if result.success else result.response,
+            )
+        await ctx.message.channel.send(BroadcastHandler._summary(command_args, results))
+
+    async def handle_set_group(self, ctx: CommandContext) -> None:
+        """Assign the authorized server of this channel to a broadcast group
+
+        Args:
+            ctx (CommandContext): Command Context
+        """
+        channel_cfg = self._auth_channels.get(f"{ctx.message.channel.id}")
+        if not channel_cfg or not channel_cfg["authorized"]:
+            await ctx.message.channel.send("This Channel is not yet authorized.")
+            return
+        if ctx.args:
+            channel_cfg["group"] = ctx.args[0].lower()
+            await ctx.message.channel.send(f'This server is now part of group "{ctx.args[0]}".')
+        else:
+            channel_cfg.pop("group", None)
+            await ctx.message.channel.send("This server is no longer part of a group.")
+
+    def get_targets(self, guild: Guild, group: Optional[str] = None) -> List[Tuple[Any, Any]]:
+        """Get all authorized channels of a guild, optionally limited to a group
+
+        Args:
+            guild (Guild): Guild whose channels are targeted
+            group (Optional[str], optional): Name of a group. Defaults to None.
+
+        Returns:
+            List[Tuple[Any, Any]]: Channels mapped to their configs
+        """
+        targets: List[Tuple[Any, Any]] = []
+        for channel_id, channel_cfg in self._auth_channels.items():
+            if not channel_cfg.get("authorized"):
+                continue
+            if group and channel_cfg.get("group") != group.lower():
+                continue
+            channel = guild.get_channel(int(channel_id))
+            if channel is not None:
+                targets.append((channel, channel_cfg))
+        return targets
+
+    async def broadcast(
+        self, targets: List[Tuple[Any, Any]], command: str, args: List[str]
+    ) -> List[BroadcastResult]:
+        """Run a command on all targets concurrently
+
+        Args:
+            targets (List[Tuple[Any, Any]]): Channels and configs of the targeted servers
+            command (str): Command without prefix
+            args (List[str]): Arguments of the command
+
+        Returns:
+            List[BroadcastResult]: Results in the order of the targets
+        """
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def run_one(channel: Any, creds: Dict[str, Any]) -> BroadcastResult:
+            server, name = channel.id, channel.name
+            async with semaphore:
+                try:
+                    response = await self._rcon_handler.run(
+                        creds, command, *args, timeout=self._server_timeout
+                    )
+                except ServerUnavailableError:
+                    return BroadcastResult(server, name, False, "server down")
+                except asyncio.TimeoutError:
+                    return BroadcastResult(server, name, False, "timed out")
+                except AuthenticationError:
+                    return BroadcastResult(server, name, False, "wrong password")
+                except (ConnectionRefusedError, socket.gaierror, OSError) as err:
+                    logging.error("Broadcast to %s failed: %s", name, err)
+                    return BroadcastResult(server, name, False, "connection failed")
+                except Exception as err:  # pylint: disable=broad-except
+                    # One broken server must not cost the results of all others
+                    logging.exception("Broadcast to %s failed unexpectedly: %r", name, err)
+                    return BroadcastResult(server, name, False, "error")
+                return BroadcastResult(server, name, True, response)
+
+        return await asyncio.gather(*(run_one(channel, creds) for channel, creds in targets))
+
+    @staticmethod
+    def _split_group(args: List[str]) -> Tuple[Optional[str], List[str]]:
+        """Split the optional group flag from the command
+
+        Args:
+            args (List[str]): Arguments of the broadcast command
+
+        Returns:
+            Tuple[Optional[str], List[str]]: Group (None if not passed, "" if malformed) and the
+                remaining command with arguments
+        """
+        if args and args[0] == GROUP_FLAG:
+            if len(args) < 2:
+                return "", []
+            return args[1], args[2:]
+        return None, args
+
+    @staticmethod
+    def _summary(command_args: List[str], results: List[BroadcastResult]) -> str:
+        """Render the results of a broadcast as one compact message
+
+        Args:
+            command_args (List[str]): Broadcasted command with arguments
+            results (List[BroadcastResult]): Results per server
+
+        Returns:
+            str: Summary that fits into one Discord message
+        """
+        succeeded = sum(1 for result in results if result.success)
+        lines: List[str] = [
+            f"`{' '.join(command_args)}`: {succeeded}/{len(results)} servers succeeded",
+            "```",
+        ]
+        for result in sorted(results, key=lambda result: (result.success, result.name)):
+            response = " ".join(result.response.split()) or "-"
+            if len(response) > MAX_RESPONSE_LENGTH:
+                response = response[:MAX_RESPONSE_LENGTH - 3] + "..."
+            lines.append(f"{'ok ' if result.success else 'ERR'} {result.name}: {response}")
+        summary = "\n".join(lines)
+        if len(summary) > MAX_MESSAGE_LENGTH - 4:
+            summary = summary[:MAX_MESSAGE_LENGTH - 8] + "\n..."
+        return summary + "\n```"
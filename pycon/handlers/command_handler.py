@@ -41,8 +41,17 @@ class CommandContext:
 
 
 class CommandHandler:
-    """Handling for bot and rcon commands in text channels."""
-    def __init__(self) -> None:
+    """Handling for bot and rcon commands in text channels.
+
+    Args:
+        permission_check (Optional[Callable[[Message, CommandAuthStage], bool]], optional):
+            Function that decides whether the author of a message may run a command of an auth
+            stage. Defaults to None, which allows every command.
+    """
+    def __init__(
+        self, permission_check: Optional[Callable[[Message, CommandAuthStage], bool]] = None
+    ) -> None:
+        self.__permission_check = permission_check
         self.__commands: Dict[str, BotCommand] = {
             "help": BotCommand(
                 "help",
@@ -52,6 +61,11 @@ class CommandHandler:
             ),
         }
 
+    @property
+    def commands(self) -> List[BotCommand]:
+        """List[BotCommand]: All registered commands"""
+        return list(self.__commands.values())
+
     def add_commands(
         self,
         commands: List[Union[Tuple[str, Callable, str, CommandAuthStage], BotCommand]]
@@ -97,6 +111,17 @@ class CommandHandler:
                 f'No such command "{ctx.command}".\n'
                 f'Try "{ctx.prefix}help" to get a list of available commands."'
             )
+        elif self.__permission_check and not self.__permission_check(
+            ctx.message, command.auth_stage
+        ):
+            logging.warning(
+                "User %s (%d) lacks auth stage %s for command %s",
+                ctx.message.author,
+                ctx.message.author.id,
+                command.auth_stage.name,
+                ctx.command,
+            )
+            await ctx.message.channel.send("You don't have permissions for this command.")
         else:
             logging.debug("Executing command %s %s", ctx.command, ctx.args)
             await command.handler(ctx)
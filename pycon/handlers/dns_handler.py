@@ -0,0 +1,220 @@
+"""Asynchronous DNS resolution
+
+Description:    Asynchronous DNS resolver with a shared TTL cache for RCON hosts
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+DEFAULT_POSITIVE_TTL = 300.0
+DEFAULT_NEGATIVE_TTL = 30.0
+DEFAULT_LOOKUP_TIMEOUT = 5.0
+DEFAULT_REFRESH_INTERVAL = 10.0
+DEFAULT_IDLE_TTL = 3600.0
+
+
+@dataclass
+class DNSCacheEntry:
+    """Cached result of a single host lookup"""
+    addresses: List[str]
+    expires: float
+    last_used: float
+    error: Optional[socket.gaierror] = None
+
+
+class DNSResolver:
+    """Resolve RCON hostnames without blocking the event loop.
+
+    Results are cached for all channels. Successful lookups are kept for ``positive_ttl`` seconds,
+    failed ones for ``negative_ttl`` seconds. A background task refreshes positive entries shortly
+    before they expire, so the per-message path usually never waits for a lookup.
+
+    Args:
+        positive_ttl (float, optional): Seconds a successful lookup is cached.
+            Defaults to DEFAULT_POSITIVE_TTL.
+        negative_ttl (float, optional): Seconds a failed lookup is cached.
+            Defaults to DEFAULT_NEGATIVE_TTL.
+        lookup_timeout (float, optional): Seconds until a single lookup is given up.
+            Defaults to DEFAULT_LOOKUP_TIMEOUT.
+        refresh_interval (float, optional): Seconds between two runs of the background refresh.
+            Defaults to DEFAULT_REFRESH_INTERVAL.
+        idle_ttl (float, optional): Seconds after which unused entries are dropped instead of
+            refreshed. Defaults to DEFAULT_IDLE_TTL.
+    """
+    def __init__(
+        self,
+        positive_ttl: float = DEFAULT_POSITIVE_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+        lookup_timeout: float = DEFAULT_LOOKUP_TIMEOUT,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+        idle_ttl: float = DEFAULT_IDLE_TTL,
+    ) -> None:
+        self._positive_ttl = positive_ttl
+        self._negative_ttl = negative_ttl
+        self._lookup_timeout = lookup_timeout
+        self._refresh_interval = refresh_interval
+        self._idle_ttl = idle_ttl
+        self._cache: Dict[str, DNSCacheEntry] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the background refresh task. Has to be called from a running event loop."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        """Stop the background refresh task"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def resolve(self, host: str, port: int = 0) -> str:
+        """Resolve a hostname to an IP address
+
+        Args:
+            host (str): Hostname or IP address
+            port (int, optional): Port that will be connected to. Defaults to 0.
+
+        Raises:
+            socket.gaierror: If the host could not be resolved (possibly cached)
+
+        Returns:
+            str: First IP address of the host
+        """
+        if DNSResolver._is_ip_address(host):
+            return host
+        now = time.monotonic()
+        entry = self._cache.get(host)
+        if entry is not None and entry.expires > now:
+            entry.last_used = now
+            if entry.error is not None:
+                raise socket.gaierror(*entry.error.args)
+            return entry.addresses[0]
+        entry = await self._lookup(host, port)
+        if entry.error is not None:
+            raise socket.gaierror(*entry.error.args)
+        return entry.addresses[0]
+
+    def invalidate(self, host: str) -> None:
+        """Drop a host from the cache, e.g. after its address stopped working
+
+        Args:
+            host (str): Hostname to be removed
+        """
+        self._cache.pop(host, None)
+
+    async def _lookup(self, host: str, port: int) -> DNSCacheEntry:
+        """Look up a host, sharing one lookup between concurrent callers
+
+        The lookup runs in a task of its own, so cancelling one caller, e.g. by the timeout of its
+        command, does not cancel the lookup of the others.
+
+        Args:
+            host (str): Hostname to resolve
+            port (int): Port that will be connected to
+
+        Returns:
+            DNSCacheEntry: Fresh cache entry of the host
+        """
+        pending = self._pending.get(host)
+        if pending is None:
+            pending = asyncio.get_running_loop().create_task(self._update(host, port))
+            self._pending[host] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(host, None))
+        return await asyncio.shield(pending)
+
+    async def _update(self, host: str, port: int) -> DNSCacheEntry:
+        """Query a host and store the result in the cache
+
+        Args:
+            host (str): Hostname to resolve
+            port (int): Port that will be connected to
+
+        Returns:
+            DNSCacheEntry: Fresh cache entry of the host
+        """
+        entry = await self._query(host, port)
+        self._cache[host] = entry
+        return entry
+
+    async def _query(self, host: str, port: int) -> DNSCacheEntry:
+        """Query the system resolver in the loop's executor
+
+        Args:
+            host (str): Hostname to resolve
+            port (int): Port that will be connected to
+
+        Returns:
+            DNSCacheEntry: Positive or negative cache entry
+        """
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        previous = self._cache.get(host)
+        last_used = previous.last_used if previous else now
+        try:
+            infos = await asyncio.wait_for(
+                loop.getaddrinfo(host, port, type=socket.SOCK_STREAM),
+                timeout=self._lookup_timeout,
+            )
+        except asyncio.TimeoutError:
+            error = socket.gaierror(socket.EAI_AGAIN, f"Lookup of {host} timed out")
+            logging.warning("DNS lookup of %s timed out", host)
+            return DNSCacheEntry([], now + self._negative_ttl, last_used, error)
+        except socket.gaierror as err:
+            logging.warning("DNS lookup of %s failed: %s", host, err)
+            return DNSCacheEntry([], now + self._negative_ttl, last_used, err)
+        addresses: List[str] = []
+        for info in infos:
+            address = info[4][0]
+            if address not in addresses:
+                addresses.append(address)
+        logging.debug("Resolved %s to %s", host, addresses)
+        return DNSCacheEntry(addresses, now + self._positive_ttl, last_used)
+
+    async def _refresh_loop(self) -> None:
+        """Periodically refresh entries that are about to expire"""
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            try:
+                await self._refresh()
+            except Exception as err:  # pylint: disable=broad-except
+                logging.error("DNS cache refresh failed: %s", err)
+
+    async def _refresh(self) -> None:
+        """Refresh all positive entries expiring before the next refresh run"""
+        now = time.monotonic()
+        horizon = now + 2 * self._refresh_interval
+        for host, entry in list(self._cache.items()):
+            if now - entry.last_used > self._idle_ttl:
+                logging.debug("Dropping idle DNS entry of %s", host)
+                del self._cache[host]
+                continue
+            if entry.error is not None or entry.expires > horizon or host in self._pending:
+                continue
+            fresh = await self._query(host, 0)
+            if fresh.error is not None and entry.expires > time.monotonic():
+                # Keep serving the last known addresses until they really expire
+                continue
+            self._cache[host] = fresh
+
+    @staticmethod
+    def _is_ip_address(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return True
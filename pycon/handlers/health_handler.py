@@ -0,0 +1,158 @@
+"""Health handler
+
+Description:    Circuit breakers for unreachable RCON servers
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import logging
+import time
+from enum import Enum, auto
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_INITIAL_BACKOFF = 5.0
+DEFAULT_MAX_BACKOFF = 300.0
+
+
+class BreakerState(Enum):
+    """States of a circuit breaker"""
+    CLOSED = auto()
+    OPEN = auto()
+    HALF_OPEN = auto()
+
+
+class ServerUnavailableError(ConnectionRefusedError):
+    """Custom Exception for commands to servers whose circuit breaker is open
+
+    Args:
+        key (Tuple[str, int]): Host and port of the server
+        since (float): Unix timestamp of the failure that opened the breaker
+    """
+    def __init__(self, key: Tuple[str, int], since: float) -> None:
+        super().__init__(f"{key[0]}:{key[1]} is down since {time.ctime(since)}")
+        self.key = key
+        self.since = since
+
+
+class CircuitBreaker:
+    """Health state of one RCON endpoint.
+
+    After ``failure_threshold`` consecutive connection failures the breaker opens and every command
+    fails fast. A single background probe checks the endpoint with exponential backoff. While it
+    runs, the breaker is half-open and commands still fail fast; the probe alone decides whether the
+    breaker closes again.
+
+    Args:
+        key (Tuple[str, int]): Host and port of the endpoint
+        failure_threshold (int, optional): Consecutive failures that open the breaker.
+            Defaults to DEFAULT_FAILURE_THRESHOLD.
+        initial_backoff (float, optional): Seconds until the first probe.
+            Defaults to DEFAULT_INITIAL_BACKOFF.
+        max_backoff (float, optional): Maximum seconds between two probes.
+            Defaults to DEFAULT_MAX_BACKOFF.
+    """
+    def __init__(
+        self,
+        key: Tuple[str, int],
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        initial_backoff: float = DEFAULT_INITIAL_BACKOFF,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+    ) -> None:
+        self.key = key
+        self.state = BreakerState.CLOSED
+        self.since: float = 0.0
+        self._failures = 0
+        self._failure_threshold = failure_threshold
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def check(self) -> None:
+        """Fail fast if the endpoint is known to be down
+
+        Raises:
+            ServerUnavailableError: If the breaker is open or half-open
+        """
+        if self.state != BreakerState.CLOSED:
+            raise ServerUnavailableError(self.key, self.since)
+
+    def record_success(self) -> None:
+        """Reset the failure count after a successful command"""
+        self._failures = 0
+
+    def record_failure(self, probe: Callable[[], Awaitable[None]]) -> None:
+        """Count a connection failure and open the breaker once the threshold is reached
+
+        Args:
+            probe (Callable[[], Awaitable[None]]): Coroutine function that raises if the endpoint
+                is still down
+        """
+        if self._failures == 0:
+            self.since = time.time()
+        self._failures += 1
+        if self.state == BreakerState.CLOSED and self._failures >= self._failure_threshold:
+            logging.warning("Circuit breaker of %s:%s opened", *self.key)
+            self.state = BreakerState.OPEN
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe_loop(probe))
+
+    async def stop(self) -> None:
+        """Cancel the background probe"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    async def _probe_loop(self, probe: Callable[[], Awaitable[None]]) -> None:
+        backoff = self._initial_backoff
+        while True:
+            await asyncio.sleep(backoff)
+            self.state = BreakerState.HALF_OPEN
+            try:
+                await probe()
+            except (OSError, asyncio.TimeoutError) as err:
+                logging.debug("Probe of %s:%s failed: %s", *self.key, err)
+                self.state = BreakerState.OPEN
+                backoff = min(backoff * 2, self._max_backoff)
+                continue
+            except Exception as err:  # pylint: disable=broad-except
+                # E.g. another service answering the port. The probe must not die, or the breaker
+                # would stay half-open forever.
+                logging.warning("Probe of %s:%s failed unexpectedly: %r", *self.key, err)
+                self.state = BreakerState.OPEN
+                backoff = min(backoff * 2, self._max_backoff)
+                continue
+            logging.info("Circuit breaker of %s:%s closed", *self.key)
+            self.state = BreakerState.CLOSED
+            self._failures = 0
+            self._probe_task = None
+            return
+
+
+class HealthHandler:
+    """Circuit breakers of all RCON endpoints, keyed by host and port"""
+    def __init__(self) -> None:
+        self._breakers: Dict[Tuple[str, int], CircuitBreaker] = {}
+
+    def get(self, host: str, port: int) -> CircuitBreaker:
+        """Get the circuit breaker of an endpoint
+
+        Args:
+            host (str): Host as configured in the authorized channel
+            port (int): RCON port
+
+        Returns:
+            CircuitBreaker: Breaker of the endpoint, created on first use
+        """
+        key = (host, int(port))
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key)
+            self._breakers[key] = breaker
+        return breaker
@@ -0,0 +1,363 @@
+"""Journal handler
+
+Description:    Live console feed of game server journals into authorized channels
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Pattern
+
+import discord
+
+from pycon.handlers.command_handler import CommandContext
+from pycon.handlers.permission_handler import PermissionHandler
+from pycon.handlers.system_handler import UNIT_PATTERN, SystemHandler
+
+CONSOLE_PATTERNS: Dict[str, Pattern] = {
+    "join": re.compile(r"joined the game|logged in with entity id|player connected", re.I),
+    "leave": re.compile(r"left the game|lost connection|player disconnected", re.I),
+    "death": re.compile(
+        r"\b(was (slain|shot|killed|blown up|pricked|squashed|fireballed)|drowned|died|"
+        r"fell (from|off|out)|burned to death|tried to swim in lava|starved to death)\b",
+        re.I,
+    ),
+    "chat": re.compile(r"<[^>]+> "),
+    "error": re.compile(r"\b(ERROR|FATAL|SEVERE|Exception|Traceback)\b"),
+}
+DEFAULT_CATEGORIES = ("join", "leave", "death", "error")
+DEFAULT_FLUSH_INTERVAL = 2.0
+DEFAULT_MESSAGE_BUDGET = 1900
+DEFAULT_MAX_MESSAGES = 2
+MAX_BUFFERED_LINES = 500
+RESTART_DELAY = 5.0
+TERMINATE_TIMEOUT = 5.0
+
+
+class JournalReader:
+    """Follow the journal of one systemd unit and feed it to all subscribed channels
+
+    Args:
+        unit (str): Name of the systemd unit
+        flush_interval (float, optional): Seconds between two posts into a channel.
+            Defaults to DEFAULT_FLUSH_INTERVAL.
+        message_budget (int, optional): Maximum characters of log lines per message.
+            Defaults to DEFAULT_MESSAGE_BUDGET.
+        max_messages (int, optional): Maximum messages per channel and flush. Lines that do not
+            fit are dropped and counted. Defaults to DEFAULT_MAX_MESSAGES.
+    """
+    def __init__(
+        self,
+        unit: str,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        message_budget: int = DEFAULT_MESSAGE_BUDGET,
+        max_messages: int = DEFAULT_MAX_MESSAGES,
+    ) -> None:
+        self.unit = unit
+        self._flush_interval = flush_interval
+        self._message_budget = message_budget
+        self._max_messages = max_messages
+        self._subscribers: Dict[int, Any] = {}
+        self._categories: Dict[int, List[str]] = {}
+        self._buffers: Dict[int, List[str]] = {}
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def subscribed(self) -> bool:
+        """bool: Whether any channel is subscribed to this reader"""
+        return bool(self._subscribers)
+
+    def has_subscriber(self, channel_id: int) -> bool:
+        """Check whether a channel is subscribed to this reader
+
+        Args:
+            channel_id (int): ID of the channel
+
+        Returns:
+            bool: True if the channel is subscribed
+        """
+        return channel_id in self._subscribers
+
+    def subscribe(self, channel: Any, categories: List[str]) -> None:
+        """Subscribe a channel and start reading if this is the first subscriber
+
+        Args:
+            channel (Any): Messageable channel that receives the feed
+            categories (List[str]): Names of CONSOLE_PATTERNS that are posted into the channel
+        """
+        self._subscribers[channel.id] = channel
+        self._categories[channel.id] = categories
+        self._buffers.setdefault(channel.id, [])
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [
+                loop.create_task(self._read_loop()),
+                loop.create_task(self._flush_loop()),
+            ]
+
+    async def unsubscribe(self, channel_id: int) -> None:
+        """Unsubscribe a channel and stop reading if it was the last subscriber
+
+        Args:
+            channel_id (int): ID of the channel
+        """
+        self._subscribers.pop(channel_id, None)
+        self._categories.pop(channel_id, None)
+        self._buffers.pop(channel_id, None)
+        if not self._subscribers and self._tasks:
+            await self.stop()
+
+    async def stop(self) -> None:
+        """Stop the journal process and all tasks of this reader"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self._terminate()
+
+    def dispatch(self, line: str) -> None:
+        """Append a journal line to the buffers of all channels interested in it
+
+        Args:
+            line (str): Line of the journal
+        """
+        matched: Dict[str, bool] = {}
+        for channel_id, categories in self._categories.items():
+            for category in categories:
+                if category not in matched:
+                    matched[category] = CONSOLE_PATTERNS[category].search(line) is not None
+                if matched[category]:
+                    buffer = self._buffers[channel_id]
+                    if len(buffer) < MAX_BUFFERED_LINES:
+                        buffer.append(line)
+                    break
+
+    async def flush(self) -> None:
+        """Post buffered lines into their channels, coalesced into as few messages as possible"""
+        for channel_id, buffer in list(self._buffers.items()):
+            channel = self._subscribers.get(channel_id)
+            if not buffer or channel is None:
+                continue
+            self._buffers[channel_id] = []
+            for message in self._batch(buffer):
+                try:
+                    await channel.send(message)
+                except discord.errors.HTTPException as err:
+                    logging.error("Could not post journal of %s: %s", self.unit, err)
+                    break
+
+    def _batch(self, lines: List[str]) -> List[str]:
+        """Split lines into messages within the size budget
+
+        Args:
+            lines (List[str]): Buffered lines
+
+        Returns:
+            List[str]: At most max_messages messages
+        """
+        messages: List[str] = []
+        current: List[str] = []
+        size = 0
+        for index, line in enumerate(lines):
+            line = line[:self._message_budget - 1]
+            if current and size + len(line) + 1 > self._message_budget:
+                messages.append("```\n" + "\n".join(current) + "\n```")
+                current, size = [], 0
+                if len(messages) == self._max_messages:
+                    messages[-1] += f"\n*{len(lines) - index} more lines skipped*"
+                    return messages
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            messages.append("```\n" + "\n".join(current) + "\n```")
+        return messages
+
+    async def _read_loop(self) -> None:
+        """Follow the journal and restart journalctl if it exits unexpectedly"""
+        while True:
+            try:
+                self._process = await asyncio.create_subprocess_exec(
+                    "journalctl",
+                    "--follow",
+                    "--lines=0",
+                    "--output=cat",
+                    f"--unit={self.unit}",
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                logging.info("Following journal of %s", self.unit)
+                while True:
+                    try:
+                        raw = await self._process.stdout.readline()
+                    except ValueError as err:
+                        # Line longer than the stream limit. It is dropped from the buffer, a rest
+                        # that was not read yet arrives as a line of its own.
+                        logging.warning("Skipping overlong journal line of %s: %s", self.unit, err)
+                        continue
+                    if not raw:
+                        break
+                    self.dispatch(raw.decode("utf-8", errors="replace").rstrip())
+                logging.warning("Journal of %s ended unexpectedly", self.unit)
+            except OSError as err:
+                logging.error("Could not follow journal of %s: %s", self.unit, err)
+            except Exception:  # pylint: disable=broad-except
+                # The feed has to restart, whatever went wrong
+                logging.exception("Following the journal of %s failed", self.unit)
+            await self._terminate()
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def _flush_loop(self) -> None:
+        """Flush buffers periodically"""
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    async def _terminate(self) -> None:
+        """Stop journalctl and wait for it, so it doesn't remain as a zombie process"""
+        process = self._process
+        if process is None:
+            return
+        if process.returncode is None:
+            try:
+                process.terminate()
+            except ProcessLookupError:
+                pass
+        try:
+            await asyncio.wait_for(process.wait(), TERMINATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("journalctl of %s ignored SIGTERM, killing it", self.unit)
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        # Only forgotten once reaped, so a cancelled wait is repeated by stop
+        self._process = None
+
+
+class JournalHandler:
+    """Opt-in live console feeds of the systemd units behind authorized channels
+
+    One JournalReader is shared by all channels subscribed to the same unit. Like system commands,
+    feeds read from the host of the bot, so only the users of the sys auth file may enable them.
+
+    Args:
+        auth_channels (Dict[str, Any]): Pycon client's authorized channels
+        permission_handler (PermissionHandler): Handler that knows the authorized users
+    """
+    def __init__(
+        self, auth_channels: Dict[str, Any], permission_handler: PermissionHandler
+    ) -> None:
+        self._auth_channels = auth_channels
+        self._permission_handler = permission_handler
+        self._readers: Dict[str, JournalReader] = {}
+
+    async def handle_console(self, ctx: CommandContext) -> None:
+        """Handle the console command: ``console on [CATEGORIES...]`` or ``console off``
+
+        Args:
+            ctx (CommandContext): Command Context
+        """
+        server_config = self._auth_channels.get(f"{ctx.message.channel.id}")
+        if not server_config or not server_config["authorized"]:
+            await ctx.message.channel.send("This channel isn't authorized yet.")
+            return
+        action = ctx.args[0].lower() if ctx.args else ""
+        if action == "on" and not self._permission_handler.is_authorized_user(
+            ctx.message.author.id
+        ):
+            logging.warning(
+                "User %s (%d) tried to enable a console feed",
+                ctx.message.author,
+                ctx.message.author.id,
+            )
+            await ctx.message.channel.send("You don't have permissions for this command.")
+        elif action == "on":
+            categories = [category.lower() for category in ctx.args[1:]] or list(
+                DEFAULT_CATEGORIES
+            )
+            unknown = [category for category in categories if category not in CONSOLE_PATTERNS]
+            if unknown:
+                await ctx.message.channel.send(
+                    f"Unknown categories: {', '.join(unknown)}. "
+                    f"Available: {', '.join(CONSOLE_PATTERNS)}"
+                )
+                return
+            if not self.subscribe(ctx.message.channel, {**server_config, "console": categories}):
+                await ctx.message.channel.send("The server type of this channel is no valid unit.")
+                return
+            server_config["console"] = categories
+            await ctx.message.channel.send(f"Console feed enabled for {', '.join(categories)}.")
+        elif action == "off":
+            server_config.pop("console", None)
+            await self.unsubscribe(ctx.message.channel.id)
+            await ctx.message.channel.send("Console feed disabled.")
+        else:
+            await ctx.message.channel.send(
+                f"Use it like this: {ctx.prefix}{ctx.command} on [CATEGORIES] | off\n"
+                f"Categories: {', '.join(CONSOLE_PATTERNS)}"
+            )
+
+    def subscribe(self, channel: Any, server_config: Dict[str, Any]) -> bool:
+        """Subscribe a channel to the journal of its server's unit
+
+        Args:
+            channel (Any): Messageable channel
+            server_config (Dict[str, Any]): Config of the authorized channel
+
+        Returns:
+            bool: False if the server type is no valid unit name
+        """
+        unit = SystemHandler.get_unit(server_config)
+        if not UNIT_PATTERN.match(unit):
+            logging.warning("Refusing to follow the journal of invalid unit %r", unit)
+            return False
+        for reader in self._readers.values():
+            if reader.unit != unit and reader.has_subscriber(channel.id):
+                # Server type changed since the last subscription
+                asyncio.get_running_loop().create_task(reader.unsubscribe(channel.id))
+        reader = self._readers.get(unit)
+        if reader is None:
+            reader = JournalReader(unit)
+            self._readers[unit] = reader
+        reader.subscribe(channel, server_config["console"])
+        return True
+
+    async def unsubscribe(self, channel_id: int) -> None:
+        """Unsubscribe a channel from all journals
+
+        Args:
+            channel_id (int): ID of the channel
+        """
+        for unit, reader in list(self._readers.items()):
+            await reader.unsubscribe(channel_id)
+            if not reader.subscribed:
+                del self._readers[unit]
+
+    def resume(self, get_channel: Callable[[int], Any]) -> None:
+        """Resubscribe all persisted console feeds, e.g. after a restart
+
+        Args:
+            get_channel (Callable[[int], Any]): Function returning a channel for an ID
+        """
+        for channel_id, server_config in self._auth_channels.items():
+            if not server_config.get("authorized") or not server_config.get("console"):
+                continue
+            channel = get_channel(int(channel_id))
+            if channel is not None:
+                self.subscribe(channel, server_config)
+
+    async def stop(self) -> None:
+        """Stop all journal readers"""
+        for reader in self._readers.values():
+            await reader.stop()
+        self._readers = {}
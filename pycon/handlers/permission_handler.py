@@ -0,0 +1,179 @@
+"""Permission handler
+
+Description:    Command auth stage enforcement based on Discord roles
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import logging
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+from discord import Guild, Member, Message
+
+from pycon.handlers.command_handler import CommandAuthStage, CommandContext
+
+STAGE_NAMES: Dict[str, CommandAuthStage] = {stage.name.lower(): stage for stage in CommandAuthStage}
+REMOVE_STAGE = "none"
+
+
+class PermissionHandler:
+    """Decide whether users may run commands of an auth stage.
+
+    Stages are granted by Discord roles per guild. For each guild, the role mapping is compiled
+    into one set of role IDs per stage, holding every role that grants at least that stage. A
+    check is then a single set intersection with the author's roles, which arrive with every
+    message. The compiled index is dropped whenever roles or the guild change.
+
+    Users listed in the sys auth file are BOSS everywhere, guild owners are at least HITMAN.
+
+    Args:
+        role_stages (Dict[str, Dict[str, int]]): Persisted role mapping, see
+            PersistenceHandler.get_role_stages
+        boss_users (Iterable[int]): IDs of users with auth stage BOSS
+    """
+    def __init__(self, role_stages: Dict[str, Dict[str, int]], boss_users: Iterable[int]) -> None:
+        self._role_stages = role_stages
+        self._boss_users: FrozenSet[int] = frozenset(boss_users)
+        self._index: Dict[int, Dict[CommandAuthStage, FrozenSet[int]]] = {}
+
+    def check(self, message: Message, stage: CommandAuthStage) -> bool:
+        """Check whether the author of a message has at least an auth stage
+
+        Args:
+            message (Message): Message with the command
+            stage (CommandAuthStage): Required auth stage
+
+        Returns:
+            bool: True if the author may run the command
+        """
+        return self.is_allowed(message.author, stage)
+
+    def is_allowed(self, user: Any, stage: CommandAuthStage) -> bool:
+        """Check whether a user or member has at least an auth stage
+
+        Args:
+            user (Any): Discord user or guild member
+            stage (CommandAuthStage): Required auth stage
+
+        Returns:
+            bool: True if the user has the auth stage
+        """
+        if stage == CommandAuthStage.CROOK or user.id in self._boss_users:
+            return True
+        if not isinstance(user, Member):
+            return False
+        if stage == CommandAuthStage.HITMAN and user.guild.owner_id == user.id:
+            return True
+        roles = self._get_index(user.guild)[stage]
+        return bool(roles) and not roles.isdisjoint(role.id for role in user.roles)
+
+    def is_authorized_user(self, user_id: int) -> bool:
+        """Check whether a user is listed in the sys auth file, i.e. BOSS in every guild
+
+        Args:
+            user_id (int): ID of the user
+
+        Returns:
+            bool: True for authorized users, regardless of their roles
+        """
+        return user_id in self._boss_users
+
+    def invalidate(self, guild_id: int) -> None:
+        """Drop the compiled role index of a guild
+
+        Args:
+            guild_id (int): ID of the guild
+        """
+        self._index.pop(guild_id, None)
+
+    def set_role_stage(
+        self, guild: Guild, role_id: int, stage: Optional[CommandAuthStage]
+    ) -> None:
+        """Grant an auth stage to a role or remove it
+
+        Args:
+            guild (Guild): Guild of the role
+            role_id (int): ID of the role
+            stage (Optional[CommandAuthStage]): Granted stage, None to remove the role
+        """
+        guild_roles = self._role_stages.setdefault(f"{guild.id}", {})
+        if stage is None:
+            guild_roles.pop(f"{role_id}", None)
+        else:
+            guild_roles[f"{role_id}"] = stage.value
+        self.invalidate(guild.id)
+
+    def load(self, role_stages: Dict[str, Dict[str, int]], boss_users: Iterable[int]) -> None:
+        """Replace the role mapping and the BOSS users, e.g. once they are loaded from persistence
+
+        Args:
+            role_stages (Dict[str, Dict[str, int]]): Persisted role mapping
+            boss_users (Iterable[int]): IDs of users with auth stage BOSS
+        """
+        self._role_stages.clear()
+        self._role_stages.update(role_stages)
+        self._boss_users = frozenset(boss_users)
+        self._index.clear()
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        """Get the role mapping in its persistence format
+
+        Returns:
+            Dict[str, Dict[str, int]]: Guild IDs mapped to role IDs and their auth stage values
+        """
+        return {guild_id: roles for guild_id, roles in self._role_stages.items() if roles}
+
+    async def handle_set_role(self, ctx: CommandContext) -> None:
+        """Handle the set-role command: ``set-role STAGE @ROLE...``
+
+        Args:
+            ctx (CommandContext): Command Context
+        """
+        if not ctx.message.guild:
+            await ctx.message.channel.send("Roles only exist in servers!")
+            return
+        stage_name = ctx.args[0].lower() if ctx.args else ""
+        if (
+            (stage_name not in STAGE_NAMES and stage_name != REMOVE_STAGE) or
+            not ctx.message.role_mentions
+        ):
+            await ctx.message.channel.send(
+                f"Use it like this: {ctx.prefix}{ctx.command} STAGE @ROLE\n"
+                f"STAGE is one of {', '.join(STAGE_NAMES)} or {REMOVE_STAGE}."
+            )
+            return
+        stage = STAGE_NAMES.get(stage_name)
+        for role in ctx.message.role_mentions:
+            self.set_role_stage(ctx.message.guild, role.id, stage)
+        roles: str = ", ".join(role.name for role in ctx.message.role_mentions)
+        logging.info("Roles %s of guild %d now have stage %s", roles, ctx.message.guild.id, stage)
+        await ctx.message.channel.send(
+            f"{roles} now grant{'s' if len(ctx.message.role_mentions) == 1 else ''} "
+            f"{stage.name if stage else 'no'} permissions."
+        )
+
+    def _get_index(self, guild: Guild) -> Dict[CommandAuthStage, FrozenSet[int]]:
+        """Get or build the role index of a guild
+
+        Args:
+            guild (Guild): Guild of the index
+
+        Returns:
+            Dict[CommandAuthStage, FrozenSet[int]]: Stages mapped to all role IDs granting at least
+                that stage
+        """
+        index = self._index.get(guild.id)
+        if index is None:
+            granted: Dict[CommandAuthStage, List[int]] = {stage: [] for stage in CommandAuthStage}
+            for role_id, value in self._role_stages.get(f"{guild.id}", {}).items():
+                if guild.get_role(int(role_id)) is None:
+                    # Deleted role, its ID might never show up again
+                    continue
+                for stage in CommandAuthStage:
+                    if stage.value <= value:
+                        granted[stage].append(int(role_id))
+            index = {stage: frozenset(role_ids) for stage, role_ids in granted.items()}
+            self._index[guild.id] = index
+        return index
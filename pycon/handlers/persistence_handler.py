@@ -10,14 +10,25 @@ Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
 import json
 import logging
 import os
+import sqlite3
+from contextlib import closing
 from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
-BASE_PATH = Path.home() / ".local/share/pycon"
+DATA_DIR_VAR = "PYCON_DATA_DIR"
+BASE_PATH = Path(os.getenv(DATA_DIR_VAR) or Path.home() / ".local/share/pycon")
 CHANNEL_AUTH_FILE = BASE_PATH / "auth_channels.json"
 PREFIX_FILE = BASE_PATH / "prefixes.json"
 SYS_AUTH_FILE = BASE_PATH / "authorized_users.json"
+SCHEDULE_FILE = BASE_PATH / "schedules.json"
+ROLE_STAGE_FILE = BASE_PATH / "role_stages.json"
+AUDIT_PATH = BASE_PATH / "audit"
+STATS_FILE = BASE_PATH / "stats.bin"
+SQLITE_FILE = BASE_PATH / "pycon.sqlite"
+STREAM_CHUNK_SIZE = 64 * 1024
+NUMBER_CHARS = frozenset("0123456789.eE+-")
+SQLITE_BATCH_SIZE = 1000
 
 
 class PersistenceMethod(Enum):
@@ -30,6 +41,26 @@ class PersistenceMethod(Enum):
     SQLITE = "sqlite"
 
 
+class PersistenceKind(Enum):
+    """Kind of persisted state that can be streamed between persistence methods
+
+    Args:
+        Enum (str): Enum values represent JSON file names and SQLite table names
+    """
+    CHANNELS = "auth_channels"
+    PREFIXES = "prefixes"
+    USERS = "authorized_users"
+
+
+SQLITE_SCHEMAS: Dict[PersistenceKind, str] = {
+    PersistenceKind.CHANNELS: "CREATE TABLE IF NOT EXISTS auth_channels "
+                              "(id TEXT PRIMARY KEY, config TEXT NOT NULL)",
+    PersistenceKind.PREFIXES: "CREATE TABLE IF NOT EXISTS prefixes "
+                              "(id TEXT PRIMARY KEY, prefix TEXT NOT NULL)",
+    PersistenceKind.USERS: "CREATE TABLE IF NOT EXISTS authorized_users (id INTEGER PRIMARY KEY)",
+}
+
+
 class PersistenceHandler:
     """Persistence facade to save information"""
     @staticmethod
@@ -57,7 +88,7 @@ class PersistenceHandler:
                 content = auth_file.read()
                 channels = json.loads(content) if content else {}
         elif method == PersistenceMethod.SQLITE:
-            logging.warning("No SQLITE Implementation yet!")
+            channels = dict(PersistenceHandler.iter_entries(PersistenceKind.CHANNELS, method))
 
         return channels
 
@@ -84,7 +115,7 @@ class PersistenceHandler:
                 content: str = prefix_file.read()
                 prefixes = json.loads(content)
         elif method == PersistenceMethod.SQLITE:
-            logging.warning("No SQLITE Implementation yet!")
+            prefixes = dict(PersistenceHandler.iter_entries(PersistenceKind.PREFIXES, method))
 
         return prefixes
 
@@ -104,7 +135,9 @@ class PersistenceHandler:
             with open(CHANNEL_AUTH_FILE, "w", encoding="utf-8") as auth_file:
                 auth_file.write(json.dumps(channels))
         elif method == PersistenceMethod.SQLITE:
-            logging.warning("No SQLITE Implementation yet!")
+            PersistenceHandler.write_entries(
+                PersistenceKind.CHANNELS, iter(channels.items()), method
+            )
 
     @staticmethod
     def save_prefixes(
@@ -123,7 +156,9 @@ class PersistenceHandler:
             with open(PREFIX_FILE, "w", encoding="utf-8") as prefix_file:
                 prefix_file.write(json.dumps(prefix_dict))
         elif method == PersistenceMethod.SQLITE:
-            logging.warning("No SQLITE Implementation yet!")
+            PersistenceHandler.write_entries(
+                PersistenceKind.PREFIXES, iter(prefix_dict.items()), method
+            )
 
     @staticmethod
     def get_authorized_users(method: PersistenceMethod = PersistenceMethod.JSON) -> List[int]:
@@ -147,5 +182,323 @@ class PersistenceHandler:
                 content: str = sys_auth.read()
                 auths = json.loads(content)
         elif method == PersistenceMethod.SQLITE:
-            logging.warning("No SQLITE Implementation yet!")
+            auths = [
+                user for _, user in PersistenceHandler.iter_entries(PersistenceKind.USERS, method)
+            ]
         return auths
+
+    @staticmethod
+    def get_schedules(
+        method: PersistenceMethod = PersistenceMethod.JSON
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Get all scheduled commands, mapped to the IDs of their channels
+
+        Args:
+            method (PersistenceMethod, optional): Method that is preferred to get persistence from.
+                Defaults to PersistenceMethod.JSON.
+
+        Returns:
+            Dict[str, List[Dict[str, Any]]]: Channel IDs mapped to their scheduled commands
+        """
+        logging.debug("Getting schedules with method %s", method.name)
+        schedules: Dict[str, List[Dict[str, Any]]] = {}
+        if method == PersistenceMethod.JSON:
+            if not SCHEDULE_FILE.exists():
+                logging.info("Schedule file not found, creating one at %s", SCHEDULE_FILE)
+                with open(SCHEDULE_FILE, "w", encoding="utf-8") as schedule_file:
+                    schedule_file.write(json.dumps(schedules))
+                return schedules
+            with open(SCHEDULE_FILE, "r", encoding="utf-8") as schedule_file:
+                content: str = schedule_file.read()
+                schedules = json.loads(content) if content else {}
+        elif method == PersistenceMethod.SQLITE:
+            logging.warning("No SQLITE Implementation yet!")
+        return schedules
+
+    @staticmethod
+    def save_schedules(
+        schedules: Dict[str, List[Dict[str, Any]]],
+        method: PersistenceMethod = PersistenceMethod.JSON
+    ):
+        """Persist all scheduled commands
+
+        Args:
+            schedules (Dict[str, List[Dict[str, Any]]]): Channel IDs mapped to their scheduled
+                commands
+            method (PersistenceMethod, optional): Method that is preferred to persist data.
+                Defaults to PersistenceMethod.JSON.
+        """
+        if method == PersistenceMethod.JSON:
+            logging.debug("Saving schedules to %s", SCHEDULE_FILE)
+            with open(SCHEDULE_FILE, "w", encoding="utf-8") as schedule_file:
+                schedule_file.write(json.dumps(schedules))
+        elif method == PersistenceMethod.SQLITE:
+            logging.warning("No SQLITE Implementation yet!")
+
+    @staticmethod
+    def get_role_stages(
+        method: PersistenceMethod = PersistenceMethod.JSON
+    ) -> Dict[str, Dict[str, int]]:
+        """Get the command auth stages granted by roles, per Server/Guild
+
+        Args:
+            method (PersistenceMethod, optional): Method that is preferred to get persistence from.
+                Defaults to PersistenceMethod.JSON.
+
+        Returns:
+            Dict[str, Dict[str, int]]: Guild IDs mapped to role IDs and their auth stage values
+        """
+        logging.debug("Getting role stages with method %s", method.name)
+        role_stages: Dict[str, Dict[str, int]] = {}
+        if method == PersistenceMethod.JSON:
+            if not ROLE_STAGE_FILE.exists():
+                logging.info("Role stage file not found, creating one at %s", ROLE_STAGE_FILE)
+                with open(ROLE_STAGE_FILE, "w", encoding="utf-8") as role_file:
+                    role_file.write(json.dumps(role_stages))
+                return role_stages
+            with open(ROLE_STAGE_FILE, "r", encoding="utf-8") as role_file:
+                content: str = role_file.read()
+                role_stages = json.loads(content) if content else {}
+        elif method == PersistenceMethod.SQLITE:
+            logging.warning("No SQLITE Implementation yet!")
+        return role_stages
+
+    @staticmethod
+    def save_role_stages(
+        role_stages: Dict[str, Dict[str, int]],
+        method: PersistenceMethod = PersistenceMethod.JSON
+    ):
+        """Persist the command auth stages granted by roles
+
+        Args:
+            role_stages (Dict[str, Dict[str, int]]): Guild IDs mapped to role IDs and their auth
+                stage values
+            method (PersistenceMethod, optional): Method that is preferred to persist data.
+                Defaults to PersistenceMethod.JSON.
+        """
+        if method == PersistenceMethod.JSON:
+            logging.debug("Saving role stages to %s", ROLE_STAGE_FILE)
+            with open(ROLE_STAGE_FILE, "w", encoding="utf-8") as role_file:
+                role_file.write(json.dumps(role_stages))
+        elif method == PersistenceMethod.SQLITE:
+            logging.warning("No SQLITE Implementation yet!")
+
+    @staticmethod
+    def get_stats() -> bytes:
+        """Get the persisted time series of all servers
+
+        Returns:
+            bytes: Binary stats as written by StatsHandler.to_bytes, empty if there are none
+        """
+        logging.debug("Getting stats from %s", STATS_FILE)
+        if not STATS_FILE.exists():
+            return b""
+        with open(STATS_FILE, "rb") as stats_file:
+            return stats_file.read()
+
+    @staticmethod
+    def save_stats(stats: bytes):
+        """Persist the time series of all servers
+
+        Args:
+            stats (bytes): Binary stats as written by StatsHandler.to_bytes
+        """
+        logging.debug("Saving stats to %s", STATS_FILE)
+        tmp_file = STATS_FILE.with_suffix(".tmp")
+        with open(tmp_file, "wb") as stats_file:
+            stats_file.write(stats)
+        os.replace(tmp_file, STATS_FILE)
+
+    @staticmethod
+    def get_path(
+        kind: PersistenceKind, method: PersistenceMethod, base_path: Path = BASE_PATH
+    ) -> Path:
+        """Get the file that persists a kind of state
+
+        Args:
+            kind (PersistenceKind): Kind of state
+            method (PersistenceMethod): Method of persistence
+            base_path (Path, optional): Directory of the files. Defaults to BASE_PATH.
+
+        Returns:
+            Path: JSON file of the kind or the SQLite database
+        """
+        if method == PersistenceMethod.SQLITE:
+            return base_path / SQLITE_FILE.name
+        return base_path / f"{kind.value}.{method.value}"
+
+    @staticmethod
+    def iter_entries(
+        kind: PersistenceKind, method: PersistenceMethod, base_path: Path = BASE_PATH
+    ) -> Iterator[Tuple[Optional[str], Any]]:
+        """Stream persisted entries one by one, without loading the whole state into memory
+
+        Args:
+            kind (PersistenceKind): Kind of state
+            method (PersistenceMethod): Method of persistence
+            base_path (Path, optional): Directory of the files. Defaults to BASE_PATH.
+
+        Yields:
+            Tuple[Optional[str], Any]: Key and value of an entry. Authorized users have no key.
+        """
+        path = PersistenceHandler.get_path(kind, method, base_path)
+        if not path.exists():
+            logging.info("%s not found, nothing to read", path)
+            return
+        if method == PersistenceMethod.JSON:
+            with open(path, "r", encoding="utf-8") as json_file:
+                yield from _iter_json(json_file)
+            return
+        with closing(sqlite3.connect(path)) as connection:
+            connection.execute(SQLITE_SCHEMAS[kind])
+            if kind == PersistenceKind.CHANNELS:
+                rows = connection.execute("SELECT id, config FROM auth_channels")
+                for channel_id, config in rows:
+                    yield channel_id, json.loads(config)
+            elif kind == PersistenceKind.PREFIXES:
+                yield from connection.execute("SELECT id, prefix FROM prefixes")
+            else:
+                for (user,) in connection.execute("SELECT id FROM authorized_users"):
+                    yield None, user
+
+    @staticmethod
+    def write_entries(
+        kind: PersistenceKind,
+        entries: Iterator[Tuple[Optional[str], Any]],
+        method: PersistenceMethod,
+        base_path: Path = BASE_PATH,
+    ) -> int:
+        """Replace the persisted state of a kind with streamed entries
+
+        JSON files are written to a temporary file first, so a file may be rewritten while its
+        entries are still streamed from it.
+
+        Args:
+            kind (PersistenceKind): Kind of state
+            entries (Iterator[Tuple[Optional[str], Any]]): Entries as yielded by iter_entries
+            method (PersistenceMethod): Method of persistence
+            base_path (Path, optional): Directory of the files. Defaults to BASE_PATH.
+
+        Returns:
+            int: Number of written entries
+        """
+        path = PersistenceHandler.get_path(kind, method, base_path)
+        os.makedirs(path.parent, exist_ok=True)
+        count = 0
+        if method == PersistenceMethod.JSON:
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as json_file:
+                is_list = kind == PersistenceKind.USERS
+                json_file.write("[" if is_list else "{")
+                for key, value in entries:
+                    json_file.write(", " if count else "")
+                    if not is_list:
+                        json_file.write(f"{json.dumps(key)}: ")
+                    json_file.write(json.dumps(value))
+                    count += 1
+                json_file.write("]" if is_list else "}")
+            os.replace(tmp_path, path)
+            return count
+        with closing(sqlite3.connect(path)) as connection:
+            # WAL lets the entries be streamed from the same database while it is rewritten
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.execute(SQLITE_SCHEMAS[kind])
+                connection.execute(f"DELETE FROM {kind.value}")
+                batch: List[Tuple[Any, ...]] = []
+                for key, value in entries:
+                    if kind == PersistenceKind.CHANNELS:
+                        batch.append((key, json.dumps(value)))
+                    elif kind == PersistenceKind.PREFIXES:
+                        batch.append((key, value))
+                    else:
+                        batch.append((value,))
+                    count += 1
+                    if len(batch) >= SQLITE_BATCH_SIZE:
+                        PersistenceHandler._insert(connection, kind, batch)
+                        batch = []
+                PersistenceHandler._insert(connection, kind, batch)
+        return count
+
+    @staticmethod
+    def _insert(
+        connection: sqlite3.Connection, kind: PersistenceKind, rows: Iterable[Tuple[Any, ...]]
+    ) -> None:
+        placeholders = ", ".join("?" * (1 if kind == PersistenceKind.USERS else 2))
+        connection.executemany(
+            f"INSERT OR REPLACE INTO {kind.value} VALUES ({placeholders})", rows
+        )
+
+
+def _iter_json(json_file: TextIO) -> Iterator[Tuple[Optional[str], Any]]:
+    """Incrementally parse the top level object or list of a JSON file
+
+    Only one entry and one read chunk are held in memory at a time.
+
+    Args:
+        json_file (TextIO): Opened JSON file
+
+    Raises:
+        ValueError: If the file is no JSON object or list
+
+    Yields:
+        Tuple[Optional[str], Any]: Keys and values of an object, or None and the items of a list
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def peek() -> str:
+        nonlocal buffer, pos, eof
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            chunk = json_file.read(STREAM_CHUNK_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+
+    def decode() -> Any:
+        nonlocal buffer, pos, eof
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A number is only complete once a character follows that can't continue it.
+                # Otherwise "1" could be decoded from a chunk ending in "1" of "1.5".
+                if eof or (end < len(buffer) and buffer[end] not in NUMBER_CHARS):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            chunk = json_file.read(STREAM_CHUNK_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+
+    def expect(char: str) -> None:
+        nonlocal pos
+        if peek() != char:
+            raise ValueError(f"Expected {char!r} in JSON stream, got {peek()!r}")
+        pos += 1
+
+    start = peek()
+    if start not in ("{", "["):
+        if not start:
+            return
+        raise ValueError("JSON stream has to contain an object or a list")
+    end = "}" if start == "{" else "]"
+    pos += 1
+    first = True
+    while True:
+        if peek() == end:
+            return
+        if not first:
+            expect(",")
+        first = False
+        if start == "{":
+            key = decode()
+            expect(":")
+            yield key, decode()
+        else:
+            yield None, decode()
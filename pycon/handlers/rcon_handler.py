@@ -0,0 +1,203 @@
+"""RCON handler
+
+Description:    Asynchronous access to the RCON servers of authorized channels
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+from pycon.handlers.dns_handler import DNSResolver
+from pycon.handlers.health_handler import HealthHandler
+from pycon.handlers.transport_handler import AuthenticationError, RCONTransport, get_transport
+
+DEFAULT_TIMEOUT = 10.0
+PROBE_TIMEOUT = 5.0
+
+
+class RCONHandler:
+    """Run commands on the RCON server of an authorized channel without blocking the event loop
+
+    Every endpoint is spoken to by one transport, chosen by the server type of the channel config
+    and kept open between commands. A transport that is replaced, e.g. after the password of the
+    channel changed, is closed once the commands running on it are done. Connection failures are
+    tracked per endpoint by a HealthHandler, so commands to servers that are known to be down fail
+    fast with a ServerUnavailableError.
+
+    Args:
+        resolver (DNSResolver): Shared resolver for RCON hostnames
+        timeout (float, optional): Default timeout of a command in seconds.
+            Defaults to DEFAULT_TIMEOUT.
+    """
+    def __init__(self, resolver: DNSResolver, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self._resolver = resolver
+        self._timeout = timeout
+        self._health = HealthHandler()
+        self._transports: Dict[Tuple[str, int], RCONTransport] = {}
+        self._locks: Dict[Tuple[str, int], asyncio.Lock] = {}
+        # Commands running on each transport, and replaced transports that still run commands
+        self._users: Dict[RCONTransport, int] = {}
+        self._retired: Set[RCONTransport] = set()
+        self._closing: Set[asyncio.Task] = set()
+
+    async def run(
+        self, creds: Dict[str, Any], command: str, *args: str, timeout: Optional[float] = None
+    ) -> str:
+        """Run a command on the server of a channel config
+
+        Args:
+            creds (Dict[str, Any]): Channel config with rcon, port, password and type
+            command (str): Command without prefix
+            *args (str): Arguments of the command
+            timeout (Optional[float], optional): Timeout in seconds. Defaults to the handler's
+                timeout.
+
+        Raises:
+            ServerUnavailableError: If the server is known to be down
+            ConnectionRefusedError: If the server does not accept the connection
+            socket.gaierror: If the host could not be resolved
+            asyncio.TimeoutError: If the command did not finish in time
+            AuthenticationError: If the server rejected the password
+
+        Returns:
+            str: Response of the server
+        """
+        timeout = timeout if timeout is not None else self._timeout
+        breaker = self._health.get(creds["rcon"], creds["port"])
+        breaker.check()
+        full_command = " ".join((f"{RCONHandler.command_prefix(creds)}{command}", *args))
+        try:
+            async with self._use_transport(creds) as transport:
+                logging.debug("Running %s on %s:%s", full_command, transport.host, transport.port)
+                response = await asyncio.wait_for(transport.run(full_command), timeout=timeout)
+        except (OSError, asyncio.TimeoutError):
+            breaker.record_failure(lambda: self._probe(creds))
+            raise
+        breaker.record_success()
+        return response
+
+    async def check(self, creds: Dict[str, Any], timeout: Optional[float] = None) -> bool:
+        """Connect and log in to the server of a channel config without running a command
+
+        Args:
+            creds (Dict[str, Any]): Channel config with rcon, port, password and type
+            timeout (Optional[float], optional): Timeout in seconds. Defaults to the handler's
+                timeout.
+
+        Raises:
+            ConnectionRefusedError: If the server does not accept the connection
+            socket.gaierror: If the host could not be resolved
+            asyncio.TimeoutError: If the login did not finish in time
+            AuthenticationError: If the server rejected the password
+
+        Returns:
+            bool: True if a connection was opened, False if the transport was connected already
+        """
+        async with self._use_transport(creds) as transport:
+            return await asyncio.wait_for(
+                transport.connect(), timeout=timeout if timeout is not None else self._timeout
+            )
+
+    async def get_transport(self, creds: Dict[str, Any]) -> RCONTransport:
+        """Get the transport of the server of a channel config
+
+        The transport of an endpoint is reused as long as its protocol, address and password stay
+        the same. Otherwise it is replaced, and closed once no command runs on it anymore.
+
+        Args:
+            creds (Dict[str, Any]): Channel config with rcon, port, password and type
+
+        Raises:
+            socket.gaierror: If the host could not be resolved
+
+        Returns:
+            RCONTransport: Transport of the endpoint, connected on first use
+        """
+        port = int(creds["port"])
+        key = (creds["rcon"], port)
+        # Concurrent first commands to an endpoint must not open one transport each
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            address: str = await self._resolver.resolve(creds["rcon"], port)
+            transport_type = get_transport(creds.get("type"))
+            transport = self._transports.get(key)
+            if (
+                transport is None
+                or type(transport) is not transport_type
+                or transport.host != address
+                or transport.password != creds["password"]
+            ):
+                previous = transport
+                transport = transport_type(address, port, creds["password"])
+                self._transports[key] = transport
+                if previous is not None:
+                    self._retire(previous)
+            return transport
+
+    @asynccontextmanager
+    async def _use_transport(self, creds: Dict[str, Any]) -> AsyncIterator[RCONTransport]:
+        """Get the transport of a channel config and keep it open while it is used
+
+        Args:
+            creds (Dict[str, Any]): Channel config with rcon, port, password and type
+
+        Yields:
+            RCONTransport: Transport of the endpoint
+        """
+        transport = await self.get_transport(creds)
+        self._users[transport] = self._users.get(transport, 0) + 1
+        try:
+            yield transport
+        finally:
+            self._users[transport] -= 1
+            if not self._users[transport]:
+                del self._users[transport]
+                if transport in self._retired:
+                    self._retire(transport)
+
+    def _retire(self, transport: RCONTransport) -> None:
+        """Close a replaced transport, or mark it to be closed after its last running command
+
+        Args:
+            transport (RCONTransport): Replaced transport
+        """
+        if transport in self._users:
+            self._retired.add(transport)
+            return
+        self._retired.discard(transport)
+        task = asyncio.get_running_loop().create_task(transport.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _probe(self, creds: Dict[str, Any]) -> None:
+        """Check whether the server of a channel config accepts logins again
+
+        Args:
+            creds (Dict[str, Any]): Channel config with rcon, port, password and type
+
+        Raises:
+            OSError: If the endpoint is unreachable
+            asyncio.TimeoutError: If the login timed out
+        """
+        self._resolver.invalidate(creds["rcon"])
+        try:
+            await self.check(creds, timeout=PROBE_TIMEOUT)
+        except AuthenticationError:
+            # The server answers, only the password is wrong
+            pass
+
+    @staticmethod
+    def command_prefix(creds: Dict[str, Any]) -> str:
+        """Get the prefix the server of a channel config expects in front of commands
+
+        Args:
+            creds (Dict[str, Any]): Channel config
+
+        Returns:
+            str: Command prefix of the registered transport, e.g. "/" for Minecraft
+        """
+        return get_transport(creds.get("type")).command_prefix
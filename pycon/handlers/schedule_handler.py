@@ -0,0 +1,385 @@
+"""Schedule handler
+
+Description:    Recurring RCON commands, driven by a single heap-based timer
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+import re
+import socket
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import discord
+
+from pycon.handlers.command_handler import CommandAuthStage, CommandContext
+from pycon.handlers.permission_handler import PermissionHandler
+from pycon.handlers.rcon_handler import RCONHandler
+from pycon.handlers.transport_handler import AuthenticationError
+
+MIN_INTERVAL = 10
+MAX_JOBS_PER_CHANNEL = 25
+MAX_CONCURRENT_RUNS = 16
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+INTERVAL_PATTERN = re.compile(r"^(\d+)([smhd])$")
+
+
+@dataclass
+class ScheduledCommand:
+    """A recurring RCON command of an authorized channel"""
+    job_id: int
+    channel_id: str
+    interval: int
+    command: str
+    args: List[str] = field(default_factory=list)
+    next_run: float = 0.0
+    author: int = 0
+
+
+class ScheduleHandler:
+    """Run scheduled RCON commands of all authorized channels.
+
+    All jobs share one timer task that sleeps until the earliest due time of a min-heap. Removed
+    or rescheduled jobs leave stale heap entries behind, which are skipped when popped.
+
+    Runs missed while the bot was offline are coalesced: an overdue job runs once right after
+    start and then continues on its original cadence, without replaying every missed run.
+
+    Args:
+        auth_channels (Dict[str, Any]): Pycon client's authorized channels
+        rcon_handler (RCONHandler): Handler to run RCON commands with
+        schedules (Dict[str, List[Dict[str, Any]]]): Persisted schedules, see
+            PersistenceHandler.get_schedules
+    """
+    def __init__(
+        self,
+        auth_channels: Dict[str, Any],
+        rcon_handler: RCONHandler,
+        permission_handler: PermissionHandler,
+        schedules: Dict[str, List[Dict[str, Any]]],
+    ) -> None:
+        self._auth_channels = auth_channels
+        self._rcon_handler = rcon_handler
+        self._permission_handler = permission_handler
+        self._jobs: Dict[int, ScheduledCommand] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._running: Set[asyncio.Task] = set()
+        self._get_channel: Callable[[int], Any] = lambda channel_id: None
+        self.load(schedules)
+
+    def load(self, schedules: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Add persisted schedules to the timer
+
+        Args:
+            schedules (Dict[str, List[Dict[str, Any]]]): Channel IDs mapped to their schedules
+        """
+        for jobs in schedules.values():
+            for job in jobs:
+                self._push(ScheduledCommand(**job))
+
+    def to_dict(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Get all schedules in their persistence format
+
+        Returns:
+            Dict[str, List[Dict[str, Any]]]: Channel IDs mapped to their schedules
+        """
+        schedules: Dict[str, List[Dict[str, Any]]] = {}
+        for job in self._jobs.values():
+            schedules.setdefault(job.channel_id, []).append(asdict(job))
+        return schedules
+
+    def start(self, get_channel: Callable[[int], Any]) -> None:
+        """Start the timer task. Has to be called from a running event loop.
+
+        Args:
+            get_channel (Callable[[int], Any]): Function returning a channel for an ID
+        """
+        self._get_channel = get_channel
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_RUNS)
+            self._task = asyncio.get_running_loop().create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        """Stop the timer task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def handle_schedule(self, ctx: CommandContext) -> None:
+        """Handle the schedule command:
+        ``schedule add INTERVAL COMMAND [ARGS]``, ``schedule list`` or ``schedule remove ID``
+
+        Args:
+            ctx (CommandContext): Command Context
+        """
+        channel_id = f"{ctx.message.channel.id}"
+        channel_cfg = self._auth_channels.get(channel_id)
+        if not channel_cfg or not channel_cfg["authorized"]:
+            await ctx.message.channel.send("This Channel is not yet authorized.")
+            return
+        action = ctx.args[0].lower() if ctx.args else ""
+        if action == "add" and len(ctx.args) > 2:
+            await self._command_add(ctx, channel_id)
+        elif action == "list":
+            await ctx.message.channel.send(self._list(channel_id))
+        elif action == "remove" and len(ctx.args) > 1:
+            await self._command_remove(ctx, channel_id)
+        else:
+            await ctx.message.channel.send(
+                f"Use it like this:\n"
+                f"{ctx.prefix}{ctx.command} add INTERVAL COMMAND [ARGS] (e.g. 30m save-all)\n"
+                f"{ctx.prefix}{ctx.command} list\n"
+                f"{ctx.prefix}{ctx.command} remove ID"
+            )
+
+    def add(
+        self, channel_id: str, interval: int, command: str, args: List[str], author: int = 0
+    ) -> ScheduledCommand:
+        """Schedule a command, first run after one interval
+
+        Args:
+            channel_id (str): ID of the authorized channel
+            interval (int): Seconds between two runs
+            command (str): RCON command
+            args (List[str]): Arguments of the command
+            author (int, optional): ID of the user that scheduled the command. Defaults to 0.
+
+        Returns:
+            ScheduledCommand: The new job
+        """
+        job_id = max(self._jobs, default=0) + 1
+        job = ScheduledCommand(
+            job_id, channel_id, interval, command, args, time.time() + interval, author
+        )
+        self._push(job)
+        return job
+
+    def remove(self, job_id: int) -> Optional[ScheduledCommand]:
+        """Unschedule a command. Its heap entry is skipped once it becomes due.
+
+        Args:
+            job_id (int): ID of the job
+
+        Returns:
+            Optional[ScheduledCommand]: The removed job, if it existed
+        """
+        job = self._jobs.pop(job_id, None)
+        if len(self._heap) > 2 * len(self._jobs) + MAX_JOBS_PER_CHANNEL:
+            # Drop stale entries, so removed jobs don't pile up in the heap
+            self._heap = [(job.next_run, job.job_id) for job in self._jobs.values()]
+            heapq.heapify(self._heap)
+        return job
+
+    def _push(self, job: ScheduledCommand) -> None:
+        self._jobs[job.job_id] = job
+        if not self._heap or job.next_run < self._heap[0][0]:
+            # New earliest job: the timer has to wake up earlier than planned
+            if self._wakeup is not None:
+                self._wakeup.set()
+        heapq.heappush(self._heap, (job.next_run, job.job_id))
+
+    async def _run_loop(self) -> None:
+        """Sleep until the next job is due, run all due jobs and reschedule them"""
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                due, job_id = heapq.heappop(self._heap)
+                job = self._jobs.get(job_id)
+                if job is None or job.next_run != due:
+                    # Removed or rescheduled since this entry was pushed
+                    continue
+                missed = math.floor((now - due) / job.interval) + 1
+                job.next_run = due + missed * job.interval
+                heapq.heappush(self._heap, (job.next_run, job_id))
+                task = asyncio.get_running_loop().create_task(self._execute(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job: ScheduledCommand) -> None:
+        """Run a job on its server and post non-empty responses into its channel
+
+        Args:
+            job (ScheduledCommand): Job to be run
+        """
+        creds = self._auth_channels.get(job.channel_id)
+        if not creds or not creds.get("authorized"):
+            logging.debug("Skipping job %d of unauthorized channel %s", job.job_id, job.channel_id)
+            return
+        channel = self._get_channel(int(job.channel_id))
+        is_stop = ScheduleHandler.is_stop(job.command, job.args)
+        if is_stop and not await self._is_boss(job, channel):
+            logging.warning(
+                "Skipping job %d: user %d may no longer stop the server", job.job_id, job.author
+            )
+            if channel is not None:
+                try:
+                    await channel.send(
+                        f"Skipped scheduled `{job.command}` (ID {job.job_id}). <@{job.author}> "
+                        f"may no longer stop the server."
+                    )
+                except discord.errors.HTTPException as err:
+                    logging.error("Could not post skip of job %d: %s", job.job_id, err)
+            return
+        async with self._semaphore:
+            logging.debug("Running scheduled job %d: %s %s", job.job_id, job.command, job.args)
+            try:
+                response = await self._rcon_handler.run(creds, job.command, *job.args)
+            except asyncio.TimeoutError as err:
+                logging.error("Scheduled job %d timed out: %s", job.job_id, err)
+                response = f"Scheduled `{job.command}` failed. The server took too long to answer."
+            except AuthenticationError as err:
+                logging.error("Scheduled job %d failed to log in: %s", job.job_id, err)
+                response = (
+                    f"Scheduled `{job.command}` failed. The server rejected the RCON password."
+                )
+            except (ConnectionRefusedError, socket.gaierror, OSError) as err:
+                logging.error("Scheduled job %d failed: %s", job.job_id, err)
+                response = f"Scheduled `{job.command}` failed. Is the server running?"
+        if response and channel is not None:
+            try:
+                await channel.send(response[:2000])
+            except discord.errors.HTTPException as err:
+                logging.error("Could not post result of job %d: %s", job.job_id, err)
+
+    async def _command_add(self, ctx: CommandContext, channel_id: str) -> None:
+        interval = ScheduleHandler.parse_interval(ctx.args[1])
+        if interval is None or interval < MIN_INTERVAL:
+            await ctx.message.channel.send(
+                f"Invalid interval. Use a number followed by s, m, h or d "
+                f"of at least {MIN_INTERVAL} seconds (e.g. 30m)."
+            )
+            return
+        if sum(1 for job in self._jobs.values() if job.channel_id == channel_id) >= (
+            MAX_JOBS_PER_CHANNEL
+        ):
+            await ctx.message.channel.send(
+                f"This channel already has {MAX_JOBS_PER_CHANNEL} scheduled commands."
+            )
+            return
+        if (
+            ScheduleHandler.is_stop(ctx.args[2], ctx.args[3:]) and
+            not self._permission_handler.is_allowed(ctx.message.author, CommandAuthStage.BOSS)
+        ):
+            await ctx.message.channel.send("Nah bro u aint scheduling a stop now dawg")
+            return
+        job = self.add(channel_id, interval, ctx.args[2], ctx.args[3:], ctx.message.author.id)
+        await ctx.message.channel.send(
+            f"Scheduled `{' '.join(ctx.args[2:])}` every {ctx.args[1]} (ID {job.job_id})."
+        )
+
+    async def _command_remove(self, ctx: CommandContext, channel_id: str) -> None:
+        job = self._jobs.get(int(ctx.args[1])) if ctx.args[1].isdigit() else None
+        if job is None or job.channel_id != channel_id:
+            await ctx.message.channel.send(f"No scheduled command with ID {ctx.args[1]} here.")
+            return
+        self.remove(job.job_id)
+        await ctx.message.channel.send(f"Removed scheduled command {job.job_id}.")
+
+    def _list(self, channel_id: str) -> str:
+        jobs = sorted(
+            (job for job in self._jobs.values() if job.channel_id == channel_id),
+            key=lambda job: job.next_run,
+        )
+        if not jobs:
+            return "No scheduled commands in this channel."
+        lines: List[str] = []
+        for job in jobs:
+            lines.append(
+                f"**{job.job_id}** every {ScheduleHandler.format_interval(job.interval)}, "
+                f"next <t:{int(job.next_run)}:R>: `{' '.join([job.command, *job.args])}`"
+            )
+        return "\n".join(lines)[:2000]
+
+    async def _is_boss(self, job: ScheduledCommand, channel: Any) -> bool:
+        """Check whether the author of a job still has auth stage BOSS
+
+        Args:
+            job (ScheduledCommand): Scheduled job
+            channel (Any): Channel of the job, None if unknown
+
+        Returns:
+            bool: True if the author may stop the server
+        """
+        if self._permission_handler.is_authorized_user(job.author):
+            return True
+        guild = getattr(channel, "guild", None)
+        if guild is None:
+            return False
+        author = guild.get_member(job.author)
+        if author is None:
+            # Without the members intent the member cache is empty, the roles have to be fetched
+            try:
+                author = await guild.fetch_member(job.author)
+            except discord.NotFound:
+                # Left the guild
+                return False
+            except discord.HTTPException as err:
+                logging.error("Could not fetch author of job %d: %s", job.job_id, err)
+                return False
+        return self._permission_handler.is_allowed(author, CommandAuthStage.BOSS)
+
+    @staticmethod
+    def is_stop(command: str, args: List[str]) -> bool:
+        """Check whether a command could stop the server
+
+        Args:
+            command (str): RCON command
+            args (List[str]): Arguments of the command
+
+        Returns:
+            bool: True if the command or one of its arguments contains "stop"
+        """
+        return any("stop" in part.lower() for part in (command, *args))
+
+    @staticmethod
+    def parse_interval(interval: str) -> Optional[int]:
+        """Parse an interval like "90s", "30m", "12h" or "1d"
+
+        Args:
+            interval (str): Interval string
+
+        Returns:
+            Optional[int]: Interval in seconds, None if invalid
+        """
+        match = INTERVAL_PATTERN.match(interval.lower())
+        if not match:
+            return None
+        return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+    @staticmethod
+    def format_interval(seconds: int) -> str:
+        """Format seconds with the largest unit that divides them
+
+        Args:
+            seconds (int): Interval in seconds
+
+        Returns:
+            str: Interval string, e.g. "30m"
+        """
+        for unit, factor in sorted(INTERVAL_UNITS.items(), key=lambda item: -item[1]):
+            if seconds % factor == 0:
+                return f"{seconds // factor}{unit}"
+        return f"{seconds}s"
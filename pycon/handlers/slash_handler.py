@@ -0,0 +1,453 @@
+"""Slash command handler
+
+Description:    Application (slash) commands with deferred responses and cached autocomplete
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Pattern, Set, Tuple
+
+import discord
+from discord import app_commands
+
+from pycon.handlers.command_handler import BotCommand, CommandContext, CommandHandler
+from pycon.handlers.journal_handler import CONSOLE_PATTERNS
+from pycon.handlers.permission_handler import REMOVE_STAGE, STAGE_NAMES
+from pycon.handlers.stats_handler import PLAYER_QUERIES
+
+SLASH_PREFIX = "/"
+RECENT_COMMANDS = 25
+MAX_CHOICES = 25
+MAX_CHOICE_LENGTH = 100
+# Player names are only suggested while the player queries of the stats handler keep them fresh
+PLAYERS_TTL = 300.0
+MENTION_PATTERN: Pattern = re.compile(r"<(@&|@!?|#)(\d+)>")
+# Player names in the responses of PLAYER_QUERIES, with the separator between names on one line
+PLAYER_NAME_PATTERNS: Dict[str, Tuple[Pattern, Optional[str]]] = {
+    "minecraft": (re.compile(r"online:(.*)$", re.M), ","),
+    "ark": (re.compile(r"^\d+\. (.+?), \S+$", re.M), None),
+}
+STATS_WINDOWS = ["30m", "1h", "6h", "24h", "7d", "30d"]
+AUDIT_FILTERS = ["since=1d", "since=7d", "until=1d", "command="]
+
+CommandCallback = Callable[[CommandContext], Awaitable[None]]
+Hint = Tuple[str, str]
+
+
+class AutocompleteCache:
+    """In-memory suggestions per authorized channel.
+
+    Recent commands are recorded when they are sent, player names are taken from the responses of
+    the player queries that the stats handler runs anyway. Autocomplete requests are answered from
+    here without any RCON or Discord API call.
+
+    Args:
+        players_ttl (float, optional): Seconds the player names of a response are suggested.
+            Defaults to PLAYERS_TTL.
+    """
+    def __init__(self, players_ttl: float = PLAYERS_TTL) -> None:
+        self._players_ttl = players_ttl
+        self._recent: Dict[int, Deque[str]] = {}
+        self._players: Dict[int, Tuple[float, List[str]]] = {}
+
+    def add_command(self, channel_id: int, command: str) -> None:
+        """Record an RCON command of a channel as most recent one
+
+        Args:
+            channel_id (int): ID of the authorized channel
+            command (str): Full command including its arguments
+        """
+        recent = self._recent.setdefault(channel_id, deque(maxlen=RECENT_COMMANDS))
+        if command in recent:
+            recent.remove(command)
+        recent.appendleft(command)
+
+    def observe(self, channel_id: int, creds: Dict[str, Any], command: str, response: str) -> None:
+        """Update the player names of a channel if the response answers the player query
+
+        Args:
+            channel_id (int): ID of the authorized channel
+            creds (Dict[str, Any]): Config of the authorized channel
+            command (str): Command without prefix
+            response (str): Response of the server
+        """
+        server_type = creds.get("type", "").lower()
+        query = PLAYER_QUERIES.get(server_type)
+        names = PLAYER_NAME_PATTERNS.get(server_type)
+        if query is None or names is None or command.lower() != query[0]:
+            return
+        pattern, separator = names
+        players: List[str] = []
+        for match in pattern.findall(response or ""):
+            names_of_match = match.split(separator) if separator else [match]
+            players.extend(name.strip() for name in names_of_match)
+        self._players[channel_id] = (time.monotonic(), sorted(name for name in players if name))
+
+    def recent(self, channel_id: int) -> List[str]:
+        """Get the recent commands of a channel, most recent first
+
+        Args:
+            channel_id (int): ID of the authorized channel
+
+        Returns:
+            List[str]: Recent commands
+        """
+        return list(self._recent.get(channel_id, ()))
+
+    def players(self, channel_id: int) -> List[str]:
+        """Get the players that were last seen online on the server of a channel
+
+        Args:
+            channel_id (int): ID of the authorized channel
+
+        Returns:
+            List[str]: Player names, empty if they were not seen within the TTL
+        """
+        seen, players = self._players.get(channel_id, (0.0, []))
+        if time.monotonic() - seen > self._players_ttl:
+            self._players.pop(channel_id, None)
+            return []
+        return players
+
+
+class InteractionChannel:
+    """Stand-in for the channel of a slash command.
+
+    Messages sent while the command runs answer the deferred interaction. Messages sent later, e.g.
+    by a channel that was subscribed to the journal, go to the channel itself. Everything else is
+    forwarded to the channel.
+
+    Args:
+        interaction (discord.Interaction): Interaction of the slash command
+    """
+    def __init__(self, interaction: discord.Interaction) -> None:
+        self._interaction = interaction
+        self._channel = interaction.channel
+        self._answering = True
+        self.answered = False
+        self.id = interaction.channel_id
+        self.name = getattr(interaction.channel, "name", "")
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._channel, name)
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> Any:
+        """Send a message as answer to the interaction, or into the channel once it is answered
+
+        Args:
+            content (Optional[str], optional): Content of the message. Defaults to None.
+            **kwargs (Any): Further arguments of discord.abc.Messageable.send, e.g. embed
+
+        Returns:
+            Any: Sent message
+        """
+        if content is not None:
+            kwargs["content"] = content
+        if not self._answering:
+            return await self._channel.send(**kwargs)
+        self.answered = True
+        return await self._interaction.followup.send(**kwargs)
+
+    async def finish(self) -> None:
+        """Answer the interaction if the command sent nothing and send later messages directly"""
+        if self._answering and not self.answered:
+            await self._interaction.followup.send("Done.")
+        self._answering = False
+
+
+class InteractionMessage:
+    """Stand-in for the message of a text command, so that command handlers serve slash commands
+
+    Mentions are resolved from the text of the arguments, the same way Discord resolves them
+    in messages.
+
+    Args:
+        interaction (discord.Interaction): Interaction of the slash command
+        content (str): Command line as it would have been written in a message
+    """
+    def __init__(self, interaction: discord.Interaction, content: str) -> None:
+        self.id = interaction.id
+        self.content = content
+        self.author = interaction.user
+        self.guild = interaction.guild
+        self.channel = InteractionChannel(interaction)
+        self.mentions: List[Any] = []
+        self.role_mentions: List[Any] = []
+        self.channel_mentions: List[Any] = []
+        if self.guild is None:
+            return
+        for kind, object_id in MENTION_PATTERN.findall(content):
+            if kind == "@&":
+                found, mentions = self.guild.get_role(int(object_id)), self.role_mentions
+            elif kind == "#":
+                found, mentions = self.guild.get_channel(int(object_id)), self.channel_mentions
+            else:
+                found, mentions = self.guild.get_member(int(object_id)), self.mentions
+            if found is not None:
+                mentions.append(found)
+
+
+class SlashHandler:
+    """Expose the commands of a CommandHandler and RCON as application (slash) commands.
+
+    Every text command becomes a slash command with one free-text ``arguments`` option, RCON
+    commands are sent with ``/rcon``. Interactions are deferred before the handler runs, so slow
+    RCON calls never miss Discord's three second deadline. Autocomplete is served from an
+    AutocompleteCache and the authorized channels in memory.
+
+    Args:
+        client (discord.Client): Client the command tree is attached to
+        command_handler (CommandHandler): Handler with the registered text commands
+        auth_channels (Dict[str, Any]): Pycon client's authorized channels
+        cache (AutocompleteCache): Suggestions for autocomplete
+        handle_command (CommandCallback): Function that runs a text command
+        handle_rcon (CommandCallback): Function that runs an RCON command in an authorized channel
+        guild_ids (Optional[Set[int]], optional): Guilds the bot serves, like the --servers
+            allowlist of text commands. Defaults to None, which allows every guild.
+    """
+    def __init__(
+        self,
+        client: discord.Client,
+        command_handler: CommandHandler,
+        auth_channels: Dict[str, Any],
+        cache: AutocompleteCache,
+        handle_command: CommandCallback,
+        handle_rcon: CommandCallback,
+        guild_ids: Optional[Set[int]] = None,
+    ) -> None:
+        self.tree = app_commands.CommandTree(client)
+        self._guild_ids: Set[int] = guild_ids if guild_ids is not None else set()
+        self._command_handler = command_handler
+        self._auth_channels = auth_channels
+        self._cache = cache
+        self._handle_command = handle_command
+        self._handle_rcon = handle_rcon
+
+    def setup(self) -> None:
+        """Add all registered text commands and the rcon command to the command tree"""
+        for bot_command in self._command_handler.commands:
+            self.tree.add_command(self._make_command(bot_command))
+        self.tree.add_command(self._make_rcon_command())
+
+    async def sync(self) -> None:
+        """Register the command tree with Discord"""
+        try:
+            synced = await self.tree.sync()
+            logging.info("Synced %d slash commands", len(synced))
+        except discord.HTTPException as err:
+            logging.error("Could not sync slash commands: %s", err)
+
+    def _make_command(self, bot_command: BotCommand) -> app_commands.Command:
+        @app_commands.guild_only()
+        @app_commands.describe(arguments="Arguments as in the text command")
+        async def callback(interaction: discord.Interaction, arguments: Optional[str] = None):
+            if not await self._check_guild(interaction):
+                return
+            await self._invoke(
+                interaction, self._handle_command, bot_command.name, (arguments or "").split()
+            )
+
+        async def autocomplete(
+            interaction: discord.Interaction, current: str
+        ) -> List[app_commands.Choice[str]]:
+            if not self._is_allowed_guild(interaction):
+                return []
+            return SlashHandler._choices(self._hints(bot_command.name, interaction), current)
+
+        command = app_commands.Command(
+            name=bot_command.name,
+            description=bot_command.help_text[:100],
+            callback=callback,
+        )
+        command.autocomplete("arguments")(autocomplete)
+        return command
+
+    def _make_rcon_command(self) -> app_commands.Command:
+        @app_commands.guild_only()
+        @app_commands.describe(command="RCON command including its arguments")
+        async def callback(interaction: discord.Interaction, command: str):
+            if not await self._check_guild(interaction):
+                return
+            creds = self._auth_channels.get(f"{interaction.channel_id}")
+            if not creds or not creds.get("authorized"):
+                await interaction.response.send_message(
+                    "This channel is not authorized for RCON.", ephemeral=True
+                )
+                return
+            command_list = command.split(" ")
+            await self._invoke(interaction, self._handle_rcon, command_list[0], command_list[1:])
+
+        async def autocomplete(
+            interaction: discord.Interaction, current: str
+        ) -> List[app_commands.Choice[str]]:
+            if not self._is_allowed_guild(interaction):
+                return []
+            return SlashHandler._choices(self._rcon_hints(interaction.channel_id, current), current)
+
+        command = app_commands.Command(
+            name="rcon",
+            description="Run an RCON command on the server of this channel",
+            callback=callback,
+        )
+        command.autocomplete("command")(autocomplete)
+        return command
+
+    def _is_allowed_guild(self, interaction: discord.Interaction) -> bool:
+        """Check whether an interaction comes from a guild the bot serves
+
+        Args:
+            interaction (discord.Interaction): Interaction of a slash command or autocomplete
+
+        Returns:
+            bool: True if every guild is allowed or the guild is in the allowlist
+        """
+        return not self._guild_ids or interaction.guild_id in self._guild_ids
+
+    async def _check_guild(self, interaction: discord.Interaction) -> bool:
+        """Reject interactions from guilds the bot doesn't serve, before they are deferred
+
+        Args:
+            interaction (discord.Interaction): Interaction of a slash command
+
+        Returns:
+            bool: True if the interaction may be handled
+        """
+        if self._is_allowed_guild(interaction):
+            return True
+        logging.debug("Rejecting slash command from guild %s", interaction.guild_id)
+        await interaction.response.send_message(
+            "This bot doesn't serve this server.", ephemeral=True
+        )
+        return False
+
+    async def _invoke(
+        self,
+        interaction: discord.Interaction,
+        handler: CommandCallback,
+        command: str,
+        args: List[str],
+    ) -> None:
+        """Defer the interaction and run a handler with a message stand-in
+
+        Args:
+            interaction (discord.Interaction): Interaction of the slash command
+            handler (CommandCallback): Handler of the command
+            command (str): Name of the command
+            args (List[str]): Arguments of the command
+        """
+        await interaction.response.defer(thinking=True)
+        message = InteractionMessage(interaction, " ".join((command, *args)))
+        try:
+            await handler(CommandContext(SLASH_PREFIX, command, args, message))
+        except Exception:
+            await message.channel.send("I'm sorry, something bad happend on my end :(")
+            raise
+        finally:
+            await message.channel.finish()
+
+    def _hints(self, command: str, interaction: discord.Interaction) -> List[Hint]:
+        """Get the suggestions for the arguments of a text command
+
+        Args:
+            command (str): Name of the command
+            interaction (discord.Interaction): Interaction of the autocomplete request
+
+        Returns:
+            List[Hint]: Pairs of displayed name and value
+        """
+        if command == "broadcast":
+            hints = [f"-g {group} " for group in self._groups(interaction.guild)]
+            hints += self._cache.recent(interaction.channel_id)
+        elif command == "set-group":
+            hints = self._groups(interaction.guild)
+        elif command == "stats":
+            hints = STATS_WINDOWS
+        elif command == "console":
+            hints = ["on", "off", *(f"on {category}" for category in CONSOLE_PATTERNS)]
+        elif command == "schedule":
+            hints = ["list", "add 10m ", "remove "]
+        elif command == "set-role":
+            hints = [f"{stage} " for stage in (*STAGE_NAMES, REMOVE_STAGE)]
+        elif command == "audit":
+            return [(hint, hint) for hint in AUDIT_FILTERS] + [
+                (f"server=#{channel.name}", f"server=<#{channel.id}>")
+                for channel in self._servers(interaction.guild)
+            ]
+        else:
+            hints = []
+        return [(hint, hint) for hint in hints]
+
+    def _rcon_hints(self, channel_id: int, current: str) -> List[Hint]:
+        """Get the suggestions for an RCON command: player names for the last word, then recent
+        commands
+
+        Args:
+            channel_id (int): ID of the authorized channel
+            current (str): Command typed so far
+
+        Returns:
+            List[Hint]: Pairs of displayed name and value
+        """
+        head, _, last = current.rpartition(" ")
+        hints: List[str] = []
+        if head:
+            hints += [
+                f"{head} {player}"
+                for player in self._cache.players(channel_id)
+                if player.lower().startswith(last.lower())
+            ]
+        hints += self._cache.recent(channel_id)
+        return [(hint, hint) for hint in hints]
+
+    def _servers(self, guild: Optional[discord.Guild]) -> List[Any]:
+        if guild is None:
+            return []
+        channels = (
+            guild.get_channel(int(channel_id))
+            for channel_id, channel_cfg in self._auth_channels.items()
+            if channel_cfg.get("authorized")
+        )
+        return [channel for channel in channels if channel is not None]
+
+    def _groups(self, guild: Optional[discord.Guild]) -> List[str]:
+        return sorted({
+            self._auth_channels[f"{channel.id}"]["group"]
+            for channel in self._servers(guild)
+            if self._auth_channels[f"{channel.id}"].get("group")
+        })
+
+    @staticmethod
+    def _choices(hints: List[Hint], current: str) -> List[app_commands.Choice[str]]:
+        """Filter suggestions by the typed text
+
+        Args:
+            hints (List[Hint]): Pairs of displayed name and value
+            current (str): Text typed so far
+
+        Returns:
+            List[app_commands.Choice[str]]: At most MAX_CHOICES choices, prefix matches first
+        """
+        current = current.lower()
+        prefix_matches: List[Hint] = []
+        other_matches: List[Hint] = []
+        seen = set()
+        for name, value in hints:
+            if value in seen or len(value) > MAX_CHOICE_LENGTH:
+                continue
+            seen.add(value)
+            if value.lower().startswith(current) or name.lower().startswith(current):
+                prefix_matches.append((name, value))
+            elif current in name.lower():
+                other_matches.append((name, value))
+        return [
+            app_commands.Choice(name=name[:MAX_CHOICE_LENGTH], value=value)
+            for name, value in (prefix_matches + other_matches)[:MAX_CHOICES]
+        ]
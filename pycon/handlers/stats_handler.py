@@ -0,0 +1,438 @@
+"""Stats handler
+
+Description:    Memory-bounded time series of player counts and latency per server
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import logging
+import math
+import re
+import socket
+import struct
+import time
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple
+
+from pycon.handlers.command_handler import CommandContext
+from pycon.handlers.persistence_handler import PersistenceHandler
+from pycon.handlers.rcon_handler import RCONHandler
+from pycon.handlers.transport_handler import AuthenticationError
+
+# (resolution in seconds, number of slots): 6 hours, 3 days and 30 days
+TIERS: Tuple[Tuple[int, int], ...] = ((60, 360), (600, 432), (3600, 720))
+METRICS: Tuple[str, ...] = ("players", "rtt", "up")
+METRIC_NAMES: Dict[str, str] = {
+    "players": "Players online",
+    "rtt": "RCON round trip (ms)",
+    "up": "Availability (%)",
+}
+PLAYER_QUERIES: Dict[str, Tuple[str, Pattern]] = {
+    "minecraft": ("list", re.compile(r"There are (\d+)")),
+    "ark": ("listplayers", re.compile(r"^\d+\.", re.M)),
+}
+DEFAULT_SAMPLE_INTERVAL = 60.0
+DEFAULT_SAVE_INTERVAL = 600.0
+SAMPLE_CONCURRENCY = 8
+SAMPLE_TIMEOUT = 5.0
+DEFAULT_WINDOW = "6h"
+WINDOW_UNITS = {"m": 60, "h": 3600, "d": 86400}
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+SPARK_WIDTH = 40
+FILE_MAGIC = b"PYST"
+FILE_VERSION = 1
+
+
+class RingTier:
+    """Fixed-size ring of aggregated slots of one resolution
+
+    Every slot keeps count, sum, minimum and maximum of all samples that fell into its time range,
+    so coarser tiers are downsampled automatically while samples are added.
+
+    Args:
+        resolution (int): Seconds covered by one slot
+        capacity (int): Number of slots
+    """
+    def __init__(self, resolution: int, capacity: int) -> None:
+        self.resolution = resolution
+        self.capacity = capacity
+        self.slots = array("q", [-1]) * capacity
+        self.counts = array("I", [0]) * capacity
+        self.sums = array("d", [0.0]) * capacity
+        self.minimums = array("d", [0.0]) * capacity
+        self.maximums = array("d", [0.0]) * capacity
+
+    @property
+    def span(self) -> int:
+        """int: Seconds covered by the whole ring"""
+        return self.resolution * self.capacity
+
+    def add(self, timestamp: float, value: float) -> None:
+        """Add a sample
+
+        Args:
+            timestamp (float): Unix timestamp of the sample
+            value (float): Value of the sample
+        """
+        slot = int(timestamp // self.resolution)
+        pos = slot % self.capacity
+        if self.slots[pos] != slot:
+            self.slots[pos] = slot
+            self.counts[pos] = 0
+            self.sums[pos] = 0.0
+            self.minimums[pos] = value
+            self.maximums[pos] = value
+        self.counts[pos] += 1
+        self.sums[pos] += value
+        self.minimums[pos] = min(self.minimums[pos], value)
+        self.maximums[pos] = max(self.maximums[pos], value)
+
+    def window(self, since: float) -> List[Tuple[int, int, float, float, float]]:
+        """Get all slots since a point in time
+
+        Args:
+            since (float): Unix timestamp
+
+        Returns:
+            List[Tuple[int, int, float, float, float]]: Slot start, count, sum, min and max in
+                chronological order
+        """
+        first = int(since // self.resolution)
+        result = [
+            (
+                self.slots[pos] * self.resolution,
+                self.counts[pos],
+                self.sums[pos],
+                self.minimums[pos],
+                self.maximums[pos],
+            )
+            for pos in range(self.capacity)
+            if self.slots[pos] >= first and self.counts[pos]
+        ]
+        result.sort()
+        return result
+
+    def to_bytes(self) -> bytes:
+        """Serialize the ring
+
+        Returns:
+            bytes: Raw arrays
+        """
+        return b"".join(
+            column.tobytes()
+            for column in (self.slots, self.counts, self.sums, self.minimums, self.maximums)
+        )
+
+    def load_bytes(self, data: memoryview) -> int:
+        """Load the ring from bytes written by to_bytes
+
+        Args:
+            data (memoryview): Buffer starting with the ring
+
+        Raises:
+            ValueError: If the buffer is shorter than the ring. The ring is not changed then.
+
+        Returns:
+            int: Number of bytes read
+        """
+        columns = (self.slots, self.counts, self.sums, self.minimums, self.maximums)
+        total = sum(column.itemsize * self.capacity for column in columns)
+        if len(data) < total:
+            # Loading a cut off column would silently shrink the ring
+            raise ValueError(f"ring needs {total} bytes, got {len(data)}")
+        offset = 0
+        for column in columns:
+            size = column.itemsize * self.capacity
+            loaded = array(column.typecode)
+            loaded.frombytes(data[offset:offset + size])
+            column[:] = loaded
+            offset += size
+        return offset
+
+
+class TimeSeries:
+    """One metric of a server, kept in one RingTier per entry of TIERS"""
+    def __init__(self) -> None:
+        self.tiers: List[RingTier] = [
+            RingTier(resolution, capacity) for resolution, capacity in TIERS
+        ]
+
+    def add(self, timestamp: float, value: float) -> None:
+        """Add a sample to all tiers
+
+        Args:
+            timestamp (float): Unix timestamp of the sample
+            value (float): Value of the sample
+        """
+        for tier in self.tiers:
+            tier.add(timestamp, value)
+
+    def window(self, seconds: float) -> Tuple[int, List[Tuple[int, int, float, float, float]]]:
+        """Get the slots of the finest tier that covers a window
+
+        Args:
+            seconds (float): Length of the window up to now
+
+        Returns:
+            Tuple[int, List[Tuple[int, int, float, float, float]]]: Resolution of the tier and its
+                slots within the window
+        """
+        tier = next((tier for tier in self.tiers if tier.span >= seconds), self.tiers[-1])
+        return tier.resolution, tier.window(time.time() - seconds)
+
+
+class StatsHandler:
+    """Sample player count, RCON round trip time and availability of all authorized servers.
+
+    Every series lives in fixed-size rings, so memory per server stays constant no matter how long
+    the bot runs. The rings are persisted as raw arrays through PersistenceHandler and restored with
+    load.
+
+    Args:
+        auth_channels (Dict[str, Any]): Pycon client's authorized channels
+        rcon_handler (RCONHandler): Handler to run RCON commands with
+        sample_interval (float, optional): Seconds between two samples.
+            Defaults to DEFAULT_SAMPLE_INTERVAL.
+        on_response (Optional[Callable[[str, Dict[str, Any], str, str], None]], optional):
+            Function called with channel ID, config, command and response of every successful
+            sample. Defaults to None.
+    """
+    def __init__(
+        self,
+        auth_channels: Dict[str, Any],
+        rcon_handler: RCONHandler,
+        sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+        on_response: Optional[Callable[[str, Dict[str, Any], str, str], None]] = None,
+    ) -> None:
+        self._auth_channels = auth_channels
+        self._rcon_handler = rcon_handler
+        self._sample_interval = sample_interval
+        self._on_response = on_response
+        self._series: Dict[int, Dict[str, TimeSeries]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start sampling. Has to be called from a running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._sample_loop())
+
+    def add_sample(self, channel_id: int, metric: str, value: float, timestamp: float) -> None:
+        """Add a sample to a series
+
+        Args:
+            channel_id (int): ID of the authorized channel
+            metric (str): One of METRICS
+            value (float): Value of the sample
+            timestamp (float): Unix timestamp of the sample
+        """
+        series = self._series.get(channel_id)
+        if series is None:
+            series = {name: TimeSeries() for name in METRICS}
+            self._series[channel_id] = series
+        series[metric].add(timestamp, value)
+
+    async def sample(self, channel_id: str, creds: Dict[str, Any]) -> None:
+        """Query one server and record its metrics
+
+        Servers with a player query run it, so the round trip includes a command. Other servers
+        are only connected to, and their round trip is the time to connect and log in.
+
+        Args:
+            channel_id (str): ID of the authorized channel
+            creds (Dict[str, Any]): Config of the authorized channel
+        """
+        query = PLAYER_QUERIES.get(creds.get("type", "").lower())
+        timestamp = time.time()
+        start = time.perf_counter()
+        try:
+            if query is None:
+                measured = await self._rcon_handler.check(creds, timeout=SAMPLE_TIMEOUT)
+            else:
+                measured = True
+                response = await self._rcon_handler.run(creds, query[0], timeout=SAMPLE_TIMEOUT)
+        except (
+            asyncio.TimeoutError,
+            ConnectionRefusedError,
+            socket.gaierror,
+            OSError,
+            AuthenticationError,
+        ) as err:
+            logging.debug("Stats sample of %s failed: %s", channel_id, err)
+            self.add_sample(int(channel_id), "up", 0.0, timestamp)
+            return
+        # A connection that was still open from a recent command took no time to connect
+        if measured:
+            self.add_sample(int(channel_id), "rtt", (time.perf_counter() - start) * 1000, timestamp)
+        self.add_sample(int(channel_id), "up", 1.0, timestamp)
+        if query is None:
+            return
+        command, pattern = query
+        if self._on_response is not None:
+            self._on_response(channel_id, creds, command, response)
+        matches = pattern.findall(response or "")
+        if pattern.groups:
+            players = int(matches[0]) if matches else 0
+        else:
+            players = len(matches)
+        self.add_sample(int(channel_id), "players", players, timestamp)
+
+    async def handle_stats(self, ctx: CommandContext) -> None:
+        """Handle the stats command: ``stats [WINDOW]``, e.g. ``stats 7d``
+
+        Args:
+            ctx (CommandContext): Command Context
+        """
+        channel_cfg = self._auth_channels.get(f"{ctx.message.channel.id}")
+        if not channel_cfg or not channel_cfg["authorized"]:
+            await ctx.message.channel.send("This Channel is not yet authorized.")
+            return
+        window_arg = ctx.args[0].lower() if ctx.args else DEFAULT_WINDOW
+        match = re.match(r"^(\d+)([mhd])$", window_arg)
+        if not match:
+            await ctx.message.channel.send(
+                f"Use it like this: {ctx.prefix}{ctx.command} [WINDOW] (e.g. 30m, 6h, 7d)"
+            )
+            return
+        seconds = int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+        await ctx.message.channel.send(self.render(ctx.message.channel.id, seconds, window_arg))
+
+    def render(self, channel_id: int, seconds: float, window_name: str) -> str:
+        """Render a summary with a sparkline per metric
+
+        Args:
+            channel_id (int): ID of the authorized channel
+            seconds (float): Length of the window up to now
+            window_name (str): Window as entered by the user
+
+        Returns:
+            str: Message content
+        """
+        series = self._series.get(channel_id)
+        if series is None:
+            return "No stats recorded for this server yet."
+        lines = [f"Stats of the last {window_name}:", "```"]
+        for metric in METRICS:
+            resolution, slots = series[metric].window(seconds)
+            if not slots:
+                continue
+            count = sum(slot[1] for slot in slots)
+            average = sum(slot[2] for slot in slots) / count
+            minimum = min(slot[3] for slot in slots)
+            maximum = max(slot[4] for slot in slots)
+            scale = 100 if metric == "up" else 1
+            lines.append(
+                f"{METRIC_NAMES[metric]}: avg {average * scale:.1f}, "
+                f"min {minimum * scale:.1f}, max {maximum * scale:.1f}"
+            )
+            lines.append(f"  {StatsHandler._sparkline(slots, seconds, resolution)}")
+        lines.append("```")
+        return "\n".join(lines) if len(lines) > 3 else "No stats recorded in this window."
+
+    def load(self, data: bytes) -> None:
+        """Load persisted series
+
+        Args:
+            data (bytes): Data written by to_bytes
+        """
+        if not data:
+            return
+        view = memoryview(data)
+        header = struct.Struct(f"<4sHI{2 * len(TIERS)}I")
+        expected = (FILE_MAGIC, FILE_VERSION, len(METRICS), *sum(TIERS, ()))
+        if len(data) < header.size or header.unpack_from(view)[:3 + 2 * len(TIERS)] != expected:
+            logging.warning("Discarding stats of an incompatible format")
+            return
+        offset = header.size
+        try:
+            while offset < len(data):
+                (channel_id,) = struct.unpack_from("<Q", view, offset)
+                offset += 8
+                series = {name: TimeSeries() for name in METRICS}
+                for metric in METRICS:
+                    for tier in series[metric].tiers:
+                        offset += tier.load_bytes(view[offset:])
+                self._series[channel_id] = series
+        except (struct.error, ValueError) as err:
+            logging.error("Stats file is corrupt: %s", err)
+
+    def to_bytes(self) -> bytes:
+        """Serialize all series of currently authorized channels
+
+        Returns:
+            bytes: Compact binary representation
+        """
+        header = struct.pack(
+            f"<4sHI{2 * len(TIERS)}I",
+            FILE_MAGIC,
+            FILE_VERSION,
+            len(METRICS),
+            *sum(TIERS, ()),
+        )
+        chunks = [header]
+        for channel_id, series in self._series.items():
+            if not self._auth_channels.get(f"{channel_id}", {}).get("authorized"):
+                continue
+            chunks.append(struct.pack("<Q", channel_id))
+            for metric in METRICS:
+                for tier in series[metric].tiers:
+                    chunks.append(tier.to_bytes())
+        return b"".join(chunks)
+
+    def save(self) -> None:
+        """Persist all series"""
+        PersistenceHandler.save_stats(self.to_bytes())
+
+    async def _sample_loop(self) -> None:
+        semaphore = asyncio.Semaphore(SAMPLE_CONCURRENCY)
+        last_save = time.monotonic()
+
+        async def sample_one(channel_id: str, creds: Dict[str, Any]) -> None:
+            async with semaphore:
+                await self.sample(channel_id, creds)
+
+        while True:
+            await asyncio.sleep(self._sample_interval)
+            await asyncio.gather(
+                *(
+                    sample_one(channel_id, creds)
+                    for channel_id, creds in list(self._auth_channels.items())
+                    if creds.get("authorized")
+                )
+            )
+            if time.monotonic() - last_save > DEFAULT_SAVE_INTERVAL:
+                last_save = time.monotonic()
+                await asyncio.to_thread(PersistenceHandler.save_stats, self.to_bytes())
+
+    @staticmethod
+    def _sparkline(
+        slots: List[Tuple[int, int, float, float, float]], seconds: float, resolution: int
+    ) -> str:
+        """Render averages of slots as a fixed-width bar chart, with gaps for missing data
+
+        Args:
+            slots (List[Tuple[int, int, float, float, float]]): Slots in chronological order
+            seconds (float): Length of the window
+            resolution (int): Seconds per slot
+
+        Returns:
+            str: Sparkline
+        """
+        width = max(1, min(SPARK_WIDTH, math.ceil(seconds / resolution)))
+        start = time.time() - seconds
+        buckets: List[List[float]] = [[0, 0.0] for _ in range(width)]
+        for slot_start, count, total, _, _ in slots:
+            index = min(width - 1, max(0, int((slot_start - start) / seconds * width)))
+            buckets[index][0] += count
+            buckets[index][1] += total
+        averages = [total / count if count else None for count, total in buckets]
+        known = [value for value in averages if value is not None]
+        low, high = min(known), max(known)
+        span = (high - low) or 1
+        steps = len(SPARK_CHARS) - 1
+        return "".join(
+            " " if value is None else SPARK_CHARS[int((value - low) / span * steps)]
+            for value in averages
+        )
@@ -8,18 +8,40 @@ Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
 """
 
 import logging
+import re
 import subprocess
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
+from pycon.handlers.audit_handler import AuditHandler
 from pycon.handlers.command_handler import CommandContext
+from pycon.handlers.permission_handler import PermissionHandler
 from pycon.handlers.persistence_handler import PersistenceHandler
 
+# Server types are entered by users when authorizing a channel, so only plain unit names are run
+UNIT_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_.@-]{0,63}$")
+
 
 class SystemHandler:
     """Class representation for System Command Handling
+
+    System commands run on the host of the bot, so they are limited to the users of the sys auth
+    file. Auth stages granted by roles are not enough.
+
+    Args:
+        auth_channels (Dict[str, Any]): Pycon client's authorized channels
+        permission_handler (PermissionHandler): Handler that knows the authorized users
+        audit_handler (Optional[AuditHandler], optional): Audit log for executed commands.
+            Defaults to None.
     """
-    def __init__(self, auth_channels: Dict[str, Any]) -> None:
+    def __init__(
+        self,
+        auth_channels: Dict[str, Any],
+        permission_handler: PermissionHandler,
+        audit_handler: Optional[AuditHandler] = None,
+    ) -> None:
         self._auth_channels = auth_channels
+        self._permission_handler = permission_handler
+        self._audit_handler = audit_handler
 
     async def handle_sys_command(self, ctx: CommandContext):
         """Handle System command
@@ -34,9 +56,7 @@ class SystemHandler:
             ctx.command,
             ctx.args,
         )
-        auth_users: List[int] = SystemHandler.get_authorized_users()
-        logging.warning("Authorized users: %s", auth_users)
-        if not ctx.message.author.id in auth_users:
+        if not self._permission_handler.is_authorized_user(ctx.message.author.id):
             await ctx.message.channel.send("You don't have permissions for this command.")
             return
         if ctx.command == "restart":
@@ -53,20 +73,42 @@ class SystemHandler:
         if not server_config:
             await ctx.message.channel.send("This channel isn't authorized yet.")
             return
-        server_type: str = server_config["type"].strip().lower()
+        unit: str = SystemHandler.get_unit(server_config)
+        if not UNIT_PATTERN.match(unit):
+            logging.warning("Refusing to restart invalid unit %r", unit)
+            self._audit(ctx, "invalid unit")
+            await ctx.message.channel.send("The server type of this channel is no valid unit.")
+            return
         try:
             await ctx.message.channel.send("Trying to restart server ...")
-            process_out = subprocess.check_output(
-                f"systemctl restart {server_type}",
-                shell=True,
-            )
+            process_out = subprocess.check_output(["systemctl", "restart", unit])
             logging.debug("Process finished: %s", process_out)
         except subprocess.CalledProcessError as err:
+            self._audit(ctx, f"failed with {err.returncode}")
             await ctx.message.channel.send("That didnt work, sorry pal")
             logging.error("Error in sys comman: %s", err)
             return
+        self._audit(ctx, "ok")
         await ctx.message.channel.send("Server is restarting. This could take a minute.")
 
+    def _audit(self, ctx: CommandContext, result: str) -> None:
+        if self._audit_handler is not None:
+            self._audit_handler.record(
+                ctx, "system", ctx.message.channel.id, ctx.message.channel.name, result
+            )
+
+    @staticmethod
+    def get_unit(server_config: Dict[str, Any]) -> str:
+        """Get the systemd unit of an authorized channel's server
+
+        Args:
+            server_config (Dict[str, Any]): Config of the authorized channel
+
+        Returns:
+            str: Name of the systemd unit
+        """
+        return server_config["type"].strip().lower()
+
     @staticmethod
     def get_authorized_users() -> List[int]:
         """Get all authorized users as a List of strings
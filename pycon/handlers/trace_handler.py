@@ -0,0 +1,252 @@
+"""Trace handler
+
+Description:    Anonymised traces of production traffic for replays
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import IO, Any, Dict, FrozenSet, Iterable, Iterator, Optional
+
+TRACE_VERSION = 1
+# Event kinds
+MESSAGE_EVENT = "msg"
+RCON_EVENT = "rcon"
+# Kinds of messages, by the path they take through on_message
+DROPPED = "drop"
+IGNORED = "ignore"
+COMMAND = "command"
+RCON = "rcon"
+AUTH = "auth"
+# Common RCON commands of the supported games. Other command names are only written as hashes,
+# since anything typed into an authorized channel is sent to the server as a command.
+RCON_COMMANDS: FrozenSet[str] = frozenset(
+    {
+        "admins",
+        "ban",
+        "banlist",
+        "bans",
+        "broadcast",
+        "changelevel",
+        "cvarlist",
+        "deop",
+        "destroywilddinos",
+        "difficulty",
+        "echo",
+        "exit",
+        "gamemode",
+        "getchat",
+        "give",
+        "help",
+        "info",
+        "kick",
+        "kickplayer",
+        "kill",
+        "list",
+        "listplayers",
+        "lock",
+        "map",
+        "missions",
+        "op",
+        "players",
+        "playerlist",
+        "quit",
+        "restart",
+        "save",
+        "save-all",
+        "save-off",
+        "save-on",
+        "saveworld",
+        "say",
+        "seed",
+        "serverchat",
+        "serverinfo",
+        "settimeofday",
+        "shutdown",
+        "status",
+        "stop",
+        "time",
+        "tp",
+        "tps",
+        "unban",
+        "unlock",
+        "users",
+        "version",
+        "weather",
+        "whitelist",
+    }
+)
+# Prefix of hashed command names
+REDACTED_PREFIX = "#"
+
+
+class TraceRecorder:
+    """Write an anonymised trace of the messages and RCON calls of the bot.
+
+    The trace is a JSON line per event, gzip compressed if the path ends in ``.gz``. It holds no
+    content: IDs are replaced by keyed hashes whose key is never written, commands are reduced to
+    their name and number of arguments, and responses to their size. Only names of bot commands
+    and RCON_COMMANDS are written as they are, any other name is replaced by a keyed hash as
+    well. Authentication DMs have no command name. Event times are seconds from the start of the
+    recording until the message arrived or the command was sent.
+
+    Message events (``"e": "msg"``) have the keys ``t`` (time), ``c`` (channel), ``g`` (guild),
+    ``k`` (kind: drop, ignore, command, rcon or auth), ``cmd``, ``argc``, ``len`` (length of the
+    message) and ``ms`` (time spent in on_message). RCON events (``"e": "rcon"``) have ``t``,
+    ``c``, ``type`` (server type), ``cmd``, ``argc``, ``ms`` (latency of the server), ``size``
+    (response size in bytes) and ``result``.
+
+    Args:
+        path (Path): File to write the trace to
+        command_names (Iterable[str], optional): Names of the bot commands. Defaults to ().
+    """
+
+    def __init__(self, path: Path, command_names: Iterable[str] = ()) -> None:
+        self._path = path
+        self._key = os.urandom(16)
+        self._known = RCON_COMMANDS | {name.lower() for name in command_names}
+        self._start = time.perf_counter()
+        self._names: Dict[int, str] = {}
+        opener = gzip.open if path.suffix == ".gz" else open
+        self._file: IO[str] = opener(path, "wt", encoding="utf-8")
+        self._write({"trace": TRACE_VERSION, "start": int(time.time())})
+        logging.info("Recording a trace to %s", path)
+
+    def message(
+        self,
+        channel_id: int,
+        guild_id: Optional[int],
+        kind: str,
+        length: int,
+        start: float,
+        command: str = "",
+        argc: int = 0,
+    ) -> None:
+        """Record a message
+
+        Args:
+            channel_id (int): ID of the channel of the message
+            guild_id (Optional[int]): ID of the guild, None for DMs
+            kind (str): Path the message took, e.g. DROPPED or RCON
+            length (int): Length of the message content
+            start (float): time.perf_counter() when on_message was called
+            command (str, optional): Name of the command. Defaults to "".
+            argc (int, optional): Number of arguments of the command. Defaults to 0.
+        """
+        self._write(
+            {
+                "e": MESSAGE_EVENT,
+                "t": self._offset(start),
+                "c": self._anonymise(channel_id),
+                "g": self._anonymise(guild_id) if guild_id is not None else None,
+                "k": kind,
+                # The "command" of an authentication is the address of the server
+                "cmd": "" if kind == AUTH else self.redact(command),
+                "argc": argc,
+                "len": length,
+                "ms": round((time.perf_counter() - start) * 1000, 3),
+            }
+        )
+
+    def rcon(
+        self,
+        channel_id: int,
+        creds: Dict[str, Any],
+        command: str,
+        argc: int,
+        start: float,
+        latency: float,
+        response: Optional[str],
+        result: str,
+    ) -> None:
+        """Record an RCON call
+
+        Args:
+            channel_id (int): ID of the authorized channel
+            creds (Dict[str, Any]): Config of the authorized channel
+            command (str): Command without prefix
+            argc (int): Number of arguments of the command
+            start (float): time.perf_counter() before the command was sent
+            latency (float): Seconds until the response or the failure
+            response (Optional[str]): Response of the server, None if the call failed
+            result (str): Result as in the audit log, e.g. "ok"
+        """
+        self._write(
+            {
+                "e": RCON_EVENT,
+                "t": self._offset(start),
+                "c": self._anonymise(channel_id),
+                "type": str(creds.get("type", "")).lower(),
+                "cmd": self.redact(command),
+                "argc": argc,
+                "ms": round(latency * 1000, 3),
+                "size": len(response.encode("utf-8")) if response else 0,
+                "result": result,
+            }
+        )
+
+    def close(self) -> None:
+        """Write the buffered events and close the trace"""
+        if not self._file.closed:
+            self._file.close()
+
+    def redact(self, command: str) -> str:
+        """Reduce a command name to something that can be written to a trace
+
+        Args:
+            command (str): Command name as typed by the user
+
+        Returns:
+            str: Lowercase name of a known command, else REDACTED_PREFIX and a keyed hash
+        """
+        command = command.lower()
+        if not command or command in self._known:
+            return command
+        return REDACTED_PREFIX + self._hash(command)[:8]
+
+    def _anonymise(self, object_id: int) -> str:
+        name = self._names.get(object_id)
+        if name is None:
+            name = self._hash(str(object_id))[:12]
+            self._names[object_id] = name
+        return name
+
+    def _hash(self, value: str) -> str:
+        return hmac.new(self._key, value.encode(), hashlib.sha256).hexdigest()
+
+    def _offset(self, start: float) -> float:
+        return round(start - self._start, 4)
+
+    def _write(self, event: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+
+def read_trace(path: Path) -> Iterator[Dict[str, Any]]:
+    """Read the events of a trace written by TraceRecorder
+
+    Args:
+        path (Path): Trace file
+
+    Raises:
+        ValueError: If the file is no trace of a supported version
+
+    Yields:
+        Dict[str, Any]: Events in the order they were recorded
+    """
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as trace_file:
+        header = json.loads(trace_file.readline() or "{}")
+        if header.get("trace") != TRACE_VERSION:
+            raise ValueError(f"{path} is no trace of version {TRACE_VERSION}")
+        for line in trace_file:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,390 @@
+"""Transport handler
+
+Description:    Asynchronous RCON transports for the supported game server protocols
+Author:         Maximilian Stephan
+Disclaimer:     Copyright (c) 2023 Maximilian Stephan,
+                ALL RIGHTS RESERVED - Unauthorized copying of this file,
+                via any medium is strictly prohibited.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import struct
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple, Type
+from urllib.parse import quote
+
+import aiohttp
+
+DEFAULT_IDLE_TIMEOUT = 30.0
+# Source servers split responses into packets of at most 4096 bytes. A response that fills a
+# packet may be continued in further packets.
+SOURCE_FRAGMENT_SIZE = 4000
+SOURCE_AUTH = 3
+SOURCE_AUTH_RESPONSE = 2
+SOURCE_EXEC_COMMAND = 2
+SOURCE_RESPONSE_VALUE = 0
+BATTLEYE_LOGIN = 0x00
+BATTLEYE_COMMAND = 0x01
+BATTLEYE_SERVER_MESSAGE = 0x02
+
+
+class AuthenticationError(Exception):
+    """Custom Exception for RCON passwords that the server rejected"""
+
+
+class RCONTransport(ABC):
+    """Connection to one RCON endpoint.
+
+    The connection is opened on first use and kept open for further commands, so consecutive
+    commands skip connecting and logging in. Commands on one transport run one at a time. A
+    transport closes itself after ``idle_timeout`` seconds without commands, and whenever a command
+    fails or is cancelled, since the state of the connection is unknown afterwards.
+
+    Subclasses implement the protocol in _open, _execute and _close. Server types whose commands
+    need a prefix register a subclass that sets ``command_prefix``.
+
+    Args:
+        host (str): Resolved address of the server
+        port (int): RCON port
+        password (str): RCON password
+        idle_timeout (float, optional): Seconds after which an unused connection is closed.
+            Defaults to DEFAULT_IDLE_TIMEOUT.
+    """
+    command_prefix = ""
+
+    def __init__(
+        self, host: str, port: int, password: str, idle_timeout: float = DEFAULT_IDLE_TIMEOUT
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.password = password
+        self.connected = False
+        self._idle_timeout = idle_timeout
+        self._lock = asyncio.Lock()
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._close_task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> bool:
+        """Open the connection and log in, if it is not open yet
+
+        Raises:
+            OSError: If the server is unreachable
+            AuthenticationError: If the server rejected the password
+
+        Returns:
+            bool: True if a connection was opened, False if it was open already
+        """
+        async with self._lock:
+            opened = not self.connected
+            await self._ensure_open()
+            self._schedule_close()
+            return opened
+
+    async def run(self, command: str) -> str:
+        """Run a command
+
+        Args:
+            command (str): Full command including its arguments
+
+        Raises:
+            OSError: If the server is unreachable or the connection broke
+            AuthenticationError: If the server rejected the password
+
+        Returns:
+            str: Response of the server
+        """
+        async with self._lock:
+            await self._ensure_open()
+            try:
+                response = await self._execute(command)
+            except BaseException:
+                await self._disconnect()
+                raise
+            self._schedule_close()
+            return response
+
+    async def close(self) -> None:
+        """Close the connection"""
+        async with self._lock:
+            await self._disconnect()
+
+    async def _ensure_open(self) -> None:
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        if self.connected:
+            return
+        try:
+            await self._open()
+        except BaseException:
+            await self._disconnect()
+            raise
+        self.connected = True
+
+    async def _disconnect(self) -> None:
+        self.connected = False
+        try:
+            await self._close()
+        except (OSError, aiohttp.ClientError) as err:
+            logging.debug("Closing RCON connection to %s:%s failed: %s", self.host, self.port, err)
+
+    def _schedule_close(self) -> None:
+        self._idle_handle = asyncio.get_running_loop().call_later(
+            self._idle_timeout, self._close_idle
+        )
+
+    def _close_idle(self) -> None:
+        self._idle_handle = None
+        self._close_task = asyncio.get_running_loop().create_task(self.close())
+
+    @abstractmethod
+    async def _open(self) -> None:
+        """Open the connection and log in"""
+
+    @abstractmethod
+    async def _execute(self, command: str) -> str:
+        """Run a command on the open connection"""
+
+    @abstractmethod
+    async def _close(self) -> None:
+        """Close the connection. Must work on partially opened connections."""
+
+
+class SourceTransport(RCONTransport):
+    """Source RCON over TCP, used by Minecraft, ARK, Valve games and most others"""
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._ids = itertools.count(1)
+
+    async def _open(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        request_id = next(self._ids)
+        await self._send(request_id, SOURCE_AUTH, self.password)
+        while True:
+            response_id, response_type, _ = await self._receive()
+            # Valve servers send an empty response value ahead of the auth response
+            if response_type == SOURCE_AUTH_RESPONSE:
+                break
+        if response_id == -1:
+            raise AuthenticationError(f"{self.host}:{self.port} rejected the RCON password")
+
+    async def _execute(self, command: str) -> str:
+        request_id = next(self._ids)
+        await self._send(request_id, SOURCE_EXEC_COMMAND, command)
+        body = await self._receive_body(request_id)
+        if len(body) < SOURCE_FRAGMENT_SIZE:
+            return body.decode("utf-8", errors="replace")
+        # Servers answer requests in order, so the answer to an empty request marks the end of a
+        # fragmented response
+        terminator_id = next(self._ids)
+        await self._send(terminator_id, SOURCE_RESPONSE_VALUE, "")
+        fragments = [body]
+        while True:
+            response_id, _, fragment = await self._receive()
+            if response_id == terminator_id:
+                return b"".join(fragments).decode("utf-8", errors="replace")
+            if response_id == request_id:
+                fragments.append(fragment)
+
+    async def _close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader, self._writer = None, None
+
+    async def _receive_body(self, request_id: int) -> bytes:
+        while True:
+            response_id, _, body = await self._receive()
+            # Skip leftovers of earlier requests, e.g. the trailing packet of a terminator
+            if response_id == request_id:
+                return body
+
+    async def _send(self, request_id: int, request_type: int, body: str) -> None:
+        payload = struct.pack("<ii", request_id, request_type) + body.encode("utf-8") + b"\0\0"
+        self._writer.write(struct.pack("<i", len(payload)) + payload)
+        await self._writer.drain()
+
+    async def _receive(self) -> Tuple[int, int, bytes]:
+        try:
+            size: int = struct.unpack("<i", await self._reader.readexactly(4))[0]
+            packet = await self._reader.readexactly(size)
+        except asyncio.IncompleteReadError as err:
+            raise ConnectionResetError("RCON connection closed by the server") from err
+        response_id, response_type = struct.unpack_from("<ii", packet)
+        return response_id, response_type, packet[8:].rstrip(b"\0")
+
+
+class MinecraftTransport(SourceTransport):
+    """Source RCON of Minecraft, whose commands start with a slash"""
+    command_prefix = "/"
+
+
+class _BattlEyeProtocol(asyncio.DatagramProtocol):
+    """Queue the payloads of received BattlEye packets"""
+    def __init__(self) -> None:
+        self.packets: asyncio.Queue = asyncio.Queue()
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        if len(data) < 7 or data[:2] != b"BE" or data[6] != 0xFF:
+            return
+        if struct.unpack_from("<I", data, 2)[0] != zlib.crc32(data[6:]):
+            return
+        self.packets.put_nowait(data[7:])
+
+    def error_received(self, exc: Exception) -> None:
+        self.packets.put_nowait(exc)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.packets.put_nowait(exc or ConnectionResetError("BattlEye connection closed"))
+
+
+class BattlEyeTransport(RCONTransport):
+    """BattlEye RCon over UDP, used by Arma and DayZ.
+
+    The server drops clients after 45 seconds without packets, which is longer than the idle
+    timeout, so no keep-alive packets are needed.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._protocol: Optional[_BattlEyeProtocol] = None
+        self._sequence = 0
+
+    async def _open(self) -> None:
+        self._transport, self._protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+            _BattlEyeProtocol, remote_addr=(self.host, self.port)
+        )
+        self._send(bytes([BATTLEYE_LOGIN]) + self.password.encode("utf-8"))
+        while True:
+            payload = await self._receive()
+            if payload[0] == BATTLEYE_LOGIN and len(payload) > 1:
+                break
+        if payload[1] != 0x01:
+            raise AuthenticationError(f"{self.host}:{self.port} rejected the RCON password")
+
+    async def _execute(self, command: str) -> str:
+        sequence = self._sequence
+        self._sequence = (self._sequence + 1) % 256
+        self._send(bytes([BATTLEYE_COMMAND, sequence]) + command.encode("utf-8"))
+        parts: Dict[int, bytes] = {}
+        while True:
+            payload = await self._receive()
+            if payload[0] != BATTLEYE_COMMAND or len(payload) < 2 or payload[1] != sequence:
+                continue
+            if len(payload) < 5 or payload[2] != 0x00:
+                return payload[2:].decode("utf-8", errors="replace")
+            # Multipart response: 0x00, number of parts, index of this part
+            parts[payload[4]] = payload[5:]
+            if len(parts) == payload[3]:
+                return b"".join(parts[index] for index in sorted(parts)).decode(
+                    "utf-8", errors="replace"
+                )
+
+    async def _close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+        self._transport, self._protocol = None, None
+
+    def _send(self, payload: bytes) -> None:
+        body = b"\xff" + payload
+        self._transport.sendto(b"BE" + struct.pack("<I", zlib.crc32(body)) + body)
+
+    async def _receive(self) -> bytes:
+        while True:
+            payload = await self._protocol.packets.get()
+            if isinstance(payload, Exception):
+                raise payload
+            if payload and payload[0] == BATTLEYE_SERVER_MESSAGE and len(payload) > 1:
+                # Server messages have to be acknowledged, their content is not needed
+                self._send(bytes([BATTLEYE_SERVER_MESSAGE, payload[1]]))
+                continue
+            if payload:
+                return payload
+
+
+class WebRconTransport(RCONTransport):
+    """WebRcon over a WebSocket with JSON messages, used by Rust"""
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._websocket: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._ids = itertools.count(1)
+
+    async def _open(self) -> None:
+        self._session = aiohttp.ClientSession()
+        url = f"ws://{self.host}:{self.port}/{quote(self.password, safe='')}"
+        try:
+            self._websocket = await self._session.ws_connect(url, heartbeat=self._idle_timeout)
+        except aiohttp.WSServerHandshakeError as err:
+            if err.status in (401, 403):
+                raise AuthenticationError(
+                    f"{self.host}:{self.port} rejected the RCON password"
+                ) from err
+            raise ConnectionRefusedError(f"WebRcon handshake failed: {err}") from err
+
+    async def _execute(self, command: str) -> str:
+        identifier = next(self._ids)
+        await self._websocket.send_json(
+            {"Identifier": identifier, "Message": command, "Name": "WebRcon"}
+        )
+        while True:
+            message = await self._websocket.receive()
+            if message.type != aiohttp.WSMsgType.TEXT:
+                raise ConnectionResetError(f"WebRcon connection closed: {message.type.name}")
+            try:
+                data = json.loads(message.data)
+            except ValueError:
+                continue
+            # Console output of the server arrives on the same socket with identifier 0
+            if isinstance(data, dict) and data.get("Identifier") == identifier:
+                return str(data.get("Message", ""))
+
+    async def _close(self) -> None:
+        if self._websocket is not None:
+            await self._websocket.close()
+        if self._session is not None:
+            await self._session.close()
+        self._session, self._websocket = None, None
+
+
+DEFAULT_TRANSPORT: Type[RCONTransport] = SourceTransport
+TRANSPORTS: Dict[str, Type[RCONTransport]] = {
+    "source": SourceTransport,
+    "minecraft": MinecraftTransport,
+    "ark": SourceTransport,
+    "battleye": BattlEyeTransport,
+    "arma": BattlEyeTransport,
+    "arma2": BattlEyeTransport,
+    "arma3": BattlEyeTransport,
+    "dayz": BattlEyeTransport,
+    "webrcon": WebRconTransport,
+    "rust": WebRconTransport,
+}
+
+
+def register_transport(types: List[str], transport: Type[RCONTransport]) -> None:
+    """Register a transport for server types
+
+    Args:
+        types (List[str]): Server types as entered when authorizing a channel, case-insensitive
+        transport (Type[RCONTransport]): Transport class for these types
+    """
+    for server_type in types:
+        TRANSPORTS[server_type.strip().lower()] = transport
+
+
+def get_transport(server_type: Optional[str]) -> Type[RCONTransport]:
+    """Get the transport of a server type
+
+    Args:
+        server_type (Optional[str]): Server type of a channel config
+
+    Returns:
+        Type[RCONTransport]: Registered transport, DEFAULT_TRANSPORT for unknown types
+    """
+    return TRANSPORTS.get((server_type or "").strip().lower(), DEFAULT_TRANSPORT)
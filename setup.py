@@ -43,5 +43,11 @@ setup(
     author="Maximilian Stephan",
     author_email="stephan.maxi@icloud.com",
     packages=find_packages(exclude=["test", "test.*"]),
-    entry_points={"console_scripts": ["pycon = pycon.bin.daemon:main"]},
+    entry_points={
+        "console_scripts": [
+            "pycon = pycon.bin.daemon:main",
+            "pycon-admin = pycon.bin.admin:main",
+            "pycon-replay = pycon.bin.replay:main",
+        ]
+    },
 )
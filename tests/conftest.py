@@ -0,0 +1,65 @@
+"""Fakes of Discord objects shared by the tests"""
+
+from typing import Dict, Iterable
+
+import discord
+import pytest
+
+
+class FakeState:
+    """Connection state that only creates users"""
+
+    def store_user(self, data: dict) -> discord.User:
+        return discord.User(state=self, data=data)
+
+
+class FakeGuild:
+    """Guild with roles whose member cache is empty, like without the members intent"""
+
+    def __init__(self, guild_id: int = 1, role_ids: Iterable[int] = (), owner_id: int = 0) -> None:
+        self.id = guild_id
+        self.owner_id = owner_id
+        self.default_role = self._role(guild_id, "@everyone", 0)
+        self.roles: Dict[int, discord.Role] = {}
+        for position, role_id in enumerate(role_ids, start=1):
+            self.roles[role_id] = self._role(role_id, f"role{role_id}", position)
+        self.members: Dict[int, discord.Member] = {}
+
+    def _role(self, role_id: int, name: str, position: int) -> discord.Role:
+        return discord.Role(
+            guild=self, state=FakeState(), data={"id": role_id, "name": name, "position": position}
+        )
+
+    def add_member(self, user_id: int, role_ids: Iterable[int] = ()) -> discord.Member:
+        member = discord.Member(
+            data={
+                "user": {
+                    "id": user_id,
+                    "username": f"user{user_id}",
+                    "discriminator": "0001",
+                    "avatar": None,
+                },
+                "roles": [f"{role_id}" for role_id in role_ids],
+            },
+            guild=self,
+            state=FakeState(),
+        )
+        self.members[user_id] = member
+        return member
+
+    def get_role(self, role_id: int) -> discord.Role:
+        return self.roles.get(role_id)
+
+    def get_member(self, user_id: int) -> None:
+        return None
+
+    async def fetch_member(self, user_id: int) -> discord.Member:
+        if user_id not in self.members:
+            response = type("Response", (), {"status": 404, "reason": "Not Found"})()
+            raise discord.NotFound(response, "Unknown Member")
+        return self.members[user_id]
+
+
+@pytest.fixture(name="guild")
+def fixture_guild() -> FakeGuild:
+    return FakeGuild(1, [10, 11, 12])
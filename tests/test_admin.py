@@ -0,0 +1,70 @@
+"""Tests of the streamed deduplication of pycon-admin"""
+
+import json
+
+import pytest
+
+from pycon.bin import admin
+from pycon.handlers.persistence_handler import PersistenceHandler, PersistenceKind
+
+CHANNEL = {"authorized": True, "rcon": "game.example", "port": 25575, "password": "pw"}
+
+
+def write_json(tmp_path, name: str, text: str) -> None:
+    path = PersistenceHandler.get_path(admin.KIND_NAMES[name], admin.METHOD_NAMES["json"], tmp_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+def read_json(tmp_path, name: str):
+    path = PersistenceHandler.get_path(admin.KIND_NAMES[name], admin.METHOD_NAMES["json"], tmp_path)
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def test_last_occurrence_wins_like_json_loads(tmp_path, capsys):
+    # Duplicate keys as they appear in hand-edited files
+    text = '{"1": %s, "2": %s, "1": %s, "x": %s}' % tuple(
+        json.dumps(dict(CHANNEL, type=kind)) for kind in ("ark", "rust", "minecraft", "ark")
+    )
+    write_json(tmp_path, "channels", text)
+    admin.main(["--base-path", str(tmp_path), "prune", "--kind", "channels"])
+    # "x" is no channel ID and dropped
+    assert read_json(tmp_path, "channels") == {
+        "1": dict(CHANNEL, type="minecraft"),
+        "2": dict(CHANNEL, type="rust"),
+    }
+    assert capsys.readouterr().out == (
+        "channels: read 4, written 2, invalid 1, duplicates 1, pruned 0, changed 0\n"
+    )
+
+
+def test_users_are_deduplicated_by_id(tmp_path, capsys):
+    write_json(tmp_path, "users", "[5, 6, 5, 7, 6]")
+    admin.main(["--base-path", str(tmp_path), "validate", "--kind", "users"])
+    assert capsys.readouterr().out == (
+        "users: read 5, checked 3, invalid 0, duplicates 2, pruned 0, changed 0\n"
+    )
+    # Validating writes nothing
+    assert read_json(tmp_path, "users") == [5, 6, 5, 7, 6]
+
+
+def test_last_occurrences_are_not_kept_in_a_dict():
+    entries = ((None, user % 1000) for user in range(5000))
+    last = admin.find_last_occurrences(PersistenceKind.USERS, entries)
+    try:
+        assert not isinstance(last, dict)
+        assert last.get(999) == 4999
+        assert last.get(0) == 4000
+        assert last.get(1000) is None
+    finally:
+        last.close()
+
+
+@pytest.mark.parametrize("method", ["json", "sqlite"])
+def test_migrate_keeps_the_last_occurrence(tmp_path, method):
+    write_json(tmp_path, "prefixes", '{"1": "!", "2": "?", "1": "$"}')
+    admin.main(["--base-path", str(tmp_path), "migrate", "--from", "json", "--to", method])
+    entries = PersistenceHandler.iter_entries(
+        PersistenceKind.PREFIXES, admin.METHOD_NAMES[method], tmp_path
+    )
+    assert sorted(entries) == [("1", "$"), ("2", "?")]
@@ -0,0 +1,144 @@
+"""Tests of the rotating audit log"""
+
+import asyncio
+import gzip
+import json
+import os
+import time
+from dataclasses import asdict
+from typing import Any, List, Optional
+
+import pytest
+
+from pycon.handlers.audit_handler import (
+    CURRENT_SEGMENT,
+    AuditHandler,
+    AuditQuery,
+    AuditRecord,
+    SegmentIndex,
+)
+
+
+def record(ts: float, guild: int = 1, user: int = 5, command: str = "list") -> dict:
+    return asdict(
+        AuditRecord(ts, user, f"user{user}", "100", "mc", "rcon", command, [], "ok", guild)
+    )
+
+
+# Recent enough not to be rotated by age
+NOW = float(int(time.time()))
+
+
+def segment(ts: float) -> str:
+    return f"segment-{int(ts * 1000)}.jsonl.gz"
+
+
+def segments(path) -> List[str]:
+    return sorted(name for name in os.listdir(path) if name.startswith("segment-"))
+
+
+def test_current_segment_is_rotated_into_gzip_segment(tmp_path):
+    handler = AuditHandler(tmp_path, segment_bytes=300)
+    handler._write([record(NOW)])
+    assert (tmp_path / CURRENT_SEGMENT).exists() and not segments(tmp_path)
+    handler._write([record(NOW + 1), record(NOW + 2)])
+    assert not (tmp_path / CURRENT_SEGMENT).exists()
+    assert segments(tmp_path) == [segment(NOW), f"{segment(NOW)}.idx"]
+    with gzip.open(tmp_path / segment(NOW), "rt", encoding="utf-8") as compressed:
+        assert [json.loads(line)["ts"] for line in compressed] == [NOW, NOW + 1, NOW + 2]
+    with open(tmp_path / f"{segment(NOW)}.idx", encoding="utf-8") as index_file:
+        index = SegmentIndex.from_dict(json.load(index_file))
+    assert (index.first, index.last, index.count, index.guilds) == (NOW, NOW + 2, 3, {1})
+
+
+def test_old_segments_and_their_indexes_are_pruned(tmp_path):
+    handler = AuditHandler(tmp_path, segment_bytes=1, max_segments=2)
+    for offset in range(4):
+        handler._write([record(NOW + offset)])
+    kept = [segment(NOW + 2), segment(NOW + 3)]
+    assert segments(tmp_path) == [kept[0], f"{kept[0]}.idx", kept[1], f"{kept[1]}.idx"]
+    assert set(handler._indexes) == set(kept)
+
+
+def test_old_segments_are_rotated_by_age(tmp_path):
+    handler = AuditHandler(tmp_path, segment_age=60)
+    handler._write([record(1000.0)])
+    assert segments(tmp_path) == [segment(1000.0), f"{segment(1000.0)}.idx"]
+
+
+def test_queries_are_scoped_per_guild(tmp_path):
+    handler = AuditHandler(tmp_path, segment_bytes=1)
+    # One segment per guild, the newest records in the current segment
+    handler._write([record(NOW, guild=1)])
+    handler._write([record(NOW + 1, guild=2)])
+    handler._segment_bytes = 1 << 20
+    handler._write([record(NOW + 2, guild=1), record(NOW + 3, guild=2)])
+    assert (tmp_path / CURRENT_SEGMENT).exists()
+
+    def search(query: AuditQuery) -> List[float]:
+        return [found["ts"] - NOW for found in asyncio.run(handler.query(query))]
+
+    assert search(AuditQuery(guild=1)) == [2, 0]
+    assert search(AuditQuery(guild=2)) == [3, 1]
+    assert search(AuditQuery()) == [3, 2, 1, 0]
+    # The segment of the other guild is skipped by its index
+    assert not handler._load_index(segment(NOW + 1)).may_match(AuditQuery(guild=1))
+
+
+def test_index_without_guilds_matches_records_without_guild():
+    index = SegmentIndex.from_dict(
+        {"first": 1, "last": 2, "count": 1, "users": [5], "servers": ["100"], "commands": ["list"]}
+    )
+    assert index.may_match(AuditQuery(guild=0))
+    assert not index.may_match(AuditQuery(guild=1))
+
+
+def test_parse_query():
+    query = AuditHandler.parse_query(["user=<@!5>", "server=<#100>", "command=SAY", "until=1d"])
+    assert (query.user, query.server, query.command) == (5, "100", "say")
+    assert query.since is None and query.until is not None and query.guild is None
+
+
+@pytest.mark.parametrize(
+    "arg, error",
+    [
+        ("user", 'Invalid filter "user".'),
+        ("color=red", 'Unknown filter "color".'),
+        ("since=yesterday", 'Invalid time "yesterday".'),
+        ("until=2023-13-01", 'Invalid time "2023-13-01".'),
+    ],
+)
+def test_parse_query_errors(arg, error):
+    with pytest.raises(ValueError, match=error):
+        AuditHandler.parse_query([arg])
+
+
+class FakeChannel:
+    """Channel that records sent messages"""
+
+    def __init__(self) -> None:
+        self.sent: List[str] = []
+
+    async def send(self, content: str) -> None:
+        self.sent.append(content)
+
+
+def audit(handler: AuditHandler, guild: Optional[Any], *args: str) -> List[str]:
+    channel = FakeChannel()
+    message = type("Message", (), {"channel": channel, "guild": guild})
+    ctx = type(
+        "Context", (), {"prefix": "r!", "command": "audit", "args": args, "message": message}
+    )
+    asyncio.run(handler.handle_audit(ctx))
+    return channel.sent
+
+
+def test_audit_command_only_shows_its_guild(tmp_path):
+    handler = AuditHandler(tmp_path)
+    handler._write([record(1000.0, guild=1, command="save"), record(2000.0, guild=2)])
+    sent = audit(handler, type("Guild", (), {"id": 1}))
+    assert len(sent) == 1 and "save" in sent[0] and "list" not in sent[0]
+    assert audit(handler, None) == ["You cannot audit from a private channel!"]
+    assert audit(handler, type("Guild", (), {"id": 1}), "color=red")[0].startswith(
+        'Unknown filter "color".'
+    )
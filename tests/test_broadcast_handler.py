@@ -0,0 +1,181 @@
+"""Tests of the concurrent fan-out of the broadcast handler"""
+
+import asyncio
+from typing import Any, List, Optional, Tuple
+
+from pycon.handlers.broadcast_handler import MAX_MESSAGE_LENGTH, BroadcastHandler
+from pycon.handlers.health_handler import ServerUnavailableError
+from pycon.handlers.permission_handler import PermissionHandler
+from pycon.handlers.transport_handler import AuthenticationError
+
+ERRORS = {
+    "down": ServerUnavailableError(("game.example", 25575), 0.0),
+    "auth": AuthenticationError("wrong password"),
+    "refused": ConnectionRefusedError("refused"),
+    "boom": RuntimeError("unexpected"),
+}
+
+
+class FakeRCONHandler:
+    """Answer after a delay, fail as the server config says and track the concurrency"""
+
+    def __init__(self, delay: float = 0.02) -> None:
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.timeouts: List[Optional[float]] = []
+
+    async def run(
+        self, creds: Any, command: str, *args: str, timeout: Optional[float] = None
+    ) -> str:
+        self.timeouts.append(timeout)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            behaviour = creds.get("behaviour", "ok")
+            if behaviour == "hang":
+                await asyncio.wait_for(asyncio.sleep(60), timeout)
+            await asyncio.sleep(self.delay)
+            if behaviour in ERRORS:
+                raise ERRORS[behaviour]
+            return " ".join((command, *args, "on", creds["name"]))
+        finally:
+            self.running -= 1
+
+
+class FakeChannel:
+    """Channel that records sent messages"""
+
+    def __init__(self, channel_id: int, name: str = "") -> None:
+        self.id = channel_id
+        self.name = name
+        self.sent: List[str] = []
+
+    async def send(self, content: str) -> None:
+        self.sent.append(content)
+
+
+class FakeAuditHandler:
+    """Record audited results"""
+
+    def __init__(self) -> None:
+        self.records: List[Tuple[str, Any, str, str]] = []
+
+    def record(self, ctx: Any, kind: str, server: Any, server_name: str, result: str) -> None:
+        self.records.append((kind, server, server_name, result))
+
+
+def targets(*behaviours: str) -> List[Tuple[FakeChannel, dict]]:
+    return [
+        (FakeChannel(100 + index, f"server{index}"), {"name": f"server{index}", "behaviour": kind})
+        for index, kind in enumerate(behaviours)
+    ]
+
+
+def make_handler(rcon: FakeRCONHandler, **kwargs: Any) -> BroadcastHandler:
+    return BroadcastHandler({}, rcon, PermissionHandler({}, []), FakeAuditHandler(), **kwargs)
+
+
+def test_concurrency_is_capped():
+    rcon = FakeRCONHandler()
+    handler = make_handler(rcon, concurrency=3)
+    results = asyncio.run(handler.broadcast(targets(*["ok"] * 10), "save", []))
+    assert rcon.max_running == 3
+    assert all(result.success for result in results)
+
+
+def test_servers_run_concurrently():
+    rcon = FakeRCONHandler(delay=0.1)
+    handler = make_handler(rcon, concurrency=10)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await handler.broadcast(targets(*["ok"] * 10), "save", [])
+        return loop.time() - start
+
+    assert asyncio.run(scenario()) < 0.5
+    assert rcon.max_running == 10
+
+
+def test_timeout_is_per_server():
+    rcon = FakeRCONHandler()
+    handler = make_handler(rcon, server_timeout=0.05)
+    results = asyncio.run(handler.broadcast(targets("hang", "ok"), "save", []))
+    assert rcon.timeouts == [0.05, 0.05]
+    assert [(result.success, result.response) for result in results] == [
+        (False, "timed out"),
+        (True, "save on server1"),
+    ]
+
+
+def test_errors_are_reported_per_server():
+    handler = make_handler(FakeRCONHandler())
+    results = asyncio.run(
+        handler.broadcast(targets("down", "auth", "refused", "boom", "ok"), "say", ["hi"])
+    )
+    # One server failing unexpectedly does not cost the results of the others
+    assert [(result.server, result.success, result.response) for result in results] == [
+        (100, False, "server down"),
+        (101, False, "wrong password"),
+        (102, False, "connection failed"),
+        (103, False, "error"),
+        (104, True, "say hi on server4"),
+    ]
+
+
+def test_summary_fits_into_one_message():
+    handler = make_handler(FakeRCONHandler(delay=0), concurrency=50)
+    results = asyncio.run(handler.broadcast(targets(*["ok", "boom"] * 100), "list", []))
+    summary = BroadcastHandler._summary(["list"], results)
+    assert len(summary) <= MAX_MESSAGE_LENGTH
+    assert summary.startswith("`list`: 100/200 servers succeeded\n```\nERR server1: error")
+    assert summary.endswith("\n...\n```")
+
+
+def test_short_summary_is_not_truncated():
+    handler = make_handler(FakeRCONHandler(delay=0))
+    results = asyncio.run(handler.broadcast(targets("ok", "down"), "list", []))
+    assert BroadcastHandler._summary(["list"], results).split("\n") == [
+        "`list`: 1/2 servers succeeded",
+        "```",
+        "ERR server1: server down",
+        "ok  server0: list on server0",
+        "```",
+    ]
+
+
+class FakeGuild:
+    """Guild with the channels of broadcast targets"""
+
+    def __init__(self, channels: List[FakeChannel]) -> None:
+        self.id = 1
+        self._channels = {channel.id: channel for channel in channels}
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self._channels.get(channel_id)
+
+
+def test_handle_broadcast_audits_every_server():
+    servers = targets("ok", "refused")
+    auth_channels = {f"{channel.id}": dict(creds, authorized=True) for channel, creds in servers}
+    audit = FakeAuditHandler()
+    handler = BroadcastHandler(auth_channels, FakeRCONHandler(), PermissionHandler({}, []), audit)
+    origin = FakeChannel(1)
+    guild = FakeGuild([channel for channel, _ in servers])
+    author = type("User", (), {"id": 5})()
+    message = type("Message", (), {"guild": guild, "channel": origin, "author": author})
+    ctx = type(
+        "Context",
+        (),
+        {"prefix": "r!", "command": "broadcast", "args": ["save"], "message": message},
+    )
+    asyncio.run(handler.handle_broadcast(ctx))
+    assert audit.records == [
+        ("broadcast", 100, "server0", "ok"),
+        ("broadcast", 101, "server1", "connection failed"),
+    ]
+    assert origin.sent == [
+        "`save`: 1/2 servers succeeded\n```\nERR server1: connection failed\n"
+        "ok  server0: save on server0\n```"
+    ]
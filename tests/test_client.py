@@ -0,0 +1,81 @@
+"""Tests of the message routing of the Pycon client"""
+
+from typing import Any, Optional
+
+import pytest
+
+from pycon.client.client import PyconClient
+from pycon.handlers.trace_handler import AUTH, COMMAND, DROPPED, RCON
+
+ALLOWED_GUILD = 1
+ACTIVE_CHANNEL = 100
+
+
+def message(content: str, guild_id: Optional[int] = ALLOWED_GUILD, channel_id: int = 200) -> Any:
+    guild = type("Guild", (), {"id": guild_id})() if guild_id is not None else None
+    channel = type("Channel", (), {"id": channel_id})()
+    author = type("User", (), {"id": 5})()
+    return type(
+        "Message", (), {"content": content, "guild": guild, "channel": channel, "author": author}
+    )()
+
+
+@pytest.fixture(name="client")
+def fixture_client() -> PyconClient:
+    client = PyconClient("token", servers=[f"{ALLOWED_GUILD}"])
+    client._PyconClient__authorized_channels.update(
+        {f"{ACTIVE_CHANNEL}": {"authorized": True}, "300": {"authorized": False}}
+    )
+    client._PyconClient__prefixes[3] = "!"
+    client._refresh_active_channels()
+    return client
+
+
+def route(client: PyconClient, *args: Any) -> str:
+    kind, handler, ctx = client._route_message(message(*args))
+    assert (handler is None) == (ctx is None)
+    return kind
+
+
+@pytest.mark.parametrize("content", ["r!help", "list"])
+def test_messages_of_other_guilds_are_dropped(client, content):
+    assert route(client, content, 2, ACTIVE_CHANNEL) == DROPPED
+
+
+def test_every_guild_is_allowed_without_allowlist():
+    client = PyconClient("token")
+    assert route(client, "r!help", 2) == COMMAND
+
+
+@pytest.mark.parametrize("channel_id", [200, 300])
+def test_messages_without_prefix_in_inactive_channels_are_dropped(client, channel_id):
+    # Channel 300 is known, but not authorized yet
+    assert route(client, "list", ALLOWED_GUILD, channel_id) == DROPPED
+
+
+def test_messages_of_active_channels_go_to_rcon(client):
+    kind, handler, ctx = client._route_message(message("list uuids", channel_id=ACTIVE_CHANNEL))
+    assert (kind, handler, ctx.command, ctx.args) == (RCON, client.handle_rcon, "list", ["uuids"])
+
+
+@pytest.mark.parametrize(
+    "content, guild_id",
+    [("r!help", ALLOWED_GUILD), ("  r!help", ALLOWED_GUILD), ("!help", 3), ("r!help", None)],
+)
+def test_commands_with_prefix_are_routed(content, guild_id):
+    client = PyconClient("token")
+    client._PyconClient__prefixes[3] = "!"
+    kind, _, ctx = client._route_message(message(content, guild_id))
+    assert (kind, ctx.command) == (COMMAND, "help")
+
+
+def test_default_prefix_is_dropped_in_guilds_with_own_prefix():
+    client = PyconClient("token")
+    client._PyconClient__prefixes[3] = "!"
+    assert route(client, "r!help", 3) == DROPPED
+
+
+def test_direct_messages_of_open_authorizations_are_routed(client):
+    assert route(client, "game.example 25575 secret", None) == DROPPED
+    client._PyconClient__open_auths[5] = {"channel": ACTIVE_CHANNEL}
+    assert route(client, "game.example 25575 secret", None) == AUTH
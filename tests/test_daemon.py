@@ -0,0 +1,55 @@
+"""Tests of the startup of the pycon daemon"""
+
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from pycon.client.startup_profile import StartupProfile
+
+ROOT = Path(__file__).parent.parent
+# Runs pycon --help and prints the heavy modules that got imported
+HELP_SCRIPT = """
+import sys
+sys.argv = ["pycon", "--help"]
+from pycon.bin import daemon
+try:
+    daemon.main()
+except SystemExit as exit:
+    assert exit.code == 0, exit.code
+print(sorted(name for name in sys.modules if name.split(".")[0] in ("discord", "aiohttp")))
+"""
+
+
+def test_help_does_not_import_discord_or_aiohttp():
+    result = subprocess.run(
+        [sys.executable, "-c", HELP_SCRIPT], capture_output=True, text=True, check=True, cwd=ROOT
+    )
+    assert "usage: pycon" in result.stdout
+    assert result.stdout.splitlines()[-1] == "[]"
+
+
+def test_client_module_is_lazy():
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, pycon.bin.daemon; print('discord' in sys.modules)"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_profile_reports_overlapping_phases():
+    profile = StartupProfile()
+    with profile.phase("outer"):
+        start = time.perf_counter()
+        time.sleep(0.01)
+        profile.add("inner", start)
+    lines = profile.report().splitlines()
+    assert lines[0] == "Startup profile (start offset, duration):"
+    assert [line.split("ms  ")[-1] for line in lines[1:]] == ["inner", "outer", "total"]
+    # Each phase has its own duration of at least the sleep
+    durations = [float(re.findall(r"([\d.]+) ms", line)[1]) for line in lines[1:3]]
+    assert all(duration >= 10 for duration in durations)
@@ -0,0 +1,149 @@
+"""Tests of the TTL cache of the DNS resolver"""
+
+import asyncio
+import socket
+from typing import Dict, List
+
+import pytest
+
+from pycon.handlers.dns_handler import DNSResolver
+
+UNKNOWN_HOST = "unknown.example"
+
+
+class FakeGetaddrinfo:
+    """Stand-in for loop.getaddrinfo that counts lookups and answers after a delay"""
+
+    def __init__(self, delay: float = 0.01) -> None:
+        self.delay = delay
+        self.calls: Dict[str, int] = {}
+
+    async def __call__(self, host: str, port: int, **kwargs) -> List[tuple]:
+        self.calls[host] = self.calls.get(host, 0) + 1
+        await asyncio.sleep(self.delay)
+        if host == UNKNOWN_HOST:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (f"10.0.0.{self.calls[host]}", port))]
+
+
+def run(scenario, getaddrinfo: FakeGetaddrinfo):
+    async def patched():
+        asyncio.get_running_loop().getaddrinfo = getaddrinfo
+        return await scenario()
+
+    return asyncio.run(patched())
+
+
+def test_ip_addresses_are_not_looked_up():
+    getaddrinfo = FakeGetaddrinfo()
+    resolver = DNSResolver()
+    assert run(lambda: resolver.resolve("192.0.2.1", 25575), getaddrinfo) == "192.0.2.1"
+    assert not getaddrinfo.calls
+
+
+def test_positive_entries_expire():
+    getaddrinfo = FakeGetaddrinfo()
+    resolver = DNSResolver(positive_ttl=0.2)
+
+    async def scenario():
+        first = await resolver.resolve("game.example")
+        cached = await resolver.resolve("game.example")
+        await asyncio.sleep(0.25)
+        return first, cached, await resolver.resolve("game.example")
+
+    assert run(scenario, getaddrinfo) == ("10.0.0.1", "10.0.0.1", "10.0.0.2")
+    assert getaddrinfo.calls == {"game.example": 2}
+
+
+def test_negative_entries_expire():
+    getaddrinfo = FakeGetaddrinfo()
+    resolver = DNSResolver(negative_ttl=0.2)
+
+    async def scenario():
+        for delay in (0, 0, 0.25):
+            await asyncio.sleep(delay)
+            with pytest.raises(socket.gaierror):
+                await resolver.resolve(UNKNOWN_HOST)
+
+    run(scenario, getaddrinfo)
+    # The second failure is served from the cache
+    assert getaddrinfo.calls == {UNKNOWN_HOST: 2}
+
+
+def test_concurrent_lookups_are_shared():
+    getaddrinfo = FakeGetaddrinfo()
+    resolver = DNSResolver()
+
+    async def scenario():
+        return await asyncio.gather(*(resolver.resolve("game.example") for _ in range(5)))
+
+    assert run(scenario, getaddrinfo) == ["10.0.0.1"] * 5
+    assert getaddrinfo.calls == {"game.example": 1}
+    assert not resolver._pending
+
+
+def test_cancelled_caller_does_not_cancel_other_waiters():
+    getaddrinfo = FakeGetaddrinfo(delay=0.1)
+    resolver = DNSResolver()
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        first = loop.create_task(resolver.resolve("game.example"))
+        second = loop.create_task(resolver.resolve("game.example"))
+        await asyncio.sleep(0.01)
+        # E.g. the command of the first caller timed out
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert run(scenario, getaddrinfo) == "10.0.0.1"
+    assert getaddrinfo.calls == {"game.example": 1}
+    assert "game.example" in resolver._cache
+
+
+def test_refresh_loop_renews_entries_before_they_expire():
+    getaddrinfo = FakeGetaddrinfo()
+    resolver = DNSResolver(positive_ttl=0.3, refresh_interval=0.1)
+
+    async def scenario():
+        resolver.start()
+        await resolver.resolve("game.example")
+        await asyncio.sleep(0.45)
+        # Served from the refreshed entry without a lookup on this path
+        calls = getaddrinfo.calls["game.example"]
+        address = await resolver.resolve("game.example")
+        assert getaddrinfo.calls["game.example"] == calls
+        await resolver.stop()
+        return address
+
+    assert run(scenario, getaddrinfo) != "10.0.0.1"
+    assert getaddrinfo.calls["game.example"] >= 2
+
+
+def test_refresh_keeps_last_addresses_if_the_lookup_fails():
+    getaddrinfo = FakeGetaddrinfo()
+    resolver = DNSResolver(positive_ttl=0.3, refresh_interval=0.2)
+
+    async def scenario():
+        await resolver.resolve("game.example")
+        # The host vanishes from DNS while its entry is still valid
+        resolver._cache[UNKNOWN_HOST] = resolver._cache.pop("game.example")
+        await resolver._refresh()
+        return await resolver.resolve(UNKNOWN_HOST)
+
+    assert run(scenario, getaddrinfo) == "10.0.0.1"
+    assert getaddrinfo.calls == {"game.example": 1, UNKNOWN_HOST: 1}
+
+
+def test_refresh_drops_idle_entries():
+    getaddrinfo = FakeGetaddrinfo()
+    resolver = DNSResolver(idle_ttl=0.05)
+
+    async def scenario():
+        await resolver.resolve("game.example")
+        await asyncio.sleep(0.1)
+        await resolver._refresh()
+
+    run(scenario, getaddrinfo)
+    assert not resolver._cache
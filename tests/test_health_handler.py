@@ -0,0 +1,141 @@
+"""Tests of the circuit breaker state transitions"""
+
+import asyncio
+import struct
+from typing import List
+
+import pytest
+
+from pycon.handlers.health_handler import (
+    BreakerState,
+    CircuitBreaker,
+    HealthHandler,
+    ServerUnavailableError,
+)
+
+BACKOFF = 0.01
+
+
+class Probe:
+    """Probe that fails with the given errors, then succeeds"""
+
+    def __init__(self, *errors: BaseException) -> None:
+        self.errors: List[BaseException] = list(errors)
+        self.calls = 0
+        self.states: List[BreakerState] = []
+        self.breaker: CircuitBreaker = None
+
+    async def __call__(self) -> None:
+        self.calls += 1
+        self.states.append(self.breaker.state)
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def make_breaker(probe: Probe, threshold: int = 3) -> CircuitBreaker:
+    breaker = CircuitBreaker(("host", 1), threshold, BACKOFF, 4 * BACKOFF)
+    probe.breaker = breaker
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    async def scenario():
+        probe = Probe(OSError("down"))
+        breaker = make_breaker(probe)
+        breaker.record_failure(probe)
+        breaker.record_failure(probe)
+        breaker.check()
+        assert breaker.state == BreakerState.CLOSED
+        breaker.record_failure(probe)
+        assert breaker.state == BreakerState.OPEN
+        with pytest.raises(ServerUnavailableError) as err:
+            breaker.check()
+        assert err.value.key == ("host", 1)
+        assert err.value.since == breaker.since
+        await breaker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_success_resets_failure_count():
+    async def scenario():
+        probe = Probe()
+        breaker = make_breaker(probe)
+        for _ in range(5):
+            breaker.record_failure(probe)
+            breaker.record_failure(probe)
+            breaker.record_success()
+        assert breaker.state == BreakerState.CLOSED
+        breaker.check()
+
+    asyncio.run(scenario())
+
+
+def test_probe_is_half_open_and_closes_on_success():
+    async def scenario():
+        probe = Probe(OSError("down"), asyncio.TimeoutError())
+        breaker = make_breaker(probe, threshold=1)
+        breaker.record_failure(probe)
+        await asyncio.sleep(20 * BACKOFF)
+        assert probe.calls == 3
+        assert probe.states == [BreakerState.HALF_OPEN] * 3
+        assert breaker.state == BreakerState.CLOSED
+        breaker.check()
+        # A new failure counts from zero again
+        breaker.record_failure(probe)
+        assert breaker.state == BreakerState.OPEN
+        await breaker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_failed_probe_reopens_with_backoff():
+    async def scenario():
+        probe = Probe(*(OSError("down") for _ in range(100)))
+        breaker = make_breaker(probe, threshold=1)
+        breaker.record_failure(probe)
+        await asyncio.sleep(BACKOFF / 2)
+        assert probe.calls == 0
+        await asyncio.sleep(15 * BACKOFF)
+        # Backoff doubles up to the maximum: 1, 2, 4, 4, ... times BACKOFF
+        assert 2 <= probe.calls <= 5
+        assert breaker.state in (BreakerState.OPEN, BreakerState.HALF_OPEN)
+        with pytest.raises(ServerUnavailableError):
+            breaker.check()
+        await breaker.stop()
+        assert breaker._probe_task is None
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("error", [struct.error("unpack"), ValueError("bad"), KeyError("x")])
+def test_unexpected_probe_errors_keep_probing(error):
+    async def scenario():
+        probe = Probe(error)
+        breaker = make_breaker(probe, threshold=1)
+        breaker.record_failure(probe)
+        await asyncio.sleep(20 * BACKOFF)
+        assert probe.calls == 2
+        assert breaker.state == BreakerState.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_only_one_probe_while_open():
+    async def scenario():
+        probe = Probe(*(OSError("down") for _ in range(100)))
+        breaker = make_breaker(probe, threshold=1)
+        breaker.record_failure(probe)
+        task = breaker._probe_task
+        for _ in range(10):
+            breaker.record_failure(probe)
+        assert breaker._probe_task is task
+        await breaker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_health_handler_keeps_one_breaker_per_endpoint():
+    handler = HealthHandler()
+    assert handler.get("host", 1) is handler.get("host", "1")
+    assert handler.get("host", 1) is not handler.get("host", 2)
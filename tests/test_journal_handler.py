@@ -0,0 +1,110 @@
+"""Tests of the console feed of the journal handler"""
+
+import asyncio
+import sys
+from typing import Any, List
+
+import pytest
+
+from pycon.handlers import journal_handler
+from pycon.handlers.journal_handler import JournalHandler, JournalReader
+from pycon.handlers.permission_handler import PermissionHandler
+
+# Fake journalctl: a joined line, a line above the 64 KiB stream limit and a left line
+FAKE_JOURNAL = (
+    "import sys\n"
+    "sys.stdout.write('Steve joined the game\\n' + 'x' * 100000 + '\\nAlex left the game\\n')\n"
+)
+
+
+class FakeChannel:
+    """Channel that records sent messages"""
+
+    def __init__(self, channel_id: int = 100) -> None:
+        self.id = channel_id
+        self.sent: List[str] = []
+
+    async def send(self, content: str) -> None:
+        self.sent.append(content)
+
+
+@pytest.fixture(name="spawns")
+def fixture_spawns(monkeypatch) -> List[tuple]:
+    """Run the fake journal instead of journalctl and record the arguments of every start"""
+    spawns: List[tuple] = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def fake_exec(*args: str, **kwargs: Any):
+        spawns.append(args)
+        return await create_subprocess_exec(sys.executable, "-c", FAKE_JOURNAL, **kwargs)
+
+    monkeypatch.setattr(journal_handler.asyncio, "create_subprocess_exec", fake_exec)
+    monkeypatch.setattr(journal_handler, "RESTART_DELAY", 0.05)
+    return spawns
+
+
+def test_read_loop_skips_overlong_lines_and_restarts(spawns):
+    reader = JournalReader("minecraft", flush_interval=3600)
+    lines: List[str] = []
+    reader.dispatch = lines.append
+
+    async def scenario():
+        reader.subscribe(FakeChannel(), ["join", "leave"])
+        while len(spawns) < 2:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)
+        await reader.stop()
+
+    asyncio.run(scenario())
+    assert spawns[0][-1] == "--unit=minecraft"
+    # The reader survived the overlong line and read the lines after it
+    assert lines[0] == "Steve joined the game"
+    assert "Alex left the game" in lines
+    assert all(len(line) < 100000 for line in lines)
+    # journalctl ended, so it was restarted
+    assert lines.count("Steve joined the game") >= 2
+    assert reader._process is None and not reader._tasks
+
+
+@pytest.fixture(name="handler")
+def fixture_handler() -> JournalHandler:
+    # Role 10 of guild 1 grants BOSS, user 99 is in the sys auth file
+    auth_channels = {"100": {"authorized": True, "type": "minecraft"}}
+    return JournalHandler(auth_channels, PermissionHandler({"1": {"10": 3}}, [99]))
+
+
+def console(handler: JournalHandler, author: Any, *args: str) -> FakeChannel:
+    channel = FakeChannel()
+    message = type("Message", (), {"channel": channel, "author": author})
+    ctx = type(
+        "Context", (), {"prefix": "r!", "command": "console", "args": args, "message": message}
+    )
+
+    async def scenario():
+        await handler.handle_console(ctx)
+        await handler.stop()
+
+    asyncio.run(scenario())
+    return channel
+
+
+def test_role_granted_boss_cannot_enable_feed(handler, guild, spawns):
+    channel = console(handler, guild.add_member(5, [10]), "on")
+    assert channel.sent == ["You don't have permissions for this command."]
+    assert "console" not in handler._auth_channels["100"]
+    assert not spawns
+
+
+def test_authorized_user_enables_feed(handler, guild, spawns):
+    channel = console(handler, guild.add_member(99), "on", "join")
+    assert channel.sent == ["Console feed enabled for join."]
+    assert handler._auth_channels["100"]["console"] == ["join"]
+
+
+@pytest.mark.parametrize("server_type", ["sshd --since=x", "../minecraft", "-minecraft"])
+def test_invalid_units_are_refused(handler, guild, spawns, server_type):
+    handler._auth_channels["100"]["type"] = server_type
+    channel = console(handler, guild.add_member(99), "on")
+    assert channel.sent == ["The server type of this channel is no valid unit."]
+    assert "console" not in handler._auth_channels["100"]
+    assert not spawns
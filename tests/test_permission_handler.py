@@ -0,0 +1,104 @@
+"""Tests of the auth stage enforcement of the permission handler"""
+
+import asyncio
+
+import discord
+import pytest
+
+from pycon.client.client import PyconClient
+from pycon.handlers.command_handler import CommandAuthStage
+from pycon.handlers.permission_handler import PermissionHandler
+
+CROOK, HITMAN, BOSS = CommandAuthStage.CROOK, CommandAuthStage.HITMAN, CommandAuthStage.BOSS
+
+
+@pytest.fixture(name="permissions")
+def fixture_permissions() -> PermissionHandler:
+    # Guild 1: role 10 grants HITMAN, role 11 BOSS, role 13 does not exist (yet). User 99 is in
+    # the sys auth file.
+    return PermissionHandler({"1": {"10": 2, "11": 3, "13": 3}}, [99])
+
+
+@pytest.mark.parametrize("stage, allowed", [(CROOK, True), (HITMAN, False), (BOSS, False)])
+def test_users_without_roles(permissions, guild, stage, allowed):
+    assert permissions.is_allowed(guild.add_member(5), stage) == allowed
+    # Users outside of guilds, e.g. in DMs, have no roles
+    assert permissions.is_allowed(discord.Object(5), stage) == allowed
+
+
+@pytest.mark.parametrize("stage", [CROOK, HITMAN, BOSS])
+def test_authorized_users_are_boss_everywhere(permissions, guild, stage):
+    assert permissions.is_allowed(guild.add_member(99), stage)
+    assert permissions.is_allowed(discord.Object(99), stage)
+    assert permissions.is_authorized_user(99)
+
+
+def test_owner_is_hitman(permissions, guild):
+    guild.owner_id = 5
+    owner = guild.add_member(5)
+    assert permissions.is_allowed(owner, HITMAN)
+    assert not permissions.is_allowed(owner, BOSS)
+    assert not permissions.is_authorized_user(5)
+
+
+@pytest.mark.parametrize(
+    "role_ids, stages",
+    [
+        ([10], {CROOK, HITMAN}),
+        ([11], {CROOK, HITMAN, BOSS}),
+        ([10, 12], {CROOK, HITMAN}),
+        ([12], {CROOK}),
+    ],
+)
+def test_role_granted_stages(permissions, guild, role_ids, stages):
+    member = guild.add_member(5, role_ids)
+    assert {stage for stage in CommandAuthStage if permissions.is_allowed(member, stage)} == stages
+    # Roles never make a user authorized for system commands
+    assert not permissions.is_authorized_user(5)
+
+
+def test_roles_of_other_guilds_grant_nothing(permissions, guild):
+    guild.id = 2
+    assert not permissions.is_allowed(guild.add_member(5, [11]), HITMAN)
+
+
+def test_set_role_stage_invalidates_the_index(permissions, guild):
+    member = guild.add_member(5, [12])
+    assert not permissions.is_allowed(member, HITMAN)
+    permissions.set_role_stage(guild, 12, HITMAN)
+    assert permissions.is_allowed(member, HITMAN)
+    permissions.set_role_stage(guild, 12, None)
+    assert not permissions.is_allowed(member, HITMAN)
+    assert permissions.to_dict() == {"1": {"10": 2, "11": 3, "13": 3}}
+
+
+@pytest.fixture(name="client")
+def fixture_client(permissions) -> PyconClient:
+    client = PyconClient("token", servers=["1"])
+    client._PyconClient__permission_handler = permissions
+    return client
+
+
+@pytest.mark.parametrize("event", ["on_guild_role_create", "on_guild_role_update"])
+def test_role_events_invalidate_the_index(permissions, guild, client, event):
+    member = guild.add_member(5, [13])
+    # Role 13 is granted BOSS but does not exist, so the compiled index ignores it
+    assert not permissions.is_allowed(member, BOSS)
+    guild.roles[13] = guild._role(13, "role13", 4)
+    # Still served from the compiled index
+    assert not permissions.is_allowed(member, BOSS)
+    role = guild.roles[13]
+    args = (role,) if event == "on_guild_role_create" else (role, role)
+    asyncio.run(getattr(client, event)(*args))
+    assert permissions.is_allowed(member, BOSS)
+
+
+def test_role_delete_and_guild_update_invalidate_the_index(permissions, guild, client):
+    member = guild.add_member(5, [11])
+    assert permissions.is_allowed(member, BOSS)
+    role = guild.roles.pop(11)
+    asyncio.run(client.on_guild_role_delete(role))
+    assert not permissions.is_allowed(member, BOSS)
+    guild.roles[11] = role
+    asyncio.run(client.on_guild_update(guild, guild))
+    assert permissions.is_allowed(member, BOSS)
@@ -0,0 +1,101 @@
+"""Tests of the streaming JSON parser of the persistence handler"""
+
+import io
+import json
+
+import pytest
+
+from pycon.handlers import persistence_handler
+from pycon.handlers.persistence_handler import _iter_json
+
+NESTED = {
+    "1": {"rcon": "mc.example.org", "port": 25575, "tags": ["a", {"b": [1, 2.5, None]}]},
+    "2": {"password": 'quote " brace } bracket ] comma ,', "empty": {}, "list": []},
+    "3": {"unicode": "café ☃", "escape": "back\\slash\nnewline\ttab \\u0041"},
+    "4": -12345678901234567890,
+    "5": True,
+}
+
+
+@pytest.fixture(params=[1, 2, 7, 64 * 1024], ids=lambda size: f"chunk{size}")
+def chunk_size(request, monkeypatch):
+    """Read the JSON in chunks of different sizes, so values are cut at every position"""
+    monkeypatch.setattr(persistence_handler, "STREAM_CHUNK_SIZE", request.param)
+    return request.param
+
+
+def test_nested_object(chunk_size):
+    text = json.dumps(NESTED, indent=2)
+    assert dict(_iter_json(io.StringIO(text))) == NESTED
+
+
+def test_escaped_keys_and_values(chunk_size):
+    data = {'key "with" quotes': '\\"', "k\\": "\u0000\u001f", "}": "{"}
+    assert dict(_iter_json(io.StringIO(json.dumps(data)))) == data
+
+
+def test_list(chunk_size):
+    items = [1, 10, 100, 1e10, "x", [[]], {"a": {"b": {}}}]
+    assert list(_iter_json(io.StringIO(json.dumps(items)))) == [(None, item) for item in items]
+
+
+def test_number_at_chunk_boundary(chunk_size):
+    assert list(_iter_json(io.StringIO("[123456789, 987654321]"))) == [
+        (None, 123456789),
+        (None, 987654321),
+    ]
+
+
+@pytest.mark.parametrize("text", ["", "   \n", "{}", "[ ]", " { \n } "])
+def test_empty(text, chunk_size):
+    assert not list(_iter_json(io.StringIO(text)))
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"a": 1',
+        '{"a": 1,',
+        '{"a": {"b": [1, 2',
+        '{"a": "unterminated',
+        '{"a"',
+        '{"a":',
+        "[1, 2",
+        '[{"a": 1}',
+    ],
+)
+def test_truncated(text, chunk_size):
+    with pytest.raises(ValueError):
+        list(_iter_json(io.StringIO(text)))
+
+
+def test_truncated_yields_complete_entries_first(chunk_size):
+    entries = _iter_json(io.StringIO('{"a": 1, "b": {"c": 2}, "d": [3'))
+    assert next(entries) == ("a", 1)
+    assert next(entries) == ("b", {"c": 2})
+    with pytest.raises(ValueError):
+        next(entries)
+
+
+@pytest.mark.parametrize("text", ['"string"', "42", '{"a" 1}', '{"a": 1 "b": 2}', "[1 2]"])
+def test_malformed(text, chunk_size):
+    with pytest.raises(ValueError):
+        list(_iter_json(io.StringIO(text)))
+
+
+def test_matches_json_loads_on_written_entries(tmp_path):
+    channels = {
+        f"{channel_id}": {"rcon": f"host{channel_id}", "port": channel_id}
+        for channel_id in range(500)
+    }
+    kind = persistence_handler.PersistenceKind.CHANNELS
+    method = persistence_handler.PersistenceMethod.JSON
+    count = persistence_handler.PersistenceHandler.write_entries(
+        kind, iter(channels.items()), method, tmp_path
+    )
+    path = persistence_handler.PersistenceHandler.get_path(kind, method, tmp_path)
+    assert count == len(channels)
+    assert json.loads(path.read_text(encoding="utf-8")) == channels
+    assert dict(persistence_handler.PersistenceHandler.iter_entries(kind, method, tmp_path)) == (
+        channels
+    )
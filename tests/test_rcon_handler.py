@@ -0,0 +1,105 @@
+"""Tests of the transport management of the RCON handler"""
+
+import asyncio
+from typing import List
+
+import pytest
+
+from pycon.handlers import transport_handler
+from pycon.handlers.rcon_handler import RCONHandler
+from pycon.handlers.transport_handler import RCONTransport
+
+
+class FakeResolver:
+    """Resolver that takes a moment to answer, so concurrent callers overlap"""
+
+    async def resolve(self, host: str, port: int) -> str:
+        await asyncio.sleep(0.01)
+        return "127.0.0.1"
+
+    def invalidate(self, host: str) -> None:
+        pass
+
+
+class FakeTransport(RCONTransport):
+    """Transport whose commands wait until they are released"""
+
+    instances: List["FakeTransport"] = []
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.release = asyncio.Event()
+        self.closed = False
+        FakeTransport.instances.append(self)
+
+    async def _open(self) -> None:
+        self.closed = False
+
+    async def _execute(self, command: str) -> str:
+        await self.release.wait()
+        return f"{self.password}: {command}"
+
+    async def _close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture(name="creds")
+def fixture_creds(monkeypatch) -> dict:
+    FakeTransport.instances = []
+    monkeypatch.setitem(transport_handler.TRANSPORTS, "fake", FakeTransport)
+    return {"rcon": "game.example", "port": 25575, "password": "old", "type": "fake"}
+
+
+@pytest.mark.parametrize(
+    "server_type, prefix",
+    [("Minecraft", "/"), ("minecraft", "/"), (" MINECRAFT ", "/"), ("ARK", ""), (None, "")],
+)
+def test_command_prefix_uses_the_normalized_type(server_type, prefix):
+    assert RCONHandler.command_prefix({"type": server_type}) == prefix
+
+
+def test_concurrent_first_commands_share_one_transport(creds):
+    handler = RCONHandler(FakeResolver())
+
+    async def scenario():
+        return await asyncio.gather(*(handler.get_transport(creds) for _ in range(5)))
+
+    transports = asyncio.run(scenario())
+    assert len(FakeTransport.instances) == 1
+    assert all(transport is transports[0] for transport in transports)
+
+
+def test_replaced_transport_is_closed_after_running_commands(creds):
+    handler = RCONHandler(FakeResolver())
+
+    async def scenario():
+        running = asyncio.get_running_loop().create_task(handler.run(creds, "list"))
+        await asyncio.sleep(0.05)
+        old = FakeTransport.instances[0]
+        # The password changes while the command runs on the old transport
+        new_creds = dict(creds, password="new")
+        new = await handler.get_transport(new_creds)
+        new.release.set()
+        assert await handler.run(new_creds, "save") == "new: save"
+        await asyncio.sleep(0.01)
+        assert not old.closed
+        old.release.set()
+        assert await running == "old: list"
+        await asyncio.sleep(0.01)
+        assert old.closed and not new.closed
+        assert not handler._users and not handler._retired
+
+    asyncio.run(scenario())
+
+
+def test_unused_replaced_transport_is_closed_at_once(creds):
+    handler = RCONHandler(FakeResolver())
+
+    async def scenario():
+        old = await handler.get_transport(creds)
+        await old.connect()
+        await handler.get_transport(dict(creds, password="new"))
+        await asyncio.sleep(0.01)
+        assert old.closed
+
+    asyncio.run(scenario())
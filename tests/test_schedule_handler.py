@@ -0,0 +1,238 @@
+"""Tests of the heap-based timer of the schedule handler"""
+
+import asyncio
+import time
+from typing import Any, List, Tuple
+
+import pytest
+
+from pycon.handlers.permission_handler import PermissionHandler
+from pycon.handlers.schedule_handler import MAX_JOBS_PER_CHANNEL, ScheduleHandler
+
+CHANNEL = "100"
+
+
+class FakeRCONHandler:
+    """Record the commands instead of running them"""
+
+    def __init__(self) -> None:
+        self.runs: List[Tuple[str, Tuple[str, ...], float]] = []
+
+    async def run(self, creds: Any, command: str, *args: str) -> str:
+        self.runs.append((command, args, time.time()))
+        return ""
+
+
+@pytest.fixture(name="rcon")
+def fixture_rcon() -> FakeRCONHandler:
+    return FakeRCONHandler()
+
+
+@pytest.fixture(name="handler")
+def fixture_handler(rcon: FakeRCONHandler) -> ScheduleHandler:
+    return ScheduleHandler({CHANNEL: {"authorized": True}}, rcon, PermissionHandler({}, []), {})
+
+
+def job(job_id: int, interval: int, next_run: float, command: str = "save") -> dict:
+    return {
+        "job_id": job_id,
+        "channel_id": CHANNEL,
+        "interval": interval,
+        "command": command,
+        "args": [],
+        "next_run": next_run,
+        "author": 0,
+    }
+
+
+def run_timer(handler: ScheduleHandler, seconds: float) -> None:
+    async def scenario():
+        handler.start(lambda channel_id: None)
+        await asyncio.sleep(seconds)
+        await handler.stop()
+
+    asyncio.run(scenario())
+
+
+def test_heap_runs_due_jobs_in_order(handler, rcon):
+    now = time.time()
+    handler.load({CHANNEL: [job(1, 3600, now - 1, "c"), job(2, 3600, now - 3, "a")]})
+    handler.load({CHANNEL: [job(3, 3600, now - 2, "b"), job(4, 3600, now + 3600, "later")]})
+    run_timer(handler, 0.1)
+    assert [command for command, _, _ in rcon.runs] == ["a", "b", "c"]
+    # Every job is rescheduled by one interval from its due time
+    assert sorted(handler._heap)[:3] == [(now + 3597, 2), (now + 3598, 3), (now + 3599, 1)]
+
+
+def test_removed_jobs_are_skipped(handler, rcon):
+    now = time.time()
+    handler.load({CHANNEL: [job(1, 3600, now - 1, "removed"), job(2, 3600, now - 1, "kept")]})
+    assert handler.remove(1).command == "removed"
+    assert handler.remove(1) is None
+    # The stale entry stays in the heap until it is popped
+    assert len(handler._heap) == 2
+    run_timer(handler, 0.1)
+    assert [command for command, _, _ in rcon.runs] == ["kept"]
+    assert [job_id for _, job_id in handler._heap] == [2]
+
+
+def test_stale_heap_entries_are_compacted(handler):
+    jobs = [handler.add(CHANNEL, 60, "save", []) for _ in range(3 * MAX_JOBS_PER_CHANNEL)]
+    for scheduled in jobs[:-1]:
+        handler.remove(scheduled.job_id)
+    # Stale entries are dropped once they outnumber the live jobs
+    assert len(handler._heap) <= 2 * len(handler._jobs) + MAX_JOBS_PER_CHANNEL
+    assert len(handler._heap) < len(jobs)
+    assert (jobs[-1].next_run, jobs[-1].job_id) in handler._heap
+
+
+def test_earlier_job_wakes_the_timer(handler, rcon):
+    async def scenario():
+        handler.add(CHANNEL, 3600, "late", [])
+        handler.start(lambda channel_id: None)
+        await asyncio.sleep(0.05)
+        handler.load({CHANNEL: [job(2, 3600, time.time() + 0.05, "early")]})
+        await asyncio.sleep(0.3)
+        await handler.stop()
+
+    asyncio.run(scenario())
+    assert [command for command, _, _ in rcon.runs] == ["early"]
+
+
+def test_missed_runs_are_coalesced(handler, rcon):
+    now = time.time()
+    # Offline for a bit more than ten intervals
+    handler.load({CHANNEL: [job(1, 60, now - 605)]})
+    run_timer(handler, 0.1)
+    assert len(rcon.runs) == 1
+    next_run = handler._jobs[1].next_run
+    # The next run keeps the original cadence and lies in the future
+    assert now < next_run <= now + 60
+    assert (next_run - (now - 605)) % 60 == pytest.approx(0)
+
+
+def test_rescheduled_job_runs_once_per_interval(handler, rcon):
+    due = time.time() - 0.5
+    handler.load({CHANNEL: [job(1, 1, due)]})
+    run_timer(handler, 1.2)
+    assert len(rcon.runs) == 2
+    assert rcon.runs[1][2] == pytest.approx(due + 1, abs=0.2)
+
+
+def test_unauthorized_channel_is_skipped(rcon):
+    handler = ScheduleHandler({CHANNEL: {"authorized": False}}, rcon, PermissionHandler({}, []), {})
+    handler.load({CHANNEL: [job(1, 3600, time.time() - 1)]})
+    run_timer(handler, 0.1)
+    assert not rcon.runs
+
+
+def test_persistence_round_trip(handler):
+    scheduled = handler.add(CHANNEL, 1800, "say", ["hello", "world"], author=7)
+    restored = ScheduleHandler({}, FakeRCONHandler(), PermissionHandler({}, []), handler.to_dict())
+    assert restored._jobs == {scheduled.job_id: scheduled}
+    assert restored.add(CHANNEL, 60, "save", []).job_id == scheduled.job_id + 1
+
+
+@pytest.mark.parametrize(
+    "interval, seconds",
+    [("90s", 90), ("30m", 1800), ("12H", 43200), ("1d", 86400), ("10", None), ("m", None)],
+)
+def test_parse_interval(interval, seconds):
+    assert ScheduleHandler.parse_interval(interval) == seconds
+
+
+@pytest.mark.parametrize("seconds, interval", [(90, "90s"), (1800, "30m"), (7200, "2h")])
+def test_format_interval(seconds, interval):
+    assert ScheduleHandler.format_interval(seconds) == interval
+
+
+class FakeChannel:
+    """Channel that records sent messages"""
+
+    id = int(CHANNEL)
+    guild = None
+
+    def __init__(self) -> None:
+        self.sent: List[str] = []
+
+    async def send(self, content: str) -> None:
+        self.sent.append(content)
+
+
+@pytest.mark.parametrize("author, allowed", [(1, False), (99, True)])
+def test_stop_needs_boss(rcon, author, allowed):
+    handler = ScheduleHandler(
+        {CHANNEL: {"authorized": True}}, rcon, PermissionHandler({}, [99]), {}
+    )
+    channel = FakeChannel()
+    message = type("Message", (), {"channel": channel, "author": type("User", (), {"id": author})})
+    ctx = type("Context", (), {"args": ["add", "10s", "stop"], "message": message})
+
+    asyncio.run(handler.handle_schedule(ctx))
+    assert bool(handler._jobs) == allowed
+
+
+@pytest.mark.parametrize("author, runs", [(1, 0), (99, 1)])
+def test_stop_is_checked_at_run_time(rcon, author, runs):
+    handler = ScheduleHandler(
+        {CHANNEL: {"authorized": True}}, rcon, PermissionHandler({}, [99]), {}
+    )
+    scheduled = handler.add(CHANNEL, 60, "say", ["stopping", "soon"], author=author)
+
+    async def scenario():
+        handler.start(lambda channel_id: FakeChannel())
+        await handler._execute(scheduled)
+        await handler.stop()
+
+    asyncio.run(scenario())
+    assert len(rcon.runs) == runs
+
+
+class GuildChannel(FakeChannel):
+    """Channel of a guild"""
+
+    def __init__(self, guild: Any) -> None:
+        super().__init__()
+        self.guild = guild
+
+
+@pytest.fixture(name="role_handler")
+def fixture_role_handler(rcon: FakeRCONHandler) -> ScheduleHandler:
+    # Role 10 of guild 1 grants BOSS
+    permissions = PermissionHandler({"1": {"10": 3}}, [99])
+    return ScheduleHandler({CHANNEL: {"authorized": True}}, rcon, permissions, {})
+
+
+def test_role_granted_boss_can_schedule_and_run_stop(role_handler, rcon, guild):
+    author = guild.add_member(5, [10])
+    channel = GuildChannel(guild)
+    message = type("Message", (), {"channel": channel, "author": author})
+    ctx = type("Context", (), {"args": ["add", "10s", "stop"], "message": message})
+
+    async def scenario():
+        await role_handler.handle_schedule(ctx)
+        role_handler.start(lambda channel_id: channel)
+        # The member cache is empty, the author's roles are fetched
+        await role_handler._execute(role_handler._jobs[1])
+        await role_handler.stop()
+
+    asyncio.run(scenario())
+    assert [command for command, _, _ in rcon.runs] == ["stop"]
+
+
+@pytest.mark.parametrize("role_ids", [[11], None])
+def test_stop_of_former_boss_is_skipped_with_notice(role_handler, rcon, guild, role_ids):
+    if role_ids is not None:
+        # Lost the BOSS role, otherwise left the guild
+        guild.add_member(5, role_ids)
+    channel = GuildChannel(guild)
+    scheduled = role_handler.add(CHANNEL, 60, "stop", [], author=5)
+
+    async def scenario():
+        role_handler.start(lambda channel_id: channel)
+        await role_handler._execute(scheduled)
+        await role_handler.stop()
+
+    asyncio.run(scenario())
+    assert not rcon.runs
+    assert len(channel.sent) == 1 and "may no longer stop" in channel.sent[0]
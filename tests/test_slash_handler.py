@@ -0,0 +1,156 @@
+"""Tests of the guild allowlist and the autocomplete cache of the slash handler"""
+
+import asyncio
+import time
+from typing import Any, List, Optional, Tuple
+
+import pytest
+
+from pycon.client.client import PyconClient
+from pycon.handlers.slash_handler import AutocompleteCache, SlashHandler
+
+ALLOWED_GUILD = 1
+OTHER_GUILD = 2
+AUTH_CHANNEL = 100
+MINECRAFT = {"type": "minecraft", "authorized": True}
+PLAYER_LIST = "There are 2 of a max of 20 players online: Alex, Steve"
+
+
+class FakeResponse:
+    """Interaction response that records how the interaction was answered"""
+
+    def __init__(self) -> None:
+        self.sent: List[Tuple[str, bool]] = []
+        self.deferred = False
+
+    async def send_message(self, content: str, ephemeral: bool = False) -> None:
+        self.sent.append((content, ephemeral))
+
+    async def defer(self, thinking: bool = False) -> None:
+        self.deferred = True
+
+
+class FakeFollowup:
+    """Followup webhook that records the answers to deferred interactions"""
+
+    def __init__(self) -> None:
+        self.sent: List[str] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> None:
+        self.sent.append(content)
+
+
+class FakeInteraction:
+    """Interaction of a slash command in a channel of a guild"""
+
+    def __init__(self, guild_id: int, channel_id: int = AUTH_CHANNEL) -> None:
+        self.id = 1000
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.guild = None
+        self.channel = type("Channel", (), {"id": channel_id, "name": "server"})()
+        self.user = type("User", (), {"id": 5})()
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+@pytest.fixture(name="handled")
+def fixture_handled() -> List[Tuple[str, List[str]]]:
+    return []
+
+
+def make_handler(handled: List[Tuple[str, List[str]]], guild_ids=None) -> SlashHandler:
+    client = PyconClient("token", servers=[f"{guild_id}" for guild_id in guild_ids or ()])
+    client._PyconClient__authorized_channels[f"{AUTH_CHANNEL}"] = MINECRAFT
+
+    async def handle(ctx: Any) -> None:
+        handled.append((ctx.command, ctx.args))
+        await ctx.message.channel.send("handled")
+
+    handler = client._PyconClient__slash_handler
+    handler._handle_command = handler._handle_rcon = handle
+    return handler
+
+
+@pytest.mark.parametrize("name, option", [("rcon", "command"), ("stats", "arguments")])
+def test_other_guilds_are_rejected_before_deferring(handled, name, option):
+    command = make_handler(handled, {ALLOWED_GUILD}).tree.get_command(name)
+    interaction = FakeInteraction(OTHER_GUILD)
+    asyncio.run(command.callback(interaction, **{option: "list"}))
+    assert interaction.response.sent == [("This bot doesn't serve this server.", True)]
+    assert not interaction.response.deferred
+    assert not handled
+
+
+@pytest.mark.parametrize("guild_ids", [{ALLOWED_GUILD}, None])
+def test_allowed_guilds_are_deferred_and_handled(handled, guild_ids):
+    command = make_handler(handled, guild_ids).tree.get_command("rcon")
+    interaction = FakeInteraction(ALLOWED_GUILD)
+    asyncio.run(command.callback(interaction, command="say hi"))
+    assert interaction.response.deferred
+    assert interaction.followup.sent == ["handled"]
+    assert handled == [("say", ["hi"])]
+
+
+def test_rcon_needs_an_authorized_channel(handled):
+    command = make_handler(handled, {ALLOWED_GUILD}).tree.get_command("rcon")
+    interaction = FakeInteraction(ALLOWED_GUILD, channel_id=200)
+    asyncio.run(command.callback(interaction, command="list"))
+    assert interaction.response.sent == [("This channel is not authorized for RCON.", True)]
+    assert not handled
+
+
+@pytest.mark.parametrize("guild_id, choices", [(ALLOWED_GUILD, ["30m", "30d"]), (OTHER_GUILD, [])])
+def test_autocomplete_of_other_guilds_is_empty(handled, guild_id, choices):
+    command = make_handler(handled, {ALLOWED_GUILD}).tree.get_command("stats")
+    autocomplete = command._params["arguments"].autocomplete
+    result = asyncio.run(autocomplete(FakeInteraction(guild_id), "30"))
+    assert [choice.value for choice in result] == choices
+
+
+def test_rcon_autocomplete_suggests_players_and_recent_commands(handled):
+    handler = make_handler(handled, {ALLOWED_GUILD})
+    cache = handler._cache
+    cache.observe(AUTH_CHANNEL, MINECRAFT, "list", PLAYER_LIST)
+    cache.add_command(AUTH_CHANNEL, "kick Steve")
+    cache.add_command(AUTH_CHANNEL, "list")
+    autocomplete = handler.tree.get_command("rcon")._params["command"].autocomplete
+
+    def values(current: str) -> List[str]:
+        result = asyncio.run(autocomplete(FakeInteraction(ALLOWED_GUILD), current))
+        return [choice.value for choice in result]
+
+    assert values("") == ["list", "kick Steve"]
+    assert values("kick ") == ["kick Alex", "kick Steve"]
+    assert values("tp S") == ["tp Steve"]
+
+
+def test_recent_commands_are_unique_and_capped():
+    cache = AutocompleteCache()
+    for index in range(30):
+        cache.add_command(AUTH_CHANNEL, f"say {index}")
+    cache.add_command(AUTH_CHANNEL, "say 20")
+    recent = cache.recent(AUTH_CHANNEL)
+    assert len(recent) == 25
+    assert recent[:3] == ["say 20", "say 29", "say 28"]
+    assert recent.count("say 20") == 1
+
+
+def test_players_are_only_taken_from_player_queries():
+    cache = AutocompleteCache()
+    cache.observe(AUTH_CHANNEL, MINECRAFT, "say", PLAYER_LIST)
+    cache.observe(AUTH_CHANNEL, {"type": "rust"}, "list", PLAYER_LIST)
+    assert cache.players(AUTH_CHANNEL) == []
+    cache.observe(AUTH_CHANNEL, {"type": "ark"}, "ListPlayers", "0. Alex, 123\n1. Steve, 456")
+    assert cache.players(AUTH_CHANNEL) == ["Alex", "Steve"]
+
+
+def test_players_expire_after_the_ttl():
+    cache = AutocompleteCache(players_ttl=0.1)
+    cache.observe(AUTH_CHANNEL, MINECRAFT, "list", PLAYER_LIST)
+    assert cache.players(AUTH_CHANNEL) == ["Alex", "Steve"]
+    time.sleep(0.15)
+    assert cache.players(AUTH_CHANNEL) == []
+    # A new response of the player query makes them suggestions again
+    cache.observe(AUTH_CHANNEL, MINECRAFT, "list", PLAYER_LIST)
+    assert cache.players(AUTH_CHANNEL) == ["Alex", "Steve"]
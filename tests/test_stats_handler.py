@@ -0,0 +1,207 @@
+"""Tests of the ring buffers, the persistence and the sampling of the stats handler"""
+
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+import pytest
+
+from pycon.handlers.stats_handler import METRICS, TIERS, RingTier, StatsHandler
+
+
+def test_ring_aggregates_samples_per_slot():
+    ring = RingTier(10, 4)
+    for timestamp, value in ((0, 3.0), (5, 1.0), (9.9, 2.0), (10, 7.0)):
+        ring.add(timestamp, value)
+    assert ring.window(0) == [(0, 3, 6.0, 1.0, 3.0), (10, 1, 7.0, 7.0, 7.0)]
+
+
+def test_ring_wraparound_overwrites_oldest_slots():
+    ring = RingTier(10, 4)
+    for timestamp in range(0, 80, 5):
+        ring.add(timestamp, timestamp)
+    # Only the last capacity slots survive, each reset when it was reused
+    assert ring.window(0) == [
+        (40, 2, 85.0, 40.0, 45.0),
+        (50, 2, 105.0, 50.0, 55.0),
+        (60, 2, 125.0, 60.0, 65.0),
+        (70, 2, 145.0, 70.0, 75.0),
+    ]
+    assert [slot[0] for slot in ring.window(60)] == [60, 70]
+    assert len(ring.slots) == ring.capacity
+
+
+def test_ring_wraparound_after_gap():
+    ring = RingTier(10, 4)
+    ring.add(0, 1.0)
+    ring.add(15, 2.0)
+    # Lands on the position of slot 0 after a gap of several rounds
+    ring.add(160, 3.0)
+    assert ring.window(0) == [(10, 1, 2.0, 2.0, 2.0), (160, 1, 3.0, 3.0, 3.0)]
+
+
+def test_ring_bytes_round_trip():
+    ring = RingTier(60, 8)
+    for timestamp in range(0, 1200, 45):
+        ring.add(timestamp, timestamp / 7)
+    loaded = RingTier(60, 8)
+    data = ring.to_bytes()
+    assert loaded.load_bytes(memoryview(data + b"next ring")) == len(data)
+    assert loaded.window(0) == ring.window(0)
+
+
+@pytest.mark.parametrize("missing", [1, 8, 48])
+def test_ring_rejects_truncated_bytes(missing):
+    ring = RingTier(60, 8)
+    ring.add(0, 1.0)
+    loaded = RingTier(60, 8)
+    loaded.add(120, 5.0)
+    with pytest.raises(ValueError):
+        loaded.load_bytes(memoryview(ring.to_bytes()[:-missing]))
+    # Nothing was changed or shrunk
+    assert len(loaded.slots) == len(loaded.maximums) == loaded.capacity
+    assert loaded.window(0) == [(120, 1, 5.0, 5.0, 5.0)]
+
+
+def make_handler(*channel_ids: int) -> StatsHandler:
+    return StatsHandler(
+        {f"{channel_id}": {"authorized": True} for channel_id in channel_ids}, rcon_handler=None
+    )
+
+
+def fill(handler: StatsHandler, channel_id: int, now: float) -> None:
+    for minute in range(30):
+        timestamp = now - minute * 60
+        handler.add_sample(channel_id, "players", minute % 5, timestamp)
+        handler.add_sample(channel_id, "rtt", 20.0 + minute, timestamp)
+        handler.add_sample(channel_id, "up", 1.0, timestamp)
+
+
+def windows(handler: StatsHandler, channel_id: int):
+    series = handler._series[channel_id]
+    return {metric: series[metric].window(3600) for metric in METRICS}
+
+
+def test_stats_round_trip_skips_unauthorized_channels():
+    now = time.time()
+    handler = make_handler(1, 2)
+    for channel_id in (1, 2, 3):
+        fill(handler, channel_id, now)
+    loaded = make_handler()
+    loaded.load(handler.to_bytes())
+    assert set(loaded._series) == {1, 2}
+    assert windows(loaded, 1) == windows(handler, 1)
+    assert windows(loaded, 2) == windows(handler, 2)
+
+
+@pytest.mark.parametrize("missing", [1, 8, 1000])
+def test_stats_load_truncated_file(missing):
+    now = time.time()
+    handler = make_handler(1, 2)
+    fill(handler, 1, now)
+    fill(handler, 2, now)
+    loaded = make_handler()
+    loaded.load(handler.to_bytes()[:-missing])
+    # The complete channel is kept, the cut off one is dropped instead of loaded with short rings
+    assert set(loaded._series) == {1}
+    assert windows(loaded, 1) == windows(handler, 1)
+    for series in loaded._series[1].values():
+        for tier, (_, capacity) in zip(series.tiers, TIERS):
+            assert len(tier.slots) == len(tier.counts) == len(tier.sums) == capacity
+
+
+@pytest.mark.parametrize("data", [b"", b"PYST", b"XXXX" + bytes(100)])
+def test_stats_load_ignores_foreign_data(data):
+    handler = make_handler()
+    handler.load(data)
+    assert not handler._series
+
+
+def test_stats_load_incompatible_tiers():
+    handler = make_handler(1)
+    handler.add_sample(1, "up", 1.0, 0)
+    data = bytearray(handler.to_bytes())
+    # First tier resolution in the header
+    data[10] += 1
+    loaded = make_handler()
+    loaded.load(bytes(data))
+    assert not loaded._series
+
+
+class FakeRCONHandler:
+    """Record the commands and connection checks of the samples"""
+
+    def __init__(self, connected: bool = False, error: Optional[Exception] = None) -> None:
+        self.connected = connected
+        self.error = error
+        self.calls: List[Tuple[str, str]] = []
+
+    async def run(
+        self, creds: dict, command: str, *args: str, timeout: Optional[float] = None
+    ) -> str:
+        self.calls.append(("run", command))
+        if self.error is not None:
+            raise self.error
+        return "There are 3 of a max of 20 players online: Alex, Steve, Sam"
+
+    async def check(self, creds: dict, timeout: Optional[float] = None) -> bool:
+        self.calls.append(("check", ""))
+        if self.error is not None:
+            raise self.error
+        await asyncio.sleep(0.01)
+        return not self.connected
+
+
+def sample(
+    rcon: FakeRCONHandler, server_type: str, responses: Optional[list] = None
+) -> StatsHandler:
+    creds = {"authorized": True, "type": server_type}
+
+    def on_response(*args) -> None:
+        responses.append(args[2:])
+
+    handler = StatsHandler(
+        {"1": creds}, rcon, on_response=on_response if responses is not None else None
+    )
+    asyncio.run(handler.sample("1", creds))
+    return handler
+
+
+def counts(handler: StatsHandler) -> dict:
+    return {
+        metric: sum(slot[1] for slot in series.window(60)[1])
+        for metric, series in handler._series[1].items()
+    }
+
+
+def test_player_query_samples_all_metrics():
+    rcon = FakeRCONHandler()
+    responses = []
+    handler = sample(rcon, "Minecraft", responses)
+    assert rcon.calls == [("run", "list")]
+    assert counts(handler) == {"players": 1, "rtt": 1, "up": 1}
+    assert handler._series[1]["players"].window(60)[1][0][2] == 3
+    assert [command for command, _ in responses] == ["list"]
+
+
+def test_unknown_types_are_only_connected_to():
+    rcon = FakeRCONHandler()
+    responses = []
+    handler = sample(rcon, "rust", responses)
+    # No empty command is sent, and there is nothing to count players from
+    assert rcon.calls == [("check", "")]
+    assert counts(handler) == {"players": 0, "rtt": 1, "up": 1}
+    assert handler._series[1]["rtt"].window(60)[1][0][2] >= 10
+    assert not responses
+
+
+def test_open_connections_count_as_up_without_round_trip():
+    handler = sample(FakeRCONHandler(connected=True), "rust")
+    assert counts(handler) == {"players": 0, "rtt": 0, "up": 1}
+
+
+@pytest.mark.parametrize("server_type", ["rust", "ark"])
+def test_failed_samples_are_down(server_type):
+    handler = sample(FakeRCONHandler(error=ConnectionRefusedError("refused")), server_type)
+    assert counts(handler) == {"players": 0, "rtt": 0, "up": 1}
+    assert handler._series[1]["up"].window(60)[1][0][2] == 0.0
@@ -0,0 +1,257 @@
+"""Tests of the Source and BattlEye RCON transports against local fake servers"""
+
+import asyncio
+import struct
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+import pytest
+
+from pycon.handlers.transport_handler import (
+    BATTLEYE_COMMAND,
+    BATTLEYE_LOGIN,
+    BATTLEYE_SERVER_MESSAGE,
+    SOURCE_AUTH,
+    SOURCE_AUTH_RESPONSE,
+    SOURCE_EXEC_COMMAND,
+    SOURCE_RESPONSE_VALUE,
+    AuthenticationError,
+    BattlEyeTransport,
+    SourceTransport,
+)
+
+PASSWORD = "secret"
+SOURCE_PACKET_SIZE = 4096
+
+
+def source_packet(request_id: int, packet_type: int, body: bytes) -> bytes:
+    payload = struct.pack("<ii", request_id, packet_type) + body + b"\0\0"
+    return struct.pack("<i", len(payload)) + payload
+
+
+class FakeSourceServer:
+    """Source RCON server that answers commands with ``responses[command]``.
+
+    Responses are split into packets of SOURCE_PACKET_SIZE bytes. The empty request that marks
+    the end of a split response is answered like Minecraft and Valve servers do: with an empty
+    response value and a trailing packet with the body 0x00 0x01 0x00 0x00.
+    """
+
+    def __init__(self, responses: dict, valve_auth: bool = False) -> None:
+        self.responses = responses
+        self.valve_auth = valve_auth
+        self.commands: List[str] = []
+        self.port = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def __aenter__(self) -> "FakeSourceServer":
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._server.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                size = struct.unpack("<i", await reader.readexactly(4))[0]
+                packet = await reader.readexactly(size)
+                request_id, request_type = struct.unpack_from("<ii", packet)
+                body = packet[8:-2]
+                if request_type == SOURCE_AUTH:
+                    if self.valve_auth:
+                        writer.write(source_packet(request_id, SOURCE_RESPONSE_VALUE, b""))
+                    accepted = body.decode() == PASSWORD
+                    writer.write(
+                        source_packet(request_id if accepted else -1, SOURCE_AUTH_RESPONSE, b"")
+                    )
+                elif request_type == SOURCE_EXEC_COMMAND:
+                    command = body.decode()
+                    self.commands.append(command)
+                    if command == "close":
+                        writer.close()
+                        return
+                    response = self.responses.get(command, b"")
+                    for offset in range(0, max(len(response), 1), SOURCE_PACKET_SIZE):
+                        chunk = response[offset : offset + SOURCE_PACKET_SIZE]
+                        writer.write(source_packet(request_id, SOURCE_RESPONSE_VALUE, chunk))
+                else:
+                    writer.write(source_packet(request_id, SOURCE_RESPONSE_VALUE, b""))
+                    writer.write(
+                        source_packet(request_id, SOURCE_RESPONSE_VALUE, b"\x00\x01\x00\x00")
+                    )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+
+def run(coroutine_function: Callable) -> None:
+    asyncio.run(coroutine_function())
+
+
+def test_source_single_packet():
+    async def scenario():
+        async with FakeSourceServer({"list": b"There are 0 players"}) as server:
+            transport = SourceTransport("127.0.0.1", server.port, PASSWORD)
+            assert await transport.run("list") == "There are 0 players"
+            assert await transport.run("unknown") == ""
+            await transport.close()
+
+    run(scenario)
+
+
+@pytest.mark.parametrize("size", [4000, 4096, 4097, 3 * 4096 + 100])
+def test_source_multi_packet_reassembly(size):
+    big = bytes(ord("a") + index % 26 for index in range(size))
+
+    async def scenario():
+        async with FakeSourceServer({"big": big, "small": b"ok"}) as server:
+            transport = SourceTransport("127.0.0.1", server.port, PASSWORD)
+            assert await transport.run("big") == big.decode()
+            # The trailing packet of the terminator must not be taken as the next response
+            assert await transport.run("small") == "ok"
+            assert await transport.run("big") == big.decode()
+            assert server.commands == ["big", "small", "big"]
+            await transport.close()
+
+    run(scenario)
+
+
+def test_source_valve_auth_reuses_connection():
+    async def scenario():
+        async with FakeSourceServer({"status": b"hostname: test"}, valve_auth=True) as server:
+            transport = SourceTransport("127.0.0.1", server.port, PASSWORD)
+            assert await transport.connect()
+            assert transport.connected
+            # Already logged in
+            assert not await transport.connect()
+            assert await transport.run("status") == "hostname: test"
+            await transport.close()
+            assert not transport.connected
+
+    run(scenario)
+
+
+def test_source_wrong_password():
+    async def scenario():
+        async with FakeSourceServer({}) as server:
+            transport = SourceTransport("127.0.0.1", server.port, "wrong")
+            with pytest.raises(AuthenticationError):
+                await transport.run("list")
+            assert not transport.connected
+
+    run(scenario)
+
+
+def test_source_connection_closed_by_server():
+    async def scenario():
+        async with FakeSourceServer({"list": b"players"}) as server:
+            transport = SourceTransport("127.0.0.1", server.port, PASSWORD)
+            with pytest.raises(ConnectionResetError):
+                await transport.run("close")
+            assert not transport.connected
+            # The next command opens a new connection
+            assert await transport.run("list") == "players"
+            await transport.close()
+
+    run(scenario)
+
+
+def battleye_packet(payload: bytes) -> bytes:
+    body = b"\xff" + payload
+    return b"BE" + struct.pack("<I", zlib.crc32(body)) + body
+
+
+class FakeBattlEyeServer(asyncio.DatagramProtocol):
+    """BattlEye RCon server whose answers to commands are produced by ``answer``"""
+
+    def __init__(self, answer: Callable[[int, bytes], List[bytes]]) -> None:
+        self.answer = answer
+        self.received: List[bytes] = []
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        assert data[:2] == b"BE" and struct.unpack_from("<I", data, 2)[0] == zlib.crc32(data[6:])
+        payload = data[7:]
+        self.received.append(payload)
+        if payload[0] == BATTLEYE_LOGIN:
+            accepted = payload[1:].decode() == PASSWORD
+            self.transport.sendto(battleye_packet(bytes([BATTLEYE_LOGIN, int(accepted)])), addr)
+        elif payload[0] == BATTLEYE_COMMAND:
+            for packet in self.answer(payload[1], payload[2:]):
+                self.transport.sendto(packet, addr)
+
+
+async def start_battleye(answer: Callable[[int, bytes], List[bytes]]) -> FakeBattlEyeServer:
+    _, server = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: FakeBattlEyeServer(answer), local_addr=("127.0.0.1", 0)
+    )
+    return server
+
+
+def test_battleye_single_response():
+    def answer(sequence: int, command: bytes) -> List[bytes]:
+        return [battleye_packet(bytes([BATTLEYE_COMMAND, sequence]) + b"echo " + command)]
+
+    async def scenario():
+        server = await start_battleye(answer)
+        port = server.transport.get_extra_info("sockname")[1]
+        transport = BattlEyeTransport("127.0.0.1", port, PASSWORD)
+        assert await transport.run("players") == "echo players"
+        assert await transport.run("bans") == "echo bans"
+        assert [payload[1] for payload in server.received[1:]] == [0, 1]
+        await transport.close()
+        server.transport.close()
+
+    run(scenario)
+
+
+def test_battleye_multipart_with_server_messages_and_noise():
+    parts = [b"first ", b"second ", b"third"]
+
+    def answer(sequence: int, command: bytes) -> List[bytes]:
+        def part(index: int) -> bytes:
+            header = bytes([BATTLEYE_COMMAND, sequence, 0x00, len(parts), index])
+            return battleye_packet(header + parts[index])
+
+        corrupted = bytearray(part(0))
+        corrupted[-1] ^= 0xFF
+        return [
+            # Answer to an older command with the same type
+            battleye_packet(bytes([BATTLEYE_COMMAND, (sequence - 1) % 256]) + b"stale"),
+            part(2),
+            battleye_packet(bytes([BATTLEYE_SERVER_MESSAGE, 7]) + b"Player connected"),
+            bytes(corrupted),
+            part(0),
+            b"garbage",
+            part(1),
+        ]
+
+    async def scenario():
+        server = await start_battleye(answer)
+        port = server.transport.get_extra_info("sockname")[1]
+        transport = BattlEyeTransport("127.0.0.1", port, PASSWORD)
+        assert await transport.run("missions") == "first second third"
+        # The server message was acknowledged with its sequence number
+        assert bytes([BATTLEYE_SERVER_MESSAGE, 7]) in server.received
+        await transport.close()
+        server.transport.close()
+
+    run(scenario)
+
+
+def test_battleye_wrong_password():
+    async def scenario():
+        server = await start_battleye(lambda sequence, command: [])
+        port = server.transport.get_extra_info("sockname")[1]
+        transport = BattlEyeTransport("127.0.0.1", port, "wrong")
+        with pytest.raises(AuthenticationError):
+            await transport.run("players")
+        assert not transport.connected
+        server.transport.close()
+
+    run(scenario)